@@ -2,50 +2,61 @@ import base64
 import hashlib
 import json
 import os
-import random
 import requests
+import secrets
 import string
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
 from backend.logger import setup_logger
 
 logger = setup_logger("spotify_auth")
 
+SPOTIFY_ACCOUNTS_URL = "https://accounts.spotify.com"
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+
 class SpotifyAuth:
-    def __init__(self, client_id: str, redirect_uri: str):
+    def __init__(self, client_id: str, redirect_uri: str,
+                 accounts_url: str = SPOTIFY_ACCOUNTS_URL, api_url: str = SPOTIFY_API_URL,
+                 timeout: float = 10.0):
         self.client_id = client_id
         self.redirect_uri = redirect_uri
-        self.code_verifier = self._generate_code_verifier()
-        self.code_challenge = self._generate_code_challenge()
-        
-    def _generate_code_verifier(self) -> str:
-        """Generate a random code verifier for PKCE"""
-        code_verifier = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(64))
-        return code_verifier
+        self.accounts_url = accounts_url.rstrip("/")
+        self.api_url = api_url.rstrip("/")
+        # Seconds to connect and to wait for each read, so a stalled accounts service cannot hang a refresh
+        self.timeout = timeout
         
-    def _generate_code_challenge(self) -> str:
-        """Generate the code challenge from the code verifier using SHA256"""
-        code_challenge = hashlib.sha256(self.code_verifier.encode('utf-8')).digest()
+    @staticmethod
+    def create_pkce_pair() -> Tuple[str, str]:
+        """
+        Generate a PKCE code verifier and its S256 code challenge. Each login
+        gets its own pair; the verifier is kept in that user's session.
+        """
+        code_verifier = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(64))
+        code_challenge = hashlib.sha256(code_verifier.encode('utf-8')).digest()
         code_challenge = base64.urlsafe_b64encode(code_challenge).decode('utf-8')
         code_challenge = code_challenge.replace('=', '')
-        return code_challenge
+        return code_verifier, code_challenge
     
-    def get_auth_url(self) -> str:
-        """Generate the Spotify authorization URL"""
+    def get_auth_url(self, code_challenge: str, state: Optional[str] = None) -> str:
+        """Generate the Spotify authorization URL for one login attempt"""
         scope = "user-read-private user-read-email user-top-read"
         
-        auth_url = "https://accounts.spotify.com/authorize?" + \
+        auth_url = f"{self.accounts_url}/authorize?" + \
                    "client_id=" + self.client_id + \
                    "&response_type=code" + \
                    "&redirect_uri=" + self.redirect_uri + \
                    "&code_challenge_method=S256" + \
-                   "&code_challenge=" + self.code_challenge + \
+                   "&code_challenge=" + code_challenge + \
                    "&scope=" + scope
+        if state:
+            auth_url += "&state=" + state
         
         return auth_url
     
-    def get_tokens(self, authorization_code: str) -> Dict:
+    def get_tokens(self, authorization_code: str, code_verifier: str) -> Dict:
         """Exchange authorization code for access and refresh tokens"""
-        token_url = "https://accounts.spotify.com/api/token"
+        token_url = f"{self.accounts_url}/api/token"
         
         headers = {
             "Content-Type": "application/x-www-form-urlencoded"
@@ -56,10 +67,10 @@ class SpotifyAuth:
             "grant_type": "authorization_code",
             "code": authorization_code,
             "redirect_uri": self.redirect_uri,
-            "code_verifier": self.code_verifier
+            "code_verifier": code_verifier
         }
         
-        response = requests.post(token_url, headers=headers, data=data)
+        response = requests.post(token_url, headers=headers, data=data, timeout=self.timeout)
         
         if response.status_code == 200:
             return response.json()
@@ -70,7 +81,7 @@ class SpotifyAuth:
     
     def refresh_token(self, refresh_token: str) -> Dict:
         """Refresh the access token using the refresh token"""
-        token_url = "https://accounts.spotify.com/api/token"
+        token_url = f"{self.accounts_url}/api/token"
         
         headers = {
             "Content-Type": "application/x-www-form-urlencoded"
@@ -82,7 +93,7 @@ class SpotifyAuth:
             "refresh_token": refresh_token
         }
         
-        response = requests.post(token_url, headers=headers, data=data)
+        response = requests.post(token_url, headers=headers, data=data, timeout=self.timeout)
         
         if response.status_code == 200:
             return response.json()
@@ -93,17 +104,79 @@ class SpotifyAuth:
     
     def get_user_profile(self, access_token: str) -> Dict:
         """Get the user's Spotify profile"""
-        url = "https://api.spotify.com/v1/me"
+        url = f"{self.api_url}/me"
         
         headers = {
             "Authorization": f"Bearer {access_token}"
         }
         
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=self.timeout)
         
         if response.status_code == 200:
             return response.json()
         else:
             logger.error(f"Error getting user profile: {response.status_code}")
             logger.debug(response.text)
-            return {"error": "Failed to get user profile"} 
\ No newline at end of file
+            return {"error": "Failed to get user profile"} 
+
+def load_session_secret(secret: Optional[str], path: Optional[str]) -> str:
+    """
+    Key for signing session cookies. Every worker process must use the same
+    key, and it must survive restarts, or sessions signed by one process are
+    rejected by the others. Uses `secret` if given; otherwise reads the key
+    from `path`, creating it there on first use (safe when several workers
+    start at once). Without either, sessions only live as long as the process.
+    """
+    if secret:
+        return secret
+    if not path:
+        logger.warning("No SESSION_SECRET configured; sessions will not survive a restart or work across workers")
+        return secrets.token_hex(32)
+    
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a private temporary file, then link it into place: the link
+        # fails if another worker got there first, and nobody reads a partial key
+        temporary = f"{path}.{os.getpid()}"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(temporary, path)
+            logger.info(f"Created session secret in {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temporary)
+        with open(path) as f:
+            return f.read().strip()
+    except OSError as e:
+        logger.warning(f"Could not store a session secret in {path} ({e}); sessions will not survive a restart")
+        return secrets.token_hex(32)
+
+
+class LazySessionMiddleware:
+    """
+    SessionMiddleware whose signing key is read from app.state.session_secret
+    on the first request, so it can be loaded at startup rather than at import
+    """
+    def __init__(self, app: ASGIApp, **options):
+        self.app = app
+        self.options = options
+        self._sessions: Optional[SessionMiddleware] = None
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if self._sessions is None:
+            self._sessions = SessionMiddleware(self.app, secret_key=scope["app"].state.session_secret, **self.options)
+        await self._sessions(scope, receive, send)
@@ -0,0 +1,264 @@
+"""
+Offline mood analysis over a dataset of logged conversations.
+
+Reads JSONL records of the form
+
+    {"id": "abc", "history": [{"role": "user", "content": "..."}, ...], "message": "..."}
+
+(`id` defaults to the line number), runs the same mood analysis the chat
+routes use with bounded concurrency across one or more Ollama endpoints, and
+appends one JSON result per record to the output file as it completes. The
+output doubles as the checkpoint: with --resume, records already analysed
+(status ok or parse_failure) are skipped, and rows with status error are
+dropped from it so those records are retried. A summary with throughput,
+parse-failure rate, latency and the mood/genre label distribution is printed
+at the end.
+
+    python -m backend.batch_analysis conversations.jsonl -o results.jsonl \\
+        --endpoints http://gpu1:11434,http://gpu2:11434 --concurrency 8
+    python -m backend.batch_analysis conversations.jsonl -o results.jsonl --resume
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import aclosing
+from typing import Dict, Iterator, Optional, Set, TextIO, Tuple
+
+import numpy as np
+
+from backend.config import Settings
+from backend.intent_classifier import IntentClassifier
+from backend.llm_manager import AsyncLLMManager
+from backend.logger import configure_logging, setup_logger, shutdown_logging
+
+logger = setup_logger("batch_analysis")
+
+# Statuses a resumed run does not redo; errors (Ollama unreachable) are retried
+DONE_STATUSES = ("ok", "parse_failure")
+
+def read_records(path: str, skip: Set[str]) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yield (id, record) for each valid line not in skip, without loading the file
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping line {line_number}: {e}")
+                continue
+            record_id = str(record.get("id", line_number))
+            if record_id in skip:
+                continue
+            yield record_id, record
+
+def load_checkpoint(path: str) -> Set[str]:
+    """
+    Ids already analysed in an earlier output file. The file is rewritten
+    without error rows and broken lines, so each id appears in it once
+    after the records to retry are appended.
+    """
+    done = set()
+    kept = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    record_id, status = str(row["id"]), row["status"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # A line cut short by an interrupted run; that record is redone
+                    continue
+                if status in DONE_STATUSES and record_id not in done:
+                    done.add(record_id)
+                    kept.append(line if line.endswith("\n") else line + "\n")
+    except FileNotFoundError:
+        return done
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.writelines(kept)
+    os.replace(temporary, path)
+    return done
+
+class BatchStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statuses: Counter = Counter()
+        self.moods: Counter = Counter()
+        self.genres: Counter = Counter()
+        self.wants_recommendations = 0
+        self.latencies = []
+
+    def add(self, status: str, result: Dict, latency: float):
+        self.statuses[status] += 1
+        self.latencies.append(latency)
+        if status == "ok":
+            self.moods[result.get("mood", "")] += 1
+            self.genres.update(result.get("genres", []))
+            self.wants_recommendations += bool(result.get("wants_recommendations"))
+
+    @property
+    def processed(self) -> int:
+        return sum(self.statuses.values())
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        processed = self.processed
+        ok = self.statuses["ok"]
+        latencies = np.asarray(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "processed": processed,
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+            "statuses": dict(self.statuses),
+            "parse_failure_rate": round(self.statuses["parse_failure"] / processed, 4) if processed else 0.0,
+            "error_rate": round(self.statuses["error"] / processed, 4) if processed else 0.0,
+            "latency_ms": {
+                f"p{q}": round(float(np.percentile(latencies, q)), 1) for q in (50, 95, 99)
+            },
+            "wants_recommendations_ratio": round(self.wants_recommendations / ok, 4) if ok else 0.0,
+            "moods": dict(self.moods.most_common()),
+            "genres": dict(self.genres.most_common())
+        }
+
+async def analyze(llm_manager: AsyncLLMManager, record: Dict) -> Tuple[str, Dict]:
+    """
+    Run one mood analysis and classify how it ended: "ok", "parse_failure"
+    (the model answered but its output could not be parsed) or "error"
+    (Ollama could not be reached or failed)
+    """
+    final = None
+    async with aclosing(llm_manager.stream_conversation_mood(record.get("history") or [],
+                                                             record.get("message", ""))) as events:
+        async for event in events:
+            if event["event"] == "analysis":
+                final = event
+    result = final["result"] if final else llm_manager._fallback_mood_analysis()
+    if final is not None and result != llm_manager._fallback_mood_analysis():
+        return "ok", result
+    # Only a completed generation reports prompt token counts
+    return ("parse_failure" if final is not None and "prompt_tokens" in final else "error"), result
+
+async def run_batch(llm_manager: AsyncLLMManager, input_path: str, output: TextIO, concurrency: int,
+                    skip: Set[str], progress_interval: float = 10.0, limit: Optional[int] = None) -> BatchStats:
+    stats = BatchStats()
+    # Bounded, so reading the input never runs far ahead of the workers
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            record_id, record = item
+            started = time.perf_counter()
+            try:
+                status, result = await analyze(llm_manager, record)
+            except Exception as e:
+                logger.error(f"Record {record_id} failed: {e}")
+                status, result = "error", {}
+            latency = time.perf_counter() - started
+            stats.add(status, result, latency)
+            output.write(json.dumps({
+                "id": record_id, "status": status, "result": result, "latency_ms": round(latency * 1000, 1)
+            }, ensure_ascii=False) + "\n")
+            output.flush()
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(progress_interval)
+            summary = stats.summary()
+            print(f"{summary['processed']} done, {summary['throughput_per_second']}/s, "
+                  f"statuses {summary['statuses']}", file=sys.stderr)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    reporter = asyncio.create_task(report_progress())
+    try:
+        for count, item in enumerate(read_records(input_path, skip)):
+            if limit is not None and count >= limit:
+                break
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        reporter.cancel()
+        for task in workers:
+            task.cancel()
+    return stats
+
+async def main_async(args) -> Dict:
+    settings = Settings.from_env()
+    endpoints = [url.strip() for url in args.endpoints.split(",") if url.strip()] if args.endpoints \
+        else settings.ollama_endpoints
+    llm_manager = AsyncLLMManager(
+        base_url=None if endpoints else settings.ollama_base_url,
+        model=args.model or settings.ollama_model,
+        endpoints=endpoints or None,
+        hedge=args.hedge,
+        read_timeout=settings.ollama_read_timeout,
+        # Enough connections for every worker plus health checks
+        max_connections=max(32, args.concurrency * 2),
+        max_keepalive_connections=max(16, args.concurrency),
+        intent_classifier=IntentClassifier() if args.fast_path else None
+    )
+    await llm_manager.start()
+    await llm_manager.wait_started()
+    concurrency = args.concurrency or 2 * len(llm_manager.pool)
+    skip = load_checkpoint(args.output) if args.resume else set()
+    if skip:
+        logger.info(f"Resuming: {len(skip)} records already done")
+
+    try:
+        with open(args.output, "a" if args.resume else "w", encoding="utf-8") as output:
+            stats = await run_batch(llm_manager, args.input, output, concurrency, skip,
+                                    args.progress_interval, args.limit)
+    finally:
+        await llm_manager.aclose()
+
+    summary = stats.summary()
+    # Across resumed runs: skipped + this run's done records = records in the output that need no retry
+    summary["skipped"] = len(skip)
+    summary["done_total"] = len(skip) + sum(stats.statuses[status] for status in DONE_STATUSES)
+    summary["concurrency"] = concurrency
+    summary["endpoints"] = llm_manager.pool.stats()
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of {id, history, message} records")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append results to")
+    parser.add_argument("--endpoints", help="comma-separated Ollama URLs (default: OLLAMA_ENDPOINTS or discovery)")
+    parser.add_argument("--model", help="model name (default: OLLAMA_MODEL)")
+    parser.add_argument("--concurrency", type=int, default=0, help="analyses in flight (default: 2 per endpoint)")
+    parser.add_argument("--resume", action="store_true", help="skip records already analysed in the output file; retry errors")
+    parser.add_argument("--limit", type=int, help="stop after this many records")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="let the local intent classifier answer easy messages, as the app does")
+    parser.add_argument("--hedge", action="store_true",
+                        help="duplicate slow requests to a second endpoint")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--summary", help="also write the summary JSON here")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    configure_logging(level=args.log_level, log_dir="")
+    try:
+        summary = asyncio.run(main_async(args))
+    finally:
+        shutdown_logging()
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
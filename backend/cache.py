@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from backend.logger import setup_logger
+
+logger = setup_logger("cache")
+
+class TTLCache:
+    """
+    Bounded in-process cache with per-entry TTL, LRU eviction and
+    stale-while-revalidate.
+
+    Entries younger than `ttl` are served as fresh. Entries younger than
+    `ttl + stale_ttl` are served immediately while a background task reloads
+    them. Older entries are treated as misses. Loaders that raise are not cached.
+
+    Loads are single-flight: concurrent misses for the same key share one
+    in-flight loader call instead of each calling upstream.
+
+    With a `shared` backend (see backend.shared_cache), local misses are looked
+    up there under `namespace` before loading, and loaded values are written
+    to it, so other worker processes can use them. `serialize` and
+    `deserialize` convert values to and from JSON documents.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, stale_ttl: float = 0.0,
+                 shared=None, namespace: str = "", serialize: Optional[Callable[[Any], Any]] = None,
+                 deserialize: Optional[Callable[[Any], Any]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        self.namespace = namespace
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return a fresh or stale value without loading, or None
+        """
+        entry = self._entries.get(key) or self._get_shared(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if time.monotonic() - stored_at >= self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._set_local(key, value, time.monotonic())
+        if self.shared is not None:
+            stored = self.serialize(value) if self.serialize else value
+            self.shared.set(self.namespace, key, stored, self.ttl + self.stale_ttl)
+
+    def _set_local(self, key: Hashable, value: Any, stored_at: float):
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Copy an entry another process stored into the local tier, keeping its age
+        """
+        if self.shared is None:
+            return None
+        found = self.shared.get(self.namespace, key)
+        if found is None:
+            return None
+        stored, stored_at = found
+        value = self.deserialize(stored) if self.deserialize else stored
+        entry = (value, time.monotonic() - max(0.0, time.time() - stored_at))
+        self._set_local(key, *entry)
+        self.shared_hits += 1
+        return entry
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self.namespace, key)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for key, calling loader() on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is None and key not in self._inflight:
+            entry = self._get_shared(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._schedule_refresh(key, loader)
+                return value
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._start_load(key, loader)
+        else:
+            self.coalesced += 1
+        # Shield the shared load so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, loader))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish_load(key, done))
+        return task
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await loader()
+        self.set(key, value)
+        return value
+
+    def _finish_load(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Cache load failed for {key!r}: {task.exception()}")
+
+    def _schedule_refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        # Keep serving the stale value; a failed refresh is retried on the next stale hit
+        if key not in self._inflight:
+            self._start_load(key, loader)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "inflight": len(self._inflight)
+        }
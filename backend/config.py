@@ -0,0 +1,129 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional
+
+from backend.auth import SPOTIFY_ACCOUNTS_URL, SPOTIFY_API_URL
+from backend.deadline import DEFAULT_BUDGETS
+from backend.llm_manager import DEFAULT_MODEL
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Application configuration, read once from the environment at startup
+    """
+    spotify_client_id: str = "5c2bfce5570a46c394675a810b5cb895"
+    spotify_redirect_uri: str = "http://localhost:8888/callback"
+    # Overridable so the app can run against local stand-ins (see benchmarks/)
+    spotify_accounts_url: str = SPOTIFY_ACCOUNTS_URL
+    spotify_api_url: str = SPOTIFY_API_URL
+
+    # Ollama nodes serving the model; without any, OLLAMA_BASE_URL or
+    # (discovered in the background) localhost or the Docker service is used
+    ollama_base_url: Optional[str] = None
+    ollama_endpoints: List[str] = field(default_factory=list)
+    ollama_model: str = DEFAULT_MODEL
+    # Duplicate generations slower than their node's p95 onto a second node (OLLAMA_HEDGE=1)
+    ollama_hedge: bool = False
+    ollama_read_timeout: float = 120.0
+    ollama_max_concurrency: Optional[int] = None
+    ollama_max_queue: int = 32
+    ollama_max_queue_per_user: int = 2
+    ollama_health_interval: float = 10.0
+    # Load the model on idle Ollama nodes when a user logs in
+    ollama_warmup: bool = True
+    ollama_keep_alive: Optional[str] = None
+    intent_fast_path: bool = True
+
+    # Mood analyses shared across users; size 0 disables the cache and
+    # similarity 0 disables near-duplicate lookup
+    mood_cache_size: int = 1024
+    mood_cache_ttl: float = 3600.0
+    mood_cache_similarity: float = 0.9
+    mood_cache_context_messages: int = 2
+
+    # Worker processes uvicorn runs (it reads WEB_CONCURRENCY as its --workers
+    # default). More than one needs the shared backends below.
+    workers: int = 1
+    # Signs session cookies; without it a key is created in session_secret_path
+    session_secret: Optional[str] = field(default=None, repr=False)
+    session_secret_path: str = "data/session_secret"
+
+    conversation_backend: str = "memory"
+    conversation_db_path: str = "data/conversations.db"
+    conversation_max_turns: int = 20
+    conversation_max_users: int = 10000
+    conversation_idle_ttl: float = 6 * 3600
+    conversation_max_bytes: int = 64 * 1024 * 1024
+
+    # Spotify responses, taste profiles and mood analyses: "memory" keeps
+    # them per process, "sqlite" also shares them between workers on a host
+    cache_backend: str = "memory"
+    cache_db_path: str = "data/cache.db"
+
+    # Deadline of a chat request and the most each stage may use of it
+    request_timeout: float = 120.0
+    stage_budgets: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_BUDGETS))
+
+    # Top artists/tracks fetched at login, reused by recommendations
+    taste_profile_ttl: float = 6 * 3600
+
+    @property
+    def max_concurrency(self) -> int:
+        """
+        Concurrent generations: explicit, or two per Ollama node
+        """
+        if self.ollama_max_concurrency:
+            return self.ollama_max_concurrency
+        return 2 * max(1, len(self.ollama_endpoints))
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "Settings":
+        defaults = cls()
+
+        def get(name, default):
+            return environ.get(name, default)
+
+        def flag(name, default: bool) -> bool:
+            return get(name, "1" if default else "0") == "1"
+
+        return cls(
+            spotify_client_id=get("SPOTIFY_CLIENT_ID", defaults.spotify_client_id),
+            spotify_redirect_uri=get("SPOTIFY_REDIRECT_URI", defaults.spotify_redirect_uri),
+            spotify_accounts_url=get("SPOTIFY_ACCOUNTS_URL", defaults.spotify_accounts_url),
+            spotify_api_url=get("SPOTIFY_API_URL", defaults.spotify_api_url),
+            ollama_base_url=get("OLLAMA_BASE_URL", None) or None,
+            ollama_endpoints=[url.strip() for url in get("OLLAMA_ENDPOINTS", "").split(",") if url.strip()],
+            ollama_model=get("OLLAMA_MODEL", defaults.ollama_model),
+            ollama_hedge=flag("OLLAMA_HEDGE", defaults.ollama_hedge),
+            ollama_read_timeout=float(get("OLLAMA_READ_TIMEOUT", defaults.ollama_read_timeout)),
+            ollama_max_concurrency=int(get("OLLAMA_MAX_CONCURRENCY", 0)) or None,
+            ollama_max_queue=int(get("OLLAMA_MAX_QUEUE", defaults.ollama_max_queue)),
+            ollama_max_queue_per_user=int(get("OLLAMA_MAX_QUEUE_PER_USER", defaults.ollama_max_queue_per_user)),
+            ollama_health_interval=float(get("OLLAMA_HEALTH_INTERVAL", defaults.ollama_health_interval)),
+            ollama_warmup=flag("OLLAMA_WARMUP", defaults.ollama_warmup),
+            ollama_keep_alive=get("OLLAMA_KEEP_ALIVE", None) or None,
+            intent_fast_path=flag("INTENT_FAST_PATH", defaults.intent_fast_path),
+            mood_cache_size=int(get("MOOD_CACHE_SIZE", defaults.mood_cache_size)),
+            mood_cache_ttl=float(get("MOOD_CACHE_TTL", defaults.mood_cache_ttl)),
+            mood_cache_similarity=float(get("MOOD_CACHE_SIMILARITY", defaults.mood_cache_similarity)),
+            mood_cache_context_messages=int(get("MOOD_CACHE_CONTEXT_MESSAGES",
+                                                defaults.mood_cache_context_messages)),
+            workers=int(get("WEB_CONCURRENCY", defaults.workers)),
+            session_secret=get("SESSION_SECRET", None) or None,
+            session_secret_path=get("SESSION_SECRET_FILE", defaults.session_secret_path),
+            conversation_backend=get("CONVERSATION_BACKEND", defaults.conversation_backend),
+            conversation_db_path=get("CONVERSATION_DB_PATH", defaults.conversation_db_path),
+            conversation_max_turns=int(get("CONVERSATION_MAX_TURNS", defaults.conversation_max_turns)),
+            conversation_max_users=int(get("CONVERSATION_MAX_USERS", defaults.conversation_max_users)),
+            conversation_idle_ttl=float(get("CONVERSATION_IDLE_TTL", defaults.conversation_idle_ttl)),
+            conversation_max_bytes=int(get("CONVERSATION_MAX_BYTES", defaults.conversation_max_bytes)),
+            cache_backend=get("CACHE_BACKEND", defaults.cache_backend),
+            cache_db_path=get("CACHE_DB_PATH", defaults.cache_db_path),
+            request_timeout=float(get("REQUEST_TIMEOUT", defaults.request_timeout)),
+            # e.g. STAGE_BUDGETS="mood_analysis=60,spotify_search=5"
+            stage_budgets={**defaults.stage_budgets, **{
+                stage.strip(): float(seconds)
+                for stage, seconds in (item.split("=", 1) for item in get("STAGE_BUDGETS", "").split(",") if "=" in item)
+            }},
+            taste_profile_ttl=float(get("TASTE_PROFILE_TTL", defaults.taste_profile_ttl)),
+        )
@@ -1,17 +1,364 @@
-from typing import Dict, List
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from backend.logger import setup_logger
+
+logger = setup_logger("conversation_store")
+
+# Approximate per-message overhead of the {"role": ..., "content": ...} dict
+_MESSAGE_OVERHEAD = sys.getsizeof({"role": "", "content": ""})
+
+class InMemoryConversationBackend:
+    """
+    In-memory conversation history with bounded memory use.
+
+    Each user keeps a ring buffer of at most `max_turns` messages. Users are
+    kept in least-recently-used order and are evicted when idle for longer than
+    `idle_ttl` seconds, when more than `max_users` are held, or when the
+    approximate size of all histories exceeds `max_bytes`.
+    """
+    def __init__(self, max_turns: int = 20, max_users: int = 10000,
+                 idle_ttl: float = 6 * 3600, max_bytes: int = 64 * 1024 * 1024):
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.conversations: "OrderedDict[str, Deque[Dict]]" = OrderedDict()  # by user ID, LRU first
+        self._last_access: Dict[str, float] = {}
+        self._user_bytes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.evicted_users = 0
 
-class ConversationStore:
-    def __init__(self):
-        self.conversations = {}  # Dict to store conversations by user ID
-        
     def add_message(self, user_id, role, content):
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
-        self.conversations[user_id].append({"role": role, "content": content})
-        
-    def get_history(self, user_id):
-        return self.conversations.get(user_id, [])
-    
+        history = self._touch(user_id)
+        if history is None:
+            history = deque()
+            self.conversations[user_id] = history
+            self._last_access[user_id] = time.monotonic()
+            self._user_bytes[user_id] = 0
+
+        if len(history) >= self.max_turns:
+            self._account(user_id, -self._message_size(history.popleft()))
+        message = {"role": role, "content": content}
+        history.append(message)
+        self._account(user_id, self._message_size(message))
+
+        self._enforce_limits(user_id)
+
+    def get_history(self, user_id, limit: Optional[int] = None) -> List[Dict]:
+        history = self._touch(user_id)
+        if history is None:
+            return []
+        messages = list(history)
+        return messages[-limit:] if limit else messages
+
     def clear_history(self, user_id):
         if user_id in self.conversations:
-            self.conversations[user_id] = [] 
\ No newline at end of file
+            self._drop_user(user_id)
+
+    def evict_idle(self) -> int:
+        """
+        Drop users that have been idle for longer than idle_ttl
+        """
+        cutoff = time.monotonic() - self.idle_ttl
+        evicted = 0
+        # Users are kept in access order, so idle ones are at the front
+        while self.conversations:
+            user_id = next(iter(self.conversations))
+            if self._last_access[user_id] > cutoff:
+                break
+            self._drop_user(user_id)
+            evicted += 1
+        self.evicted_users += evicted
+        return evicted
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "backend": "memory",
+            "users": len(self.conversations),
+            "messages": sum(len(history) for history in self.conversations.values()),
+            "approx_bytes": self.total_bytes,
+            "evicted_users": self.evicted_users
+        }
+
+    def _touch(self, user_id):
+        history = self.conversations.get(user_id)
+        if history is not None:
+            self.conversations.move_to_end(user_id)
+            self._last_access[user_id] = time.monotonic()
+        return history
+
+    def _enforce_limits(self, current_user):
+        self.evict_idle()
+
+        while len(self.conversations) > self.max_users:
+            self._evict_lru()
+
+        while self.total_bytes > self.max_bytes and len(self.conversations) > 1:
+            self._evict_lru()
+
+        # A single oversized history is trimmed rather than dropped
+        history = self.conversations.get(current_user)
+        while self.total_bytes > self.max_bytes and history and len(history) > 1:
+            self._account(current_user, -self._message_size(history.popleft()))
+
+    def _evict_lru(self):
+        user_id = next(iter(self.conversations))
+        self._drop_user(user_id)
+        self.evicted_users += 1
+
+    def _drop_user(self, user_id):
+        del self.conversations[user_id]
+        self._last_access.pop(user_id, None)
+        self.total_bytes -= self._user_bytes.pop(user_id, 0)
+
+    def _account(self, user_id, size):
+        self._user_bytes[user_id] += size
+        self.total_bytes += size
+
+    @staticmethod
+    def _message_size(message: Dict) -> int:
+        return _MESSAGE_OVERHEAD + sys.getsizeof(message["role"]) + sys.getsizeof(message["content"])
+
+
+class _PendingMessage:
+    __slots__ = ("message", "seq")
+
+    def __init__(self, message: Dict):
+        self.message = message
+        # Set by the writer before its transaction commits
+        self.seq: Optional[int] = None
+
+class SQLiteConversationBackend:
+    """
+    Durable conversation history in SQLite, shareable by several worker
+    processes on one host.
+
+    Messages live in a WITHOUT ROWID table keyed by (user_id, seq), so reading
+    the last N messages of a user is an index range scan. Writes and clears are
+    queued and group-committed in order by a background thread, keeping them
+    off the request path; until a write is committed it is served from an
+    in-process overlay so a user always reads their own writes.
+    """
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            user_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (user_id, seq)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, path: str, max_turns: int = 20, batch_size: int = 256,
+                 flush_interval: float = 0.05):
+        self.path = path
+        self.max_turns = max_turns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        # Guards the overlay only; never held across SQLite calls
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[_PendingMessage]] = {}
+        self._clearing: Dict[str, int] = {}
+        self._queue: "queue.Queue" = queue.Queue()
+        self.committed_batches = 0
+
+        with self._connect() as conn:
+            conn.execute(self._SCHEMA)
+
+        self._writer_conn = self._connect()
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @property
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def add_message(self, user_id, role, content):
+        entry = _PendingMessage({"role": role, "content": content})
+        with self._lock:
+            self._pending.setdefault(user_id, []).append(entry)
+        self._queue.put(("add", user_id, entry, time.time()))
+
+    def get_history(self, user_id, limit: Optional[int] = None) -> List[Dict]:
+        limit = min(limit, self.max_turns) if limit else self.max_turns
+        with self._lock:
+            pending = list(self._pending.get(user_id, ()))
+            clearing = user_id in self._clearing
+        # Until a queued clear commits, the rows on disk are already gone for this user
+        rows = [] if clearing else self._reader.execute(
+            "SELECT seq, role, content FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
+        # An entry committed after the snapshot above was given its seq before
+        # the commit. If the query saw that commit, the entry's seq is at most
+        # the newest seq read, even when LIMIT or the max_turns trim left its row out
+        newest = rows[0][0] if rows else 0
+        history = [{"role": role, "content": content} for _, role, content in reversed(rows)]
+        history.extend(entry.message for entry in pending if entry.seq is None or entry.seq > newest)
+        return history[-limit:]
+
+    def clear_history(self, user_id):
+        with self._lock:
+            # Writes queued before the clear are committed before it, then deleted by it
+            self._pending.pop(user_id, None)
+            self._clearing[user_id] = self._clearing.get(user_id, 0) + 1
+        self._queue.put(("clear", user_id))
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Block until every write queued so far has been committed
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._writer_conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        users, messages, approx_bytes = self._reader.execute(
+            "SELECT COUNT(DISTINCT user_id), COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages"
+        ).fetchone()
+        with self._lock:
+            pending = sum(len(entries) for entries in self._pending.values())
+        return {
+            "backend": "sqlite",
+            "users": users,
+            "messages": messages,
+            "approx_bytes": approx_bytes,
+            "pending_writes": pending,
+            "committed_batches": self.committed_batches
+        }
+
+    def _write_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [item]
+            # Group-commit whatever else is already queued
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            writes = [op for op in batch if isinstance(op, tuple)]
+            if writes:
+                try:
+                    self._commit(writes)
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to persist {len(writes)} conversation writes: {e}")
+                self._settle(writes)
+
+            for op in batch:
+                if isinstance(op, threading.Event):
+                    op.set()
+            if any(op is None for op in batch):
+                return
+
+    def _commit(self, writes):
+        conn = self._writer_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            touched = set()
+            for op in writes:
+                if op[0] == "clear":
+                    conn.execute("DELETE FROM messages WHERE user_id = ?", (op[1],))
+                    touched.discard(op[1])
+                    continue
+                _, user_id, entry, created_at = op
+                # MAX(seq) is a lookup on the primary key; BEGIN IMMEDIATE
+                # serialises writers across processes so seq stays unique
+                seq, = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                conn.execute(
+                    "INSERT INTO messages (user_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, seq, entry.message["role"], entry.message["content"], created_at)
+                )
+                entry.seq = seq
+                touched.add(user_id)
+            for user_id in touched:
+                conn.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND seq <= "
+                    "(SELECT MAX(seq) FROM messages WHERE user_id = ?) - ?",
+                    (user_id, user_id, self.max_turns)
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.committed_batches += 1
+
+    def _settle(self, writes):
+        """
+        Take committed (or failed) writes out of the overlay
+        """
+        with self._lock:
+            for op in writes:
+                user_id = op[1]
+                if op[0] == "clear":
+                    if self._clearing[user_id] == 1:
+                        del self._clearing[user_id]
+                    else:
+                        self._clearing[user_id] -= 1
+                    continue
+                pending = self._pending.get(user_id)
+                if pending and pending[0] is op[2]:
+                    pending.pop(0)
+                    if not pending:
+                        del self._pending[user_id]
+
+class ConversationStore:
+    """
+    Conversation history facade with a pluggable storage backend.
+    Defaults to a bounded in-memory backend configured by `memory_options`.
+    """
+    def __init__(self, backend=None, **memory_options):
+        self.backend = backend if backend is not None else InMemoryConversationBackend(**memory_options)
+
+    def add_message(self, user_id, role, content):
+        self.backend.add_message(user_id, role, content)
+
+    def get_history(self, user_id, limit: Optional[int] = None) -> List[Dict]:
+        return self.backend.get_history(user_id, limit)
+
+    def clear_history(self, user_id):
+        self.backend.clear_history(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Awaitable, Dict, Optional, TypeVar
+
+from starlette.requests import Request
+
+from backend import metrics
+from backend.logger import setup_logger
+
+logger = setup_logger("deadline")
+
+T = TypeVar("T")
+
+# Upper bounds per pipeline stage, in seconds; the request deadline caps them all
+DEFAULT_BUDGETS = {
+    "mood_analysis": 90.0,
+    "recommendations": 20.0,
+    "spotify_top_items": 5.0,
+    "spotify_search": 10.0,
+}
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage runs past its budget or the request deadline"""
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away and the request was cancelled"""
+
+class Deadline:
+    """
+    Time limit of one request plus per-stage budgets. The stage currently
+    running is recorded so cancellations can be attributed to it.
+    """
+    def __init__(self, timeout: float, budgets: Optional[Dict[str, float]] = None):
+        self.expires_at = time.monotonic() + timeout
+        self.budgets = DEFAULT_BUDGETS if budgets is None else budgets
+        self.stage = "request"
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def timeout_for(self, stage: str) -> float:
+        budget = self.budgets.get(stage)
+        remaining = self.remaining()
+        return remaining if budget is None else min(budget, remaining)
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+def start_deadline(timeout: float, budgets: Optional[Dict[str, float]] = None) -> Deadline:
+    deadline = Deadline(timeout, budgets)
+    _deadline.set(deadline)
+    return deadline
+
+@asynccontextmanager
+async def budget(stage: str):
+    """
+    Run a stage under its budget, capped by the request deadline. Raises
+    DeadlineExceeded when either runs out; without a deadline, does nothing.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        yield
+        return
+
+    seconds = deadline.timeout_for(stage)
+    if seconds <= 0:
+        raise DeadlineExceeded(stage)
+    outer_stage, deadline.stage = deadline.stage, stage
+    try:
+        async with asyncio.timeout(seconds):
+            yield
+    except TimeoutError as e:
+        raise DeadlineExceeded(stage) from e
+    finally:
+        deadline.stage = outer_stage
+
+async def _wait_for_disconnect(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def run_until_disconnected(request: Request, work: Awaitable[T], route: str) -> T:
+    """
+    Await work, cancelling it (and the upstream calls it is making) if the
+    client disconnects first. Raises ClientDisconnected in that case.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            record_cancelled(route)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise ClientDisconnected()
+        return task.result()
+    finally:
+        watcher.cancel()
+        if not task.done():
+            # We were cancelled ourselves
+            task.cancel()
+
+async def stream_until_disconnected(request: Request, frames: AsyncGenerator[T, None],
+                                    route: str) -> AsyncGenerator[T, None]:
+    """
+    Drive an async generator in its own task and re-yield its items, so that
+    a disconnect is noticed (and the generator cancelled) even while it is
+    waiting upstream rather than writing to the client. Cancellations are
+    recorded against the stage the deadline says was running.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def produce():
+        try:
+            async for frame in frames:
+                # Unbounded, so the generator is only ever suspended inside its own awaits
+                queue.put_nowait(frame)
+        finally:
+            queue.put_nowait(finished)
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                return
+            frame = getter.result()
+            if frame is finished:
+                # Re-raise anything the generator failed with
+                await producer
+                return
+            yield frame
+    finally:
+        watcher.cancel()
+        # Also reached when the server stops sending because the client went away
+        if not producer.done():
+            record_cancelled(route)
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+def record_cancelled(route: str):
+    deadline = _deadline.get()
+    stage = deadline.stage if deadline is not None else "request"
+    metrics.REQUESTS_CANCELLED.inc(route=route, stage=stage)
+    logger.info(f"Client disconnected from {route} during {stage}; cancelled")
+
+def record_timed_out(route: str, error: DeadlineExceeded):
+    metrics.REQUESTS_TIMED_OUT.inc(route=route, stage=error.stage)
+    logger.warning(f"{route} timed out during {error.stage}")
@@ -0,0 +1,208 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, TypeVar
+
+import httpx
+
+from backend.logger import setup_logger
+from backend.metrics import record_upstream_error
+
+logger = setup_logger("endpoint_pool")
+
+T = TypeVar("T")
+
+class OllamaEndpoint:
+    """
+    One Ollama node and the load and latency observed on it
+    """
+    def __init__(self, base_url: str, alpha: float = 0.3, window: int = 256):
+        self.base_url = base_url.rstrip("/")
+        self.chat_endpoint = f"{self.base_url}/api/chat"
+        self.tags_endpoint = f"{self.base_url}/api/tags"
+        self.ps_endpoint = f"{self.base_url}/api/ps"
+        self.alpha = alpha
+        # Assumed healthy until the first health check says otherwise
+        self.healthy = True
+        self.in_flight = 0
+        self.ewma_latency: Optional[float] = None
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+
+    def observe(self, latency: float):
+        """
+        Record the time to first response of a successful request
+        """
+        self._latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        if isinstance(error, httpx.TransportError):
+            record_upstream_error("ollama", error)
+            # Unreachable: route elsewhere until the next health check passes
+            self.healthy = False
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def stats(self) -> Dict:
+        p95 = self.percentile(0.95)
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 2) if self.ewma_latency is not None else None,
+            "p95_latency_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+class EndpointPool:
+    """
+    A set of Ollama endpoints serving the same model.
+
+    Requests are routed to the healthy endpoint with the lowest expected wait,
+    (in_flight + 1) * EWMA latency. With hedging enabled, a request that has
+    not answered within its endpoint's p95 latency (once `min_samples` are
+    known, and never sooner than `min_hedge_delay`) is duplicated to a second
+    endpoint and whichever answers first wins. A request that fails outright
+    is retried on the next best endpoint until every endpoint has been tried.
+    """
+    def __init__(self, base_urls: Iterable[str], hedge: bool = False, hedge_quantile: float = 0.95,
+                 min_hedge_delay: float = 0.25, min_samples: int = 20, alpha: float = 0.3):
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.reset(base_urls)
+
+    def reset(self, base_urls: Iterable[str]):
+        self.endpoints: List[OllamaEndpoint] = [OllamaEndpoint(url, self.alpha) for url in base_urls]
+        if not self.endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def choose(self, exclude: Iterable[OllamaEndpoint] = ()) -> Optional[OllamaEndpoint]:
+        """
+        Pick the endpoint with the lowest expected wait, or None if all are excluded
+        """
+        excluded = set(map(id, exclude))
+        candidates = [endpoint for endpoint in self.endpoints if id(endpoint) not in excluded]
+        # If every node looks down, still try one rather than failing without a request
+        candidates = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+        if not candidates:
+            return None
+
+        known = [endpoint.ewma_latency for endpoint in self.endpoints if endpoint.ewma_latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+
+        def expected_wait(endpoint):
+            latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else default_latency
+            return ((endpoint.in_flight + 1) * latency, endpoint.in_flight)
+
+        return min(candidates, key=expected_wait)
+
+    def hedge_delay(self, endpoint: OllamaEndpoint) -> Optional[float]:
+        """
+        Seconds to wait on endpoint before hedging, or None to never hedge
+        """
+        if not self.hedge or len(self.endpoints) < 2 or len(endpoint._latencies) < self.min_samples:
+            return None
+        return max(self.min_hedge_delay, endpoint.percentile(self.hedge_quantile))
+
+    async def run(self, attempt: Callable[[OllamaEndpoint], Awaitable[T]],
+                  release: Optional[Callable[[T], Awaitable[None]]] = None) -> T:
+        """
+        Run attempt(endpoint) on the best endpoint, hedging or failing over to
+        a second one as needed. An endpoint counts as in flight until its
+        attempt finishes or, if `release` is given, until release(result) is
+        called (e.g. when a stream is closed). Results of attempts that finish
+        after another has already won are released automatically.
+        """
+        primary = self.choose()
+        hold = release is not None
+        tasks: Dict[asyncio.Task, OllamaEndpoint] = {self._launch(primary, attempt, hold): primary}
+        tried = [primary]
+        hedged = False
+        delay = self.hedge_delay(primary)
+        error: Optional[BaseException] = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                delay = None
+                if not done:
+                    # Primary is slower than its p95: race a second endpoint
+                    backup = self.choose(exclude=tried)
+                    if backup is not None:
+                        self.hedged += 1
+                        hedged = True
+                        tried.append(backup)
+                        tasks[self._launch(backup, attempt, hold)] = backup
+                    continue
+
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is None:
+                        if hedged and endpoint is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+
+                if not tasks:
+                    backup = self.choose(exclude=tried)
+                    if backup is not None:
+                        logger.warning(f"Ollama at {tried[-1].base_url} failed ({error}), retrying on {backup.base_url}")
+                        self.failovers += 1
+                        tried.append(backup)
+                        tasks[self._launch(backup, attempt, hold)] = backup
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+                if release is not None:
+                    task.add_done_callback(lambda done: self._discard(done, release))
+
+    def _launch(self, endpoint: OllamaEndpoint, attempt: Callable[[OllamaEndpoint], Awaitable[T]],
+                hold: bool) -> asyncio.Task:
+        # Count the load now, before the task runs, so concurrent callers spread out
+        endpoint.requests += 1
+        endpoint.in_flight += 1
+        task = asyncio.ensure_future(attempt(endpoint))
+        task.add_done_callback(lambda done: self._settle(endpoint, done, hold))
+        return task
+
+    @staticmethod
+    def _settle(endpoint: OllamaEndpoint, task: asyncio.Task, hold: bool):
+        if hold and not task.cancelled() and task.exception() is None:
+            return  # still in flight until released
+        endpoint.in_flight -= 1
+
+    @staticmethod
+    def _discard(task: asyncio.Task, release: Callable[[T], Awaitable[None]]):
+        # A losing attempt can complete in the same tick it is cancelled
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(release(task.result()))
+
+    def stats(self) -> Dict:
+        return {
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers
+        }
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+import httpx
+
+from backend.logger import setup_logger
+
+logger = setup_logger("health_monitor")
+
+@dataclass(frozen=True)
+class ModelHealth:
+    """
+    Snapshot of the inference backend's state, replaced wholesale on every poll
+    """
+    ready: bool = False
+    base_url: str = ""
+    model: str = ""
+    installed_models: List[str] = field(default_factory=list)
+    loaded_models: List[str] = field(default_factory=list)
+    latency_ms: Optional[float] = None
+    checked_at: Optional[float] = None
+    error: Optional[str] = None
+
+class ModelHealthMonitor:
+    """
+    Polls every Ollama endpoint in the background and publishes a cached
+    readiness state per endpoint, so request handlers can check readiness
+    without any network I/O. Endpoints failing their check are taken out of
+    the LLM manager's routing until they pass again.
+    """
+    def __init__(self, llm_manager, interval: float = 10.0, timeout: float = 3.0):
+        self.llm_manager = llm_manager
+        self.interval = interval
+        self.timeout = timeout
+        self.states: Dict[str, ModelHealth] = {}  # by endpoint base URL
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return any(state.ready for state in self.states.values())
+
+    async def start(self):
+        """
+        Start polling in the background. Readiness stays False until the
+        first check, which runs as soon as endpoint discovery has finished.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await self.llm_manager.wait_started()
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Health check failed unexpectedly: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def check(self) -> Dict[str, ModelHealth]:
+        """
+        Probe every endpoint once and publish the results
+        """
+        endpoints = list(self.llm_manager.pool)
+        results = await asyncio.gather(*(self._check_endpoint(endpoint) for endpoint in endpoints))
+
+        states = {}
+        for endpoint, state in zip(endpoints, results):
+            previous = self.states.get(endpoint.base_url)
+            if previous is None or previous.ready != state.ready:
+                logger.info(f"Model {state.model} at {endpoint.base_url} ready: {state.ready}")
+            endpoint.healthy = state.ready
+            states[endpoint.base_url] = state
+        self.states = states
+        return states
+
+    async def _check_endpoint(self, endpoint) -> ModelHealth:
+        llm = self.llm_manager
+        started = time.perf_counter()
+        try:
+            tags, running = await asyncio.gather(
+                llm.client.get(endpoint.tags_endpoint, timeout=self.timeout),
+                llm.client.get(endpoint.ps_endpoint, timeout=self.timeout),
+                return_exceptions=True
+            )
+            if isinstance(tags, Exception):
+                raise tags
+            tags.raise_for_status()
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            installed = self._model_names(tags.json())
+            loaded = self._loaded_models(running)
+
+            return ModelHealth(
+                # Same match as llm._has_model, on the validated names
+                ready=any(llm.model in name for name in installed),
+                base_url=endpoint.base_url,
+                model=llm.model,
+                installed_models=installed,
+                loaded_models=loaded,
+                latency_ms=round(latency_ms, 2),
+                checked_at=time.time()
+            )
+        except (httpx.HTTPError, ValueError) as e:
+            return ModelHealth(
+                ready=False,
+                base_url=endpoint.base_url,
+                model=llm.model,
+                checked_at=time.time(),
+                error=str(e) or type(e).__name__
+            )
+
+    def _loaded_models(self, running) -> List[str]:
+        # /api/ps is informational only, so failures never affect readiness
+        if isinstance(running, Exception) or running.status_code != 200:
+            return []
+        try:
+            return self._model_names(running.json())
+        except ValueError:
+            return []
+
+    @staticmethod
+    def _model_names(body) -> List[str]:
+        """
+        Names from an Ollama {"models": [{"name": ...}, ...]} listing. Raises
+        ValueError for any other shape, so a misbehaving endpoint is reported
+        as unready instead of breaking the whole check.
+        """
+        models = body.get("models") if isinstance(body, dict) else None
+        if not isinstance(models, list) or not all(isinstance(m, dict) for m in models):
+            raise ValueError(f"Unexpected model listing from Ollama: {str(body)[:100]}")
+        return [str(m.get("name") or "") for m in models]
+
+    def cold_endpoints(self) -> List:
+        """
+        Ready endpoints that did not have the model loaded at their last check
+        """
+        model = self.llm_manager.model
+        return [
+            endpoint for endpoint in self.llm_manager.pool
+            if (state := self.states.get(endpoint.base_url)) is not None and state.ready
+            and not any(model in name for name in state.loaded_models)
+        ]
+
+    def as_dict(self) -> Dict:
+        pool = self.llm_manager.pool.stats()
+        routing = {endpoint["base_url"]: endpoint for endpoint in pool.pop("endpoints")}
+        return {
+            "ready": self.ready,
+            "model": self.llm_manager.model,
+            "endpoints": [
+                {**asdict(state), "routing": routing.get(url, {})}
+                for url, state in self.states.items()
+            ],
+            **pool
+        }
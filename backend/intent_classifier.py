@@ -0,0 +1,209 @@
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend import metrics
+from backend.logger import setup_logger
+
+logger = setup_logger("intent_classifier")
+
+# Same label sets the mood analysis prompt asks the LLM to use
+GENRE_ALIASES = {
+    "pop": ["pop"],
+    "rock": ["rock"],
+    "bollywood": ["bollywood"],
+    "lo-fi": ["lo-fi", "lofi", "lo fi"],
+    "jazz": ["jazz"],
+    "classical": ["classical"],
+    "hip-hop": ["hip-hop", "hip hop", "hiphop", "rap"],
+    "electronic": ["electronic", "edm", "techno", "house music"]
+}
+
+MOOD_WORDS = {
+    "happy": ["happy", "joyful", "excited", "celebratory", "cheerful", "upbeat", "feel good", "feel-good"],
+    "sad": ["sad", "melancholic", "heartbroken", "gloomy", "down", "depressed", "lonely", "breakup"],
+    "calm": ["calm", "relaxed", "relaxing", "peaceful", "meditative", "chill", "study", "studying",
+             "focus", "sleep", "sleeping", "mellow"],
+    "energetic": ["energetic", "pumped", "hyped", "adrenaline", "workout", "gym", "running",
+                  "party", "dance", "dancing"]
+}
+
+_GREETING = re.compile(
+    r"^\s*(hi+|hello+|hey+|yo|hiya|howdy|good (morning|afternoon|evening)|thanks?( you)?|thank u|ty|bye|goodbye)"
+    r"( there)?[\s!.,:)]*$",
+    re.IGNORECASE
+)
+_THANKS = re.compile(r"\b(thanks?|thank u|ty|bye|goodbye)\b", re.IGNORECASE)
+_MUSIC_REQUEST = re.compile(
+    r"\b(recommend\w*|suggest\w*|play|playlist|songs?|tracks?|music|listen\w*|tunes?)\b",
+    re.IGNORECASE
+)
+# Phrases that usually name an artist or depend on context the rules cannot see
+_NEEDS_LLM = re.compile(r"\b(like|by|from|similar|artist|band|singer|more|another|again|that|those|it)\b",
+                        re.IGNORECASE)
+# Negated or refused requests ("don't play rock", "stop recommending songs")
+# look like requests to n-gram features, so they always go to the LLM
+_NEGATION = re.compile(
+    r"\b(not|no|never|stop\w*|hate\w*|dislike\w*|without|nothing|none|enough)\b|n'?t\b",
+    re.IGNORECASE
+)
+
+def _compile_lexicon(lexicon: Dict[str, List[str]]) -> Dict[str, "re.Pattern"]:
+    return {
+        label: re.compile(r"\b(" + "|".join(re.escape(word) for word in words) + r")\b", re.IGNORECASE)
+        for label, words in lexicon.items()
+    }
+
+_GENRE_PATTERNS = _compile_lexicon(GENRE_ALIASES)
+_MOOD_PATTERNS = _compile_lexicon(MOOD_WORDS)
+
+def hash_ngrams(text: str, dimensions: int, ngram_range=(2, 4)) -> np.ndarray:
+    """
+    L2-normalised bag of hashed character n-grams of lowercased, whitespace-collapsed text
+    """
+    text = " " + " ".join(text.lower().split()) + " "
+    low, high = ngram_range
+    indices = [
+        zlib.crc32(text[i:i + n].encode("utf-8")) % dimensions
+        for n in range(low, high + 1)
+        for i in range(len(text) - n + 1)
+    ]
+    vector = np.bincount(np.asarray(indices, dtype=np.int64), minlength=dimensions).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def lexicon_labels(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Genres and moods named in text, per the keyword lexicons
+    """
+    genres = tuple(genre for genre, pattern in _GENRE_PATTERNS.items() if pattern.search(text))
+    moods = tuple(mood for mood, pattern in _MOOD_PATTERNS.items() if pattern.search(text))
+    return genres, moods
+
+def references_specifics(text: str) -> bool:
+    """
+    Whether text likely names an artist, refers back to earlier messages or
+    negates a request
+    """
+    return bool(_NEEDS_LLM.search(text) or _NEGATION.search(text))
+
+def _training_examples():
+    """
+    Small synthetic training set built from the genres and moods the prompt lists
+    """
+    positive_templates = [
+        "recommend some {genre} songs", "suggest {genre} music", "play some {genre}",
+        "can you recommend {genre} tracks", "i want to listen to {genre}", "any good {genre} songs",
+        "make me a {mood} playlist", "i need {mood} music", "play something {mood}",
+        "give me songs for when i feel {mood}", "put on some {mood} tunes", "{mood} songs please",
+        "what should i listen to", "recommend me some music", "suggest a few songs",
+        "songs for {activity}", "music for {activity}", "playlist for {activity}"
+    ]
+    negative_templates = [
+        "how are you", "what is the weather like today", "tell me a joke", "i just finished a workout",
+        "who won the game yesterday", "what is the capital of france", "i had a long day at work",
+        "can you help me with my homework", "what time is it", "i feel {mood} today",
+        "explain how you work", "what is your name", "i am bored", "my friend is visiting",
+        "how do i cook pasta", "i went {activity} this morning", "today was {mood}",
+        "do you know anything about history", "i am going to bed",
+        "do not play {genre} music", "don't recommend {genre} songs", "stop recommending songs",
+        "i hate {genre}", "no more {mood} music please", "never play {genre} again",
+        "i don't want any music right now", "please stop the {mood} playlist"
+    ]
+    genres = [aliases[0] for aliases in GENRE_ALIASES.values()]
+    moods = [words[0] for words in MOOD_WORDS.values()] + ["chill", "upbeat", "gloomy"]
+    activities = ["studying", "running", "the gym", "a party", "sleeping", "driving"]
+
+    examples = []
+    for templates, label in ((positive_templates, 1.0), (negative_templates, 0.0)):
+        for template in templates:
+            for genre, mood, activity in zip(genres, moods * 2, activities * 2):
+                examples.append((template.format(genre=genre, mood=mood, activity=activity), label))
+    return examples
+
+class IntentClassifier:
+    """
+    Microsecond first-stage classifier run before the LLM.
+
+    Greetings and thanks are answered by rules. Everything else is scored by a
+    logistic model over hashed character n-grams; explicit music requests that
+    score above `threshold` get genres and mood from keyword lexicons. Anything
+    uncertain, naming an artist or containing a negation returns None so the
+    caller falls back to the LLM.
+    """
+    def __init__(self, dimensions: int = 2 ** 12, threshold: float = 0.85,
+                 ngram_range=(2, 4), epochs: int = 400, learning_rate: float = 4.0):
+        self.dimensions = dimensions
+        self.threshold = threshold
+        self.ngram_range = ngram_range
+        self.counts = {"greeting": 0, "recommendation": 0, "llm": 0}
+        self.weights, self.bias = self._train(epochs, learning_rate)
+
+    def _vectorize(self, text: str) -> np.ndarray:
+        return hash_ngrams(text, self.dimensions, self.ngram_range)
+
+    def _train(self, epochs: int, learning_rate: float):
+        examples = _training_examples()
+        features = np.stack([self._vectorize(text) for text, _ in examples])
+        labels = np.array([label for _, label in examples], dtype=np.float32)
+        weights = np.zeros(self.dimensions, dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            predictions = 1.0 / (1.0 + np.exp(-(features @ weights + bias)))
+            error = predictions - labels
+            weights -= learning_rate * (features.T @ error) / len(labels)
+            bias -= learning_rate * float(error.mean())
+        return weights, bias
+
+    def recommendation_probability(self, message: str) -> float:
+        return float(1.0 / (1.0 + np.exp(-(self._vectorize(message) @ self.weights + self.bias))))
+
+    def classify(self, message: str) -> Optional[Dict]:
+        """
+        Return a mood analysis dict for confidently easy messages, or None
+        """
+        if _GREETING.match(message):
+            self._count("greeting")
+            if _THANKS.search(message):
+                response = "You're welcome! Come back any time you want more music."
+            else:
+                response = "Hey! Tell me how you're feeling or what you'd like to listen to, and I'll find some music for you."
+            return {
+                "wants_recommendations": False,
+                "mood": "neutral",
+                "genres": [],
+                "artists": [],
+                "response": response
+            }
+
+        if (_MUSIC_REQUEST.search(message) and not references_specifics(message)
+                and self.recommendation_probability(message) >= self.threshold):
+            self._count("recommendation")
+            genres = [genre for genre, pattern in _GENRE_PATTERNS.items() if pattern.search(message)]
+            mood = next((mood for mood, pattern in _MOOD_PATTERNS.items() if pattern.search(message)), "neutral")
+            described = " ".join(genres[:1]) or "some"
+            return {
+                "wants_recommendations": True,
+                "mood": mood,
+                "genres": genres,
+                "artists": [],
+                "response": f"Sure! Let me find {described} tracks for you."
+            }
+
+        self._count("llm")
+        return None
+
+    def _count(self, path: str):
+        self.counts[path] += 1
+        metrics.INTENT_PATHS.inc(path=path)
+
+    def stats(self) -> Dict[str, float]:
+        total = sum(self.counts.values())
+        fast = self.counts["greeting"] + self.counts["recommendation"]
+        return {
+            **self.counts,
+            "total": total,
+            "fast_path_ratio": fast / total if total else 0.0
+        }
@@ -1,32 +1,42 @@
+import asyncio
 import requests
+import httpx
 import json
-from typing import Dict, Optional, Generator, List
+from typing import AsyncGenerator, Dict, Optional, Generator, List, Tuple
 import re
+import time
+from contextlib import aclosing, nullcontext
+from backend import metrics
+from backend.endpoint_pool import EndpointPool, OllamaEndpoint
 from backend.logger import setup_logger
+from backend.prompts import MOOD_ANALYSIS_FIELDS, MOOD_ANALYSIS_SCHEMA, MoodPromptBuilder, PromptBuild
+from backend.streaming import IncrementalJSONObjectParser, ThinkFilter
 
 logger = setup_logger("llm_manager")
 
-class LLMManager:
-    def __init__(self, base_url: str = None):
-        try:
-            response = requests.get("http://localhost:11434", timeout=1)
-            if response.status_code == 200:
-                self.base_url = "http://localhost:11434"
-                logger.info("✅ Connected to Ollama on localhost")
-            else:
-                self.base_url = "http://ollama:11434"
-                logger.warning("⚠️ Falling back to Docker service name 'ollama'")
-        except:
-            self.base_url = "http://ollama:11434"
-            logger.warning("⚠️ Couldn't connect to localhost, falling back to Docker service name")
-        
-        self.model = "deepseek-r1:1.5b"
+LOCAL_OLLAMA_URL = "http://localhost:11434"
+DOCKER_OLLAMA_URL = "http://ollama:11434"
+DEFAULT_MODEL = "deepseek-r1:1.5b"
+
+class BaseLLMManager:
+    """
+    Transport-independent parts of the Ollama client: payloads, prompts and parsing
+    """
+    def __init__(self, base_url: str, model: str = DEFAULT_MODEL,
+                 prompt_builder: Optional[MoodPromptBuilder] = None):
+        self.model = model
+        self.prompt_builder = prompt_builder or MoodPromptBuilder()
+        self._set_base_url(base_url)
+    
+    def _set_base_url(self, base_url: str):
+        self.base_url = base_url
         self.generate_endpoint = f"{self.base_url}/api/generate"
         self.chat_endpoint = f"{self.base_url}/api/chat"
+        self.tags_endpoint = f"{self.base_url}/api/tags"
     
-    def chat(self, message: str, history: List[Dict] = None, stream: bool = True):
+    def _build_chat_payload(self, message: str, history: List[Dict] = None, stream: bool = True) -> Dict:
         """
-        Send a message to the LLM model with conversation history
+        Format a message and its conversation history for Ollama's chat API
         """
         if history is None:
             history = []
@@ -44,7 +54,10 @@ class LLMManager:
         # Add current message
         messages.append({"role": "user", "content": message})
         
-        payload = {
+        return self._build_payload(messages, stream)
+    
+    def _build_payload(self, messages: List[Dict], stream: bool = True) -> Dict:
+        return {
             "model": self.model,
             "messages": messages,
             "stream": stream,
@@ -53,53 +66,24 @@ class LLMManager:
                 "top_p": 0.8
             }
         }
-        
-        # Use the chat endpoint for more context
-        response = requests.post(self.chat_endpoint, json=payload)
-        
-        if not stream:
-            result = response.json()
-            # Clean response
-            if "message" in result and "content" in result["message"]:
-                result["message"]["content"] = self._clean_response(result["message"]["content"])
-            return result
-        else:
-            return self._process_stream(response)
     
-    def _process_stream(self, response):
+    def _clean_chat_result(self, result: Dict) -> Dict:
         """
-        Process a streaming response from the LLM
+        Clean the message content of a non-streamed chat result in place
         """
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                chunk = json.loads(line)
-                if "message" in chunk and "content" in chunk["message"]:
-                    content = chunk["message"]["content"]
-                    # Clean each chunk of content
-                    cleaned_content = self._clean_response(content)
-                    full_response += cleaned_content
-                    yield {"chunk": cleaned_content, "full": full_response}
-                elif "done" in chunk and chunk["done"]:
-                    break
+        if "message" in result and "content" in result["message"]:
+            result["message"]["content"] = self._clean_response(result["message"]["content"])
+        return result
     
-    def is_model_ready(self) -> bool:
+    def _has_model(self, tags: Dict) -> bool:
         """
-        Check if the model is ready to use
+        Check whether an /api/tags listing contains the configured model
         """
-        try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=3)
-            
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                model_names = [m.get("name", "") for m in models]
-                
-                return any(self.model in model_name for model_name in model_names)
-            return False
-        except Exception as e:  
-            logger.error(f"Error checking if model is ready: {e}")
-            return False
-
+        models = tags.get("models", [])
+        model_names = [m.get("name", "") for m in models]
+        
+        return any(self.model in model_name for model_name in model_names)
+    
     def _clean_response(self, text):
         """
         Remove <think> tags and clean up the response
@@ -112,98 +96,38 @@ class LLMManager:
         cleaned = cleaned.strip()
         return cleaned
     
-    def analyze_conversation_mood(self, conversation_history, user_message):
+    def _build_mood_request(self, conversation_history, user_message, stream: bool) -> Tuple[Dict, PromptBuild]:
         """
-        Analyze the conversation to detect if the user is explicitly asking for music
-        Returns a dict with mood, recommendation_request flag, and genres
+        Build the chat payload for mood analysis: a static system prompt (a
+        reusable KV-cache prefix) followed by a token-budgeted dynamic suffix
+        """
+        prompt = self.prompt_builder.build(conversation_history, user_message)
+        logger.debug(
+            f"Mood prompt: ~{prompt.prompt_tokens} tokens ({prompt.history_turns} turns, "
+            f"{prompt.summarized_turns} summarized, {prompt.truncated_turns} truncated)"
+        )
+        payload = self._build_payload(prompt.messages, stream)
+        # Constrain generation to the analysis schema (Ollama structured outputs)
+        payload["format"] = MOOD_ANALYSIS_SCHEMA
+        return payload, prompt
+    
+    def _log_prompt_usage(self, prompt: PromptBuild, result: Dict):
+        """
+        Record the estimated prompt size next to what Ollama actually evaluated
+        """
+        metrics.MOOD_PROMPT_TOKENS.observe(prompt.prompt_tokens, kind="estimated")
+        evaluated = result.get("prompt_eval_count")
+        if evaluated is not None:
+            metrics.MOOD_PROMPT_TOKENS.observe(evaluated, kind="evaluated")
+            logger.debug(f"Mood prompt tokens: estimated {prompt.prompt_tokens}, evaluated {evaluated}")
+    
+    def _parse_mood_analysis(self, response: Dict) -> Dict:
+        """
+        Extract the mood analysis JSON from a non-streamed chat result
         """
-        # Create a prompt for the mood analysis
-        history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation_history[-3:]])
-        
-        prompt = f"""
-            **Role**: You are a music recommendation expert specializing in mood analysis and contextual understanding. 
-            **Task**: Analyze conversation history and latest message to determine if the user wants music recommendations.
-
-            **Instructions**:
-            1. Recommendation Trigger:
-            - Set `wants_recommendations` to True ONLY if:
-                a) User explicitly requests music (e.g., "recommend songs", "make me a playlist")
-                b) User implies musical need through context (e.g., "I need study music", "What should I listen to?")
-
-            2. Mood Detection:
-            - Analyze ENTIRE conversation history to determine emotional state
-            - Use these mood mappings (expand as needed):
-                {{
-                    "happy": ["joyful", "excited", "celebratory"],
-                    "sad": ["melancholic", "heartbroken", "gloomy"],
-                    "calm": ["relaxed", "peaceful", "meditative"],
-                    "energetic": ["pumped", "hyped", "adrenaline"]
-                }}
-
-            3. Entity Extraction:
-            - `genres`: ONLY include if explicitly mentioned in LATEST message (e.g., "rock", "lo-fi")
-            - `artists`: ONLY include if named in LATEST message (e.g., "Taylor Swift", "BTS")
-
-            **Examples**:
-
-            1. User message: "Can you suggest some upbeat pop songs?"
-            {{
-                "wants_recommendations": true,
-                "mood": "happy",
-                "genres": ["pop"],
-                "artists": [],
-                "response": "I'll find some upbeat pop tracks! Any specific artists or sub-genres you prefer?"
-            }}
-
-            2. User message: "I just finished a workout"
-            Conversation history: "User mentioned feeling tired after work earlier"
-            {{
-                "wants_recommendations": false,
-                "mood": "neutral",
-                "genres": [],
-                "artists": [],
-                "response": "Great job on the workout! Would you like some energetic music to keep the momentum going?"
-            }}
-
-            3. User message: "Play something like Radiohead"
-            {{
-                "wants_recommendations": true,
-                "mood": "calm",
-                "genres": [],
-                "artists": ["Radiohead"],
-                "response": "Creating a playlist with Radiohead's style. Shall I focus on their newer or older sound?"
-            }}
-
-            **Output Format**: STRICTLY use this JSON structure:
-            {{
-                "wants_recommendations": boolean,
-                "mood": string (from: happy/sad/calm/energetic/neutral),
-                "genres": array[string] (ONLY explicit in latest message),
-                "artists": array[string] (ONLY explicit in latest message),
-                "response": string (natural language reply ALWAYS addressing latest message)
-            }}
-            - `genres`: ONLY include if explicitly mentioned in LATEST message and must be one of the following: ["pop", "rock","bollywood", "lo-fi", "jazz", "classical", "hip-hop", "electronic"]
-            **Current Analysis**:
-            Conversation History:
-            {history_text}
-
-            Latest Message:
-            {user_message}
-
-            **Generate JSON Response**:
-            """
-                    
-        # Call the LLM
-        response = self.chat(prompt, stream=False)
-        
-        # Extract and parse the JSON response
         if "message" in response and "content" in response["message"]:
             content = response["message"]["content"]
             
-            # Extract JSON from the response
-            import json
-            import re
-            
             # Look for JSON pattern between triple backticks
             json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
             if json_match:
@@ -218,25 +142,475 @@ class LLMManager:
             
             try:
                 result = json.loads(json_str)
-                logger.info(f"Result from LLM: {result}")
-                # Add additional safety check
-                if not isinstance(result.get("wants_recommendations"), bool):
-                    result["wants_recommendations"] = False
-                return result
-            except json.JSONDecodeError:
+                logger.debug("Result from LLM: %s", result)
+                return self._normalize_mood_analysis(result)
+            except (json.JSONDecodeError, AttributeError):
                 logger.error("Failed to parse JSON from response")
-                return {
-                    "mood": "neutral",
-                    "wants_recommendations": False,
-                    "genres": [],
-                    "artists": [],
-                    "response": "I'm not sure what you're asking. Can you clarify?"
-                }
+                return self._fallback_mood_analysis()
         
+        return self._fallback_mood_analysis()
+    
+    def _normalize_mood_analysis(self, result: Dict) -> Dict:
+        """
+        Coerce a parsed analysis into the expected field types
+        """
+        result = dict(result)
+        # Add additional safety check
+        if not isinstance(result.get("wants_recommendations"), bool):
+            result["wants_recommendations"] = False
+        if not isinstance(result.get("mood"), str):
+            result["mood"] = "neutral"
+        for key in ("genres", "artists"):
+            if not isinstance(result.get(key), list):
+                result[key] = []
+        if not isinstance(result.get("response"), str):
+            result["response"] = ""
+        return result
+    
+    def _fallback_mood_analysis(self) -> Dict:
         return {
             "mood": "neutral",
             "wants_recommendations": False,
             "genres": [],
             "artists": [],
             "response": "I'm not sure what you're asking. Can you clarify?"
-        } 
\ No newline at end of file
+        }
+
+class LLMManager(BaseLLMManager):
+    def __init__(self, base_url: str = None, model: str = DEFAULT_MODEL,
+                 prompt_builder: Optional[MoodPromptBuilder] = None,
+                 connect_timeout: float = 5.0, read_timeout: float = 120.0):
+        if base_url is None:
+            base_url = self._discover_base_url()
+        super().__init__(base_url, model, prompt_builder)
+        # Same limits as AsyncLLMManager: generations may be slow, connecting should not
+        self.timeout = (connect_timeout, read_timeout)
+    
+    def _discover_base_url(self) -> str:
+        try:
+            response = requests.get(LOCAL_OLLAMA_URL, timeout=1)
+            if response.status_code == 200:
+                logger.info("✅ Connected to Ollama on localhost")
+                return LOCAL_OLLAMA_URL
+            logger.warning("⚠️ Falling back to Docker service name 'ollama'")
+        except:
+            logger.warning("⚠️ Couldn't connect to localhost, falling back to Docker service name")
+        return DOCKER_OLLAMA_URL
+    
+    def chat(self, message: str, history: List[Dict] = None, stream: bool = True):
+        """
+        Send a message to the LLM model with conversation history
+        """
+        payload = self._build_chat_payload(message, history, stream)
+        
+        # Use the chat endpoint for more context
+        response = requests.post(self.chat_endpoint, json=payload, stream=stream, timeout=self.timeout)
+        
+        if not stream:
+            return self._clean_chat_result(response.json())
+        else:
+            return self._process_stream(response)
+    
+    def _process_stream(self, response):
+        """
+        Process a streaming response from the LLM, dropping <think> spans
+        """
+        think_filter = ThinkFilter()
+        for line in response.iter_lines():
+            if line:
+                chunk = json.loads(line)
+                if "message" in chunk and "content" in chunk["message"]:
+                    visible = think_filter.feed(chunk["message"]["content"])
+                    if visible:
+                        yield {"chunk": visible, "reasoning_done": think_filter.reasoning_ended}
+                elif "done" in chunk and chunk["done"]:
+                    break
+        
+        remainder = think_filter.flush()
+        if remainder:
+            yield {"chunk": remainder, "reasoning_done": think_filter.reasoning_ended}
+    
+    def is_model_ready(self) -> bool:
+        """
+        Check if the model is ready to use
+        """
+        try:
+            response = requests.get(self.tags_endpoint, timeout=3)
+            
+            if response.status_code == 200:
+                return self._has_model(response.json())
+            return False
+        except Exception as e:  
+            logger.error(f"Error checking if model is ready: {e}")
+            return False
+    
+    def analyze_conversation_mood(self, conversation_history, user_message):
+        """
+        Analyze the conversation to detect if the user is explicitly asking for music
+        Returns a dict with mood, recommendation_request flag, and genres
+        """
+        payload, prompt = self._build_mood_request(conversation_history, user_message, stream=False)
+                    
+        # Call the LLM
+        response = self._clean_chat_result(requests.post(self.chat_endpoint, json=payload, timeout=self.timeout).json())
+        self._log_prompt_usage(prompt, response)
+        
+        # Extract and parse the JSON response
+        return self._parse_mood_analysis(response)
+
+class AsyncLLMManager(BaseLLMManager):
+    """
+    Non-blocking Ollama client for use inside the FastAPI event loop.
+    A single pooled httpx.AsyncClient is shared by all requests so that
+    connections to Ollama are kept alive instead of reopened per call.
+    With several `endpoints`, generations are routed across them by an
+    EndpointPool; `base_url` then refers to the first endpoint.
+    """
+    def __init__(self, base_url: str = None, model: str = DEFAULT_MODEL, endpoints: Optional[List[str]] = None,
+                 hedge: bool = False,
+                 connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                 timeout: Optional[httpx.Timeout] = None, max_connections: int = 32, max_keepalive_connections: int = 16,
+                 keepalive_expiry: float = 30.0, intent_classifier=None,
+                 prompt_builder: Optional[MoodPromptBuilder] = None, scheduler=None,
+                 event_hooks: Optional[Dict] = None, response_cache=None):
+        # Endpoint discovery is deferred to start() so construction never blocks
+        if base_url is None and endpoints:
+            base_url = endpoints[0]
+        super().__init__(base_url or LOCAL_OLLAMA_URL, model, prompt_builder)
+        self._discover = base_url is None
+        self._discovery: Optional[asyncio.Task] = None
+        self._warmup: Optional[asyncio.Task] = None
+        self.pool = EndpointPool(endpoints or [self.base_url], hedge=hedge)
+        if timeout is None:
+            # Generations on CPU can take a while, connecting should not
+            timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=10.0, pool=10.0)
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        # Optional local first stage that answers easy messages without Ollama
+        self.intent_classifier = intent_classifier
+        # Optional InferenceScheduler bounding concurrent generations
+        self.scheduler = scheduler
+        self.event_hooks = event_hooks
+        # Optional SemanticCache of mood analyses shared across users
+        self.response_cache = response_cache
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits,
+                                             event_hooks=self.event_hooks)
+        return self._client
+    
+    async def start(self):
+        """
+        If no base URL was given, start locating Ollama in the background.
+        Requests made before discovery finishes go to the local endpoint.
+        """
+        if self._discover and self._discovery is None:
+            self._discovery = asyncio.create_task(self._run_discovery())
+    
+    async def wait_started(self):
+        """
+        Wait for endpoint discovery, if any, to finish
+        """
+        if self._discovery is not None:
+            await asyncio.shield(self._discovery)
+    
+    async def _run_discovery(self):
+        self._set_base_url(await self._discover_base_url())
+        self.pool.reset([self.base_url])
+        self._discover = False
+    
+    async def aclose(self):
+        """
+        Stop discovery and any warmup, and close the connection pool
+        """
+        for task in (self._discovery, self._warmup):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def warm_up(self, endpoints: List[OllamaEndpoint], keep_alive: Optional[str] = None):
+        """
+        Load the model on the given endpoints in the background, so the first
+        generation does not pay for loading it. A warmup already running is
+        left to finish instead of starting another.
+        """
+        if not endpoints or (self._warmup is not None and not self._warmup.done()):
+            return
+        self._warmup = asyncio.create_task(self._warm_up(endpoints, keep_alive))
+    
+    async def _warm_up(self, endpoints: List[OllamaEndpoint], keep_alive: Optional[str]):
+        # A chat request without messages only loads the model
+        payload = {"model": self.model, "messages": [], "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        
+        async def load(endpoint: OllamaEndpoint):
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(endpoint.chat_endpoint, json=payload)
+                response.raise_for_status()
+                logger.info(f"Warmed up {self.model} at {endpoint.base_url} in {time.perf_counter() - started:.1f}s")
+            except httpx.HTTPError as e:
+                logger.warning(f"Warmup of {self.model} at {endpoint.base_url} failed: {e}")
+        
+        await asyncio.gather(*(load(endpoint) for endpoint in endpoints))
+    
+    async def _discover_base_url(self) -> str:
+        try:
+            response = await self.client.get(LOCAL_OLLAMA_URL, timeout=1)
+            if response.status_code == 200:
+                logger.info("✅ Connected to Ollama on localhost")
+                return LOCAL_OLLAMA_URL
+            logger.warning("⚠️ Falling back to Docker service name 'ollama'")
+        except httpx.HTTPError:
+            logger.warning("⚠️ Couldn't connect to localhost, falling back to Docker service name")
+        return DOCKER_OLLAMA_URL
+    
+    async def chat(self, message: str, history: List[Dict] = None, stream: bool = True,
+                   user_id: Optional[str] = None):
+        """
+        Send a message to the LLM model with conversation history.
+        With stream=True an async generator of chunks is returned instead of the result.
+        Raises QueueFullError if the scheduler cannot admit the request.
+        """
+        payload = self._build_chat_payload(message, history, stream)
+        
+        if stream:
+            return self._process_stream(payload, user_id)
+        
+        return await self._complete(payload, user_id)
+    
+    def _slot(self, user_id: Optional[str] = None):
+        """
+        Inference slot from the scheduler, or a no-op when unscheduled
+        """
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(user_id)
+    
+    async def _complete(self, payload: Dict, user_id: Optional[str] = None) -> Dict:
+        """
+        POST a non-streamed chat payload and return the cleaned result
+        """
+        async with self._slot(user_id):
+            result = await self.pool.run(lambda endpoint: self._post_chat(endpoint, payload))
+        return self._clean_chat_result(result)
+    
+    async def _post_chat(self, endpoint: OllamaEndpoint, payload: Dict) -> Dict:
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(endpoint.chat_endpoint, json=payload)
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPError as e:
+            endpoint.record_failure(e)
+            raise
+        endpoint.observe(time.perf_counter() - started)
+        return result
+    
+    async def _open_stream(self, endpoint: OllamaEndpoint, payload: Dict):
+        """
+        Start a streamed chat on endpoint and wait for its first line. The
+        endpoint stays in flight until the stream is passed to _close_stream.
+        """
+        started = time.perf_counter()
+        response = None
+        try:
+            request = self.client.build_request("POST", endpoint.chat_endpoint, json=payload)
+            response = await self.client.send(request, stream=True)
+            response.raise_for_status()
+            lines = response.aiter_lines()
+            first = None
+            async for line in lines:
+                if line:
+                    first = line
+                    break
+        except BaseException as e:
+            # Includes cancellation of a hedged attempt that lost the race
+            if isinstance(e, httpx.HTTPError):
+                endpoint.record_failure(e)
+            if response is not None:
+                await response.aclose()
+            raise
+        endpoint.observe(time.perf_counter() - started)
+        return endpoint, response, lines, first
+    
+    async def _close_stream(self, stream):
+        endpoint, response, _, _ = stream
+        endpoint.in_flight -= 1
+        await response.aclose()
+    
+    async def _iter_stream_content(self, payload: Dict, usage: Optional[Dict] = None,
+                                   user_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """
+        Yield the raw message content of each chunk of a streamed chat response.
+        If a usage dict is given, it receives the final chunk's token counts.
+        The scheduler slot is held until the stream ends or is closed.
+        """
+        async with self._slot(user_id):
+            stream = await self.pool.run(lambda endpoint: self._open_stream(endpoint, payload),
+                                         release=self._close_stream)
+            endpoint, _, lines, line = stream
+            try:
+                while line is not None:
+                    if line:
+                        chunk = json.loads(line)
+                        if chunk.get("done"):
+                            if usage is not None:
+                                usage.update({key: value for key, value in chunk.items() if key.endswith("_count")})
+                            break
+                        if "message" in chunk and "content" in chunk["message"]:
+                            yield chunk["message"]["content"]
+                    line = await anext(lines, None)
+            except httpx.HTTPError as e:
+                endpoint.record_failure(e)
+                raise
+            finally:
+                await self._close_stream(stream)
+    
+    async def _process_stream(self, payload: Dict, user_id: Optional[str] = None) -> AsyncGenerator[Dict, None]:
+        """
+        Process a streaming response from the LLM, dropping <think> spans
+        """
+        think_filter = ThinkFilter()
+        async for content in self._iter_stream_content(payload, user_id=user_id):
+            visible = think_filter.feed(content)
+            if visible:
+                yield {"chunk": visible, "reasoning_done": think_filter.reasoning_ended}
+        
+        remainder = think_filter.flush()
+        if remainder:
+            yield {"chunk": remainder, "reasoning_done": think_filter.reasoning_ended}
+    
+    async def is_model_ready(self) -> bool:
+        """
+        Check if the model is ready to use
+        """
+        for endpoint in self.pool:
+            try:
+                response = await self.client.get(endpoint.tags_endpoint, timeout=3)
+                
+                if response.status_code == 200 and self._has_model(response.json()):
+                    return True
+            except Exception as e:  
+                logger.error(f"Error checking if model is ready at {endpoint.base_url}: {e}")
+        return False
+    
+    def _classify_locally(self, user_message) -> Optional[Dict]:
+        if self.intent_classifier is None:
+            return None
+        return self.intent_classifier.classify(user_message)
+    
+    async def analyze_conversation_mood(self, conversation_history, user_message, user_id: Optional[str] = None):
+        """
+        Analyze the conversation to detect if the user is explicitly asking for music
+        Returns a dict with mood, recommendation_request flag, and genres
+        """
+        return await self.collect_analysis(self.stream_conversation_mood(conversation_history, user_message, user_id))
+    
+    async def collect_analysis(self, events: AsyncGenerator[Dict, None]) -> Dict:
+        """
+        Consume a stream_conversation_mood() event stream and return its analysis
+        """
+        result = self._fallback_mood_analysis()
+        async with aclosing(events):
+            async for event in events:
+                if event["event"] == "analysis":
+                    result = event["result"]
+        return result
+    
+    def stream_conversation_mood(self, conversation_history, user_message,
+                                 user_id: Optional[str] = None) -> AsyncGenerator[Dict, None]:
+        """
+        Streaming mood analysis. Generation is constrained to the mood analysis
+        JSON schema and parsed incrementally; the Ollama stream is closed (which
+        cancels the generation) as soon as every required field is complete.
+        
+        Messages the intent classifier or the response cache can answer never
+        reach Ollama and are always admitted. For the others, this call itself
+        raises QueueFullError if the scheduler is saturated, so callers can
+        reject the request before doing anything else (the first iteration can
+        still raise it if the queue filled up in between).
+        Yields events:
+          {"event": "thinking"}               once, if the model starts reasoning
+          {"event": "token", "text": str}     new text of the "response" field
+          {"event": "analysis", "result": dict, "timings": dict, "prompt_tokens": dict}
+                                              the parsed analysis, last ("cached": True
+                                              instead of prompt_tokens on a cache hit)
+        """
+        fast_result = self._classify_locally(user_message)
+        if fast_result is not None:
+            return self._local_events(fast_result)
+        
+        if self.response_cache is not None:
+            cached = self.response_cache.get(conversation_history, user_message)
+            if cached is not None:
+                return self._local_events(cached, cached=True)
+        
+        if self.scheduler is not None:
+            self.scheduler.check_admission(user_id)
+        return self._stream_mood(conversation_history, user_message, user_id)
+    
+    async def _local_events(self, result: Dict, **extra) -> AsyncGenerator[Dict, None]:
+        yield {"event": "token", "text": result["response"]}
+        yield {"event": "analysis", "result": result, "timings": {}, **extra}
+    
+    async def _stream_mood(self, conversation_history, user_message,
+                           user_id: Optional[str] = None) -> AsyncGenerator[Dict, None]:
+        payload, prompt = self._build_mood_request(conversation_history, user_message, stream=True)
+        usage = {}
+        think_filter = ThinkFilter()
+        parser = IncrementalJSONObjectParser(stream_field="response")
+        visible_parts = []
+        
+        try:
+            async with aclosing(self._iter_stream_content(payload, usage, user_id)) as chunks:
+                async for content in chunks:
+                    was_reasoning = think_filter.reasoning_seen
+                    visible = think_filter.feed(content)
+                    if think_filter.reasoning_seen and not was_reasoning:
+                        yield {"event": "thinking"}
+                    
+                    if visible:
+                        visible_parts.append(visible)
+                        text = parser.feed(visible)
+                        if text:
+                            yield {"event": "token", "text": text}
+                    
+                    if parser.has_fields(MOOD_ANALYSIS_FIELDS):
+                        # Everything we need is in: stop paying for trailing tokens
+                        break
+        except httpx.HTTPError as e:
+            logger.error(f"Error streaming from Ollama: {e}")
+            yield {"event": "analysis", "result": self._fallback_mood_analysis(), "timings": think_filter.timings()}
+            return
+        
+        timings = think_filter.timings()
+        logger.debug(f"Mood analysis stream timings: {timings}")
+        self._log_prompt_usage(prompt, usage)
+        
+        if parser.has_fields(MOOD_ANALYSIS_FIELDS):
+            result = self._normalize_mood_analysis(parser.fields)
+        else:
+            # Unconstrained output (e.g. an Ollama without schema support): dig the JSON out
+            visible_parts.append(think_filter.flush())
+            result = self._parse_mood_analysis({"message": {"content": "".join(visible_parts)}})
+        
+        if self.response_cache is not None and result != self._fallback_mood_analysis():
+            self.response_cache.put(conversation_history, user_message, result)
+        
+        yield {
+            "event": "analysis",
+            "result": result,
+            "timings": timings,
+            "prompt_tokens": {"estimated": prompt.prompt_tokens, "evaluated": usage.get("prompt_eval_count")}
+        }
@@ -1,30 +1,115 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 
-# Create logs directory if it doesn't exist
-os.makedirs('logs', exist_ok=True)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line, for log shippers
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when the queue is full
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def configure_logging(level: Optional[str] = None, log_dir: Optional[str] = None,
+                      json_lines: Optional[bool] = None, max_bytes: Optional[int] = None,
+                      backup_count: Optional[int] = None, queue_size: Optional[int] = None,
+                      per_process: Optional[bool] = None) -> DroppingQueueHandler:
+    """
+    Route all logging through an in-memory queue drained by a background
+    thread, so emitting a record never does I/O on the calling thread.
+
+    Idempotent: the first call installs the pipeline on the root logger and
+    later calls return it unchanged. Unset arguments come from LOG_LEVEL,
+    LOG_DIR (empty disables the file), LOG_JSON, LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT and LOG_QUEUE_SIZE. `per_process` (default: when
+    WEB_CONCURRENCY is above 1) gives each process its own file named after
+    its pid, since rotating one file from several processes loses lines.
+    """
+    global _queue_handler, _listener
+    if _queue_handler is not None:
+        return _queue_handler
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_dir = os.getenv("LOG_DIR", "logs") if log_dir is None else log_dir
+    json_lines = os.getenv("LOG_JSON", "0") == "1" if json_lines is None else json_lines
+    max_bytes = max_bytes or int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = backup_count or int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    if per_process is None:
+        per_process = int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+
+    formatter = JSONFormatter() if json_lines else logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        filename = f"spotify_chat.{os.getpid()}.log" if per_process else "spotify_chat.log"
+        handlers.append(logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, filename), maxBytes=max_bytes, backupCount=backup_count,
+            encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+    # httpx logs every request at INFO; keep that out of the hot path unless debugging
+    if level != "DEBUG":
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    return _queue_handler
+
+def shutdown_logging():
+    """
+    Flush queued records and stop the writer thread
+    """
+    global _queue_handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener = None
+        _queue_handler = None
 
-# Configure the logger
 def setup_logger(name):
-    # Create a custom logger
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
-    # Create handlers
-    c_handler = logging.StreamHandler(sys.stdout)
-    f_handler = logging.FileHandler(f'logs/spotify_chat_{datetime.now().strftime("%Y%m%d")}.log')
-    c_handler.setLevel(logging.INFO)
-    f_handler.setLevel(logging.INFO)
-    
-    # Create formatters and add them to handlers
-    log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    c_handler.setFormatter(log_format)
-    f_handler.setFormatter(log_format)
-    
-    # Add handlers to the logger
-    logger.addHandler(c_handler)
-    logger.addHandler(f_handler)
-    
-    return logger 
\ No newline at end of file
+    """
+    Return a named logger. Records propagate to the root logger, so nothing is
+    written anywhere (and no log directory is created) until configure_logging()
+    runs, normally at application startup.
+    """
+    return logging.getLogger(name)
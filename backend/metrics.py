@@ -0,0 +1,239 @@
+import bisect
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from backend.logger import setup_logger
+
+logger = setup_logger("metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+class CallbackGauge(_Metric):
+    """
+    Gauge whose samples are read from a callback at scrape time
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Dict[Tuple[str, ...], float]],
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Metric callback for {self.name} failed: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self._values[key] = entry
+        counts, total = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus text-format registry. Metrics are updated from the event
+    loop only, so no locking is needed.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback_gauge(self, name: str, help: str, callback, labelnames: Iterable[str] = ()) -> CallbackGauge:
+        return self.register(CallbackGauge(name, help, callback, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "app_http_requests_total", "HTTP requests handled", ["method", "route", "status"])
+HTTP_DURATION = registry.histogram(
+    "app_http_request_duration_seconds", "Time until the response headers were sent", ["method", "route"])
+HTTP_IN_FLIGHT = registry.gauge(
+    "app_http_requests_in_flight", "HTTP requests currently being handled", ["route"])
+STAGE_DURATION = registry.histogram(
+    "app_stage_duration_seconds", "Duration of each request pipeline stage", ["stage"])
+STAGE_IN_FLIGHT = registry.gauge(
+    "app_stage_in_flight", "Pipeline stages currently running", ["stage"])
+UPSTREAM_RESPONSES = registry.counter(
+    "app_upstream_responses_total", "Responses from upstream services by status code", ["service", "status"])
+UPSTREAM_ERRORS = registry.counter(
+    "app_upstream_errors_total", "Upstream requests that failed without a response", ["service", "error"])
+SEMANTIC_CACHE_LOOKUPS = registry.counter(
+    "app_mood_cache_lookups_total", "Mood analysis cache lookups by result (exact, shared, near, miss)", ["result"])
+MOOD_PROMPT_TOKENS = registry.histogram(
+    "app_mood_prompt_tokens", "Prompt tokens per mood analysis: estimated before sending, and evaluated as reported by Ollama when the generation ran to completion",
+    ["kind"], buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 4096, 8192))
+INTENT_PATHS = registry.counter(
+    "app_intent_path_total", "Chat messages by the path that analysed them (greeting, recommendation, llm)", ["path"])
+TOKEN_REFRESHES = registry.counter(
+    "app_spotify_token_refreshes_total", "Spotify access token refreshes by result", ["result"])
+REQUESTS_CANCELLED = registry.counter(
+    "app_requests_cancelled_total", "Requests cancelled because the client disconnected", ["route", "stage"])
+REQUESTS_TIMED_OUT = registry.counter(
+    "app_requests_timed_out_total", "Requests that ran past their deadline or a stage budget", ["route", "stage"])
+STARTUP_SECONDS = registry.gauge(
+    "app_startup_seconds", "Seconds from importing the app to the end of startup")
+
+class RequestTimings:
+    """
+    Stage durations of one request, rendered as a Server-Timing header
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _timings.set(timings)
+    return timings
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage into the stage histogram and the current request's Server-Timing
+    """
+    STAGE_IN_FLIGHT.inc(stage=name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_IN_FLIGHT.dec(stage=name)
+        STAGE_DURATION.observe(elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+def upstream_hooks(service: str) -> Dict[str, List[Callable]]:
+    """
+    httpx event hooks counting upstream responses by status code
+    """
+    async def on_response(response: httpx.Response):
+        UPSTREAM_RESPONSES.inc(service=service, status=response.status_code)
+
+    return {"response": [on_response]}
+
+def record_upstream_error(service: str, error: Exception):
+    UPSTREAM_ERRORS.inc(service=service, error=type(error).__name__)
@@ -0,0 +1,152 @@
+import math
+from dataclasses import dataclass
+from typing import Dict, List
+
+GENRES = ["pop", "rock", "bollywood", "lo-fi", "jazz", "classical", "hip-hop", "electronic"]
+MOODS = ["happy", "sad", "calm", "energetic", "neutral"]
+
+# Static part of the mood analysis prompt. It never changes between requests,
+# so Ollama can reuse the KV cache for this prefix and only evaluate the suffix.
+MOOD_SYSTEM_PROMPT = f"""You are a music recommendation expert. Decide from the conversation whether the user wants music recommendations and reply to their latest message.
+
+Rules:
+- wants_recommendations is true ONLY if the user asks for music ("recommend songs", "make me a playlist") or clearly implies it ("I need study music", "What should I listen to?").
+- mood: infer from the whole conversation, one of {"/".join(MOODS)} (happy: joyful/excited; sad: melancholic/heartbroken; calm: relaxed/peaceful; energetic: pumped/hyped).
+- genres: ONLY genres named in the latest message, from: {", ".join(GENRES)}.
+- artists: ONLY artists named in the latest message.
+- response: a natural reply that always addresses the latest message.
+
+Answer with JSON only:
+{{"wants_recommendations": bool, "mood": str, "genres": [str], "artists": [str], "response": str}}
+
+Examples:
+"Can you suggest some upbeat pop songs?" -> {{"wants_recommendations": true, "mood": "happy", "genres": ["pop"], "artists": [], "response": "I'll find some upbeat pop tracks! Any artists you prefer?"}}
+"I just finished a workout" -> {{"wants_recommendations": false, "mood": "neutral", "genres": [], "artists": [], "response": "Great job! Want some energetic music to keep the momentum going?"}}
+"Play something like Radiohead" -> {{"wants_recommendations": true, "mood": "calm", "genres": [], "artists": ["Radiohead"], "response": "Here's something in Radiohead's style."}}"""
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (about four characters per token for English BPE vocabularies)
+    """
+    return math.ceil(len(text) / 4) if text else 0
+
+@dataclass
+class PromptBuild:
+    """
+    Messages for one mood analysis request plus their token accounting
+    """
+    messages: List[Dict[str, str]]
+    prompt_tokens: int
+    system_tokens: int
+    history_turns: int
+    summarized_turns: int = 0
+    truncated_turns: int = 0
+
+class MoodPromptBuilder:
+    """
+    Builds the mood analysis prompt as a static system message plus a small
+    dynamic user message holding the recent history and the latest message.
+
+    Recent turns are included newest first until `history_token_budget` is
+    spent; each turn is capped at `max_turn_tokens`. Older turns are folded
+    into a one-line rolling summary limited to `summary_token_budget`.
+    """
+    def __init__(self, history_token_budget: int = 192, max_turn_tokens: int = 64,
+                 summary_token_budget: int = 48, max_history_turns: int = 6,
+                 system_prompt: str = MOOD_SYSTEM_PROMPT):
+        self.history_token_budget = history_token_budget
+        self.max_turn_tokens = max_turn_tokens
+        self.summary_token_budget = summary_token_budget
+        self.max_history_turns = max_history_turns
+        self.system_prompt = system_prompt
+        self.system_tokens = estimate_tokens(system_prompt)
+
+    def build(self, conversation_history: List[Dict], user_message: str) -> PromptBuild:
+        history = list(conversation_history)
+        # The caller usually stores the latest message before analysing it
+        if history and history[-1].get("role") == "user" and history[-1].get("content") == user_message:
+            history.pop()
+
+        recent: List[str] = []
+        truncated = 0
+        budget = self.history_token_budget
+        index = len(history)
+        while index > 0 and len(recent) < self.max_history_turns:
+            entry = history[index - 1]
+            line, was_truncated = self._format_turn(entry)
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            recent.append(line)
+            truncated += was_truncated
+            budget -= cost
+            index -= 1
+        recent.reverse()
+
+        parts = []
+        summary = self._summarize(history[:index])
+        if summary:
+            parts.append(f"Earlier: {summary}")
+        if recent:
+            parts.append("History:\n" + "\n".join(recent))
+        parts.append(f"Latest message: {user_message}")
+        dynamic = "\n".join(parts)
+
+        dynamic_tokens = estimate_tokens(dynamic)
+        return PromptBuild(
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": dynamic}
+            ],
+            prompt_tokens=self.system_tokens + dynamic_tokens,
+            system_tokens=self.system_tokens,
+            history_turns=len(recent),
+            summarized_turns=index,
+            truncated_turns=truncated
+        )
+
+    def _format_turn(self, entry: Dict):
+        content = " ".join(str(entry.get("content", "")).split())
+        max_chars = self.max_turn_tokens * 4
+        was_truncated = len(content) > max_chars
+        if was_truncated:
+            content = content[:max_chars - 3].rstrip() + "..."
+        return f"{entry.get('role', 'user')}: {content}", was_truncated
+
+    def _summarize(self, older: List[Dict]) -> str:
+        """
+        Extractive rolling summary: the opening words of older user turns,
+        most recent first, until the summary budget is used up
+        """
+        max_chars = self.summary_token_budget * 4
+        snippets: List[str] = []
+        used = 0
+        for entry in reversed(older):
+            if entry.get("role") != "user":
+                continue
+            words = str(entry.get("content", "")).split()
+            if not words:
+                continue
+            snippet = " ".join(words[:8]) + ("..." if len(words) > 8 else "")
+            if used + len(snippet) + 2 > max_chars:
+                break
+            snippets.append(snippet)
+            used += len(snippet) + 2
+        if not snippets:
+            return ""
+        return "user said " + "; ".join(reversed(snippets))
+
+# JSON schema passed to Ollama's `format` option so generation is constrained
+# to a valid mood analysis object (field order matches the prompt)
+MOOD_ANALYSIS_FIELDS = ["wants_recommendations", "mood", "genres", "artists", "response"]
+MOOD_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "wants_recommendations": {"type": "boolean"},
+        "mood": {"type": "string", "enum": MOODS},
+        "genres": {"type": "array", "items": {"type": "string", "enum": GENRES}},
+        "artists": {"type": "array", "items": {"type": "string"}},
+        "response": {"type": "string"}
+    },
+    "required": MOOD_ANALYSIS_FIELDS
+}
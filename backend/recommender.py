@@ -0,0 +1,166 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.deadline import budget
+from backend.logger import setup_logger
+from backend.metrics import stage
+
+logger = setup_logger("recommender")
+
+class Recommender:
+    """
+    Two-stage track recommendation.
+
+    Candidate generation runs several Spotify searches concurrently, built
+    from the mood, the user's top artists, the requested genres and any
+    artists the LLM extracted, and pools their results by track ID. Ranking
+    scores every candidate at once with NumPy: affinity to the user's top
+    artists (and the requested ones), popularity, and how many queries found
+    it; a greedy pass then penalises repeating a primary artist.
+    """
+    def __init__(self, spotify_api, max_queries: int = 6, per_query_limit: int = 10, result_size: int = 5,
+                 affinity_weight: float = 1.0, popularity_weight: float = 0.3, consensus_weight: float = 0.4,
+                 diversity_penalty: float = 0.6, taste_profiles=None):
+        self.spotify_api = spotify_api
+        # Optional TasteProfiles prefetched at login; without one, top items are fetched per request
+        self.taste_profiles = taste_profiles
+        self.max_queries = max_queries
+        self.per_query_limit = per_query_limit
+        self.result_size = result_size
+        self.weights = np.array([affinity_weight, popularity_weight, consensus_weight], dtype=np.float32)
+        self.diversity_penalty = diversity_penalty
+
+    def build_queries(self, mood_analysis: Dict, top_artists: List[Dict], top_tracks: List[Dict],
+                      taste=None) -> List[str]:
+        """
+        Search queries for candidate generation, most specific first
+        """
+        mood = self.spotify_api.normalize_mood(mood_analysis.get("mood", ""))
+        requested = [name for name in mood_analysis.get("artists", []) if name]
+        genres = [genre for genre in mood_analysis.get("genres", []) if genre]
+        top_names = [artist.get("name", "") for artist in top_artists[:3] if artist.get("name")]
+
+        queries = [f"artist:{name}" for name in requested[:2]]
+        queries += [f"{mood} genre:{genre}" for genre in genres[:2]]
+        queries.append(self.spotify_api.create_recommendation_query(mood, top_artists, top_tracks, taste))
+        if not genres and taste is not None:
+            # Nothing requested: lean on the genre the user listens to most
+            queries += [f"{mood} genre:{genre}" for genre in taste.genres[:1]]
+        queries += [f"{mood} artist:{name}" for name in top_names[1:]]
+        queries.append(mood)
+
+        unique = list(dict.fromkeys(queries))
+        return unique[:self.max_queries]
+
+    async def recommend(self, access_token: str, mood_analysis: Dict,
+                        user_id: Optional[str] = None) -> List[Dict]:
+        """
+        Return the top `result_size` Spotify track objects for a mood analysis
+        """
+        taste = self.taste_profiles.get(user_id) if self.taste_profiles is not None else None
+        if taste is not None:
+            top_artists, top_tracks = taste.top_artists, taste.top_tracks
+        else:
+            async with budget("spotify_top_items"):
+                with stage("spotify_top_items"):
+                    top_artists, top_tracks = await self.spotify_api.get_user_top_artists_and_tracks(
+                        access_token, user_id=user_id
+                    )
+            top_artists = top_artists.get("items", [])
+            top_tracks = top_tracks.get("items", [])
+
+        queries = self.build_queries(mood_analysis, top_artists, top_tracks, taste)
+        logger.debug("Queries: %s", queries)
+        async with budget("spotify_search"):
+            with stage("spotify_search"):
+                candidates, hits = await self._gather_candidates(access_token, queries,
+                                                                 taste.market if taste is not None else None)
+
+        with stage("rerank"):
+            return self.rank(candidates, hits, len(queries), top_artists, top_tracks,
+                             mood_analysis.get("artists", []))
+
+    async def _gather_candidates(self, access_token: str, queries: List[str],
+                                 market: Optional[str] = None) -> Tuple[List[Dict], List[int]]:
+        results = await asyncio.gather(
+            *(self.spotify_api.search(access_token, query, types=["track"], limit=self.per_query_limit,
+                                      market=market)
+              for query in queries),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        for query, result in zip(queries, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Search for {query!r} failed: {result}")
+
+        # Deduplicate by track ID, counting how many queries returned each track
+        candidates: Dict[str, Dict] = {}
+        hits: Dict[str, int] = {}
+        for result in results:
+            if isinstance(result, Exception):
+                continue
+            for track in result.get("tracks", {}).get("items", []):
+                track_id = track.get("id") or track.get("uri") or track.get("name")
+                if not track_id:
+                    continue
+                candidates.setdefault(track_id, track)
+                hits[track_id] = hits.get(track_id, 0) + 1
+        return list(candidates.values()), [hits[key] for key in candidates]
+
+    def rank(self, candidates: List[Dict], hits: List[int], query_count: int, top_artists: List[Dict],
+             top_tracks: List[Dict], requested_artists: List[str]) -> List[Dict]:
+        if not candidates:
+            return []
+
+        affinity_by_artist = self._artist_affinity(top_artists, top_tracks, requested_artists)
+        artist_lists = [[artist.get("name", "").lower() for artist in track.get("artists", [])] for track in candidates]
+
+        affinity = np.array(
+            [max((affinity_by_artist.get(name, 0.0) for name in names), default=0.0) for names in artist_lists],
+            dtype=np.float32
+        )
+        popularity = np.array([track.get("popularity") or 0 for track in candidates], dtype=np.float32) / 100.0
+        consensus = np.asarray(hits, dtype=np.float32) / max(query_count, 1)
+        features = np.stack([affinity, popularity, consensus], axis=1)
+        scores = features @ self.weights
+
+        # Greedy selection: each pick lowers the score of other tracks by the same primary artist
+        primary = [names[0] if names else "" for names in artist_lists]
+        _, artist_index = np.unique(primary, return_inverse=True)
+        picked_per_artist = np.zeros(artist_index.max() + 1, dtype=np.float32)
+        available = np.ones(len(candidates), dtype=bool)
+        ranked = []
+        for _ in range(min(self.result_size, len(candidates))):
+            adjusted = np.where(available, scores - self.diversity_penalty * picked_per_artist[artist_index], -np.inf)
+            best = int(np.argmax(adjusted))
+            ranked.append(candidates[best])
+            available[best] = False
+            picked_per_artist[artist_index[best]] += 1
+        return ranked
+
+    @staticmethod
+    def _artist_affinity(top_artists: List[Dict], top_tracks: List[Dict],
+                         requested_artists: List[str]) -> Dict[str, float]:
+        """
+        Affinity in [0, 1] per lowercased artist name: rank-decayed for top
+        artists, half that for artists of top tracks, 1 for requested artists
+        """
+        affinity: Dict[str, float] = {}
+
+        def boost(name: str, value: float):
+            key = name.lower()
+            if key and value > affinity.get(key, 0.0):
+                affinity[key] = value
+
+        for rank, artist in enumerate(top_artists):
+            boost(artist.get("name", ""), 1.0 / (1.0 + 0.25 * rank))
+        for rank, track in enumerate(top_tracks):
+            for artist in track.get("artists", []):
+                boost(artist.get("name", ""), 0.5 / (1.0 + 0.25 * rank))
+        for name in requested_artists:
+            boost(name, 1.0)
+        return affinity
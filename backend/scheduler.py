@@ -0,0 +1,152 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from backend.logger import setup_logger
+
+logger = setup_logger("scheduler")
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot accept another request"""
+    def __init__(self, retry_after: float, queue_depth: int, queue_position: int):
+        super().__init__(f"Inference queue is full ({queue_depth} waiting)")
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+        self.queue_position = queue_position
+
+class InferenceScheduler:
+    """
+    Admission control in front of Ollama.
+
+    At most `max_concurrency` generations run at once. Further requests wait
+    in per-user FIFO queues that are served round-robin, so one user sending a
+    burst cannot starve the others. When `max_queue` requests are already
+    waiting (or a user has `max_queue_per_user` waiting) new requests fail
+    fast with QueueFullError carrying a retry-after estimate.
+    """
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 32, max_queue_per_user: int = 2,
+                 window: int = 1024):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.running = 0
+        self.waiting = 0
+        # Users with waiting requests, in round-robin order
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._wait_times: Deque[float] = deque(maxlen=window)
+        self._service_time = 1.0  # EWMA of slot hold time, seconds
+        self.admitted = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None):
+        """
+        Hold one inference slot for the duration of the block
+        """
+        await self.acquire(user_id or "anonymous")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self._service_time = 0.8 * self._service_time + 0.2 * held
+            self.release()
+
+    async def acquire(self, user_id: str):
+        enqueued = time.monotonic()
+        if self.running < self.max_concurrency and self.waiting == 0:
+            self.running += 1
+            self._admit(enqueued)
+            return
+
+        self.check_admission(user_id)
+
+        user_queue = self._queues.get(user_id)
+        future = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = deque()
+            self._queues[user_id] = user_queue
+        user_queue.append(future)
+        self.waiting += 1
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just as we were cancelled: pass it on
+                self.release()
+            else:
+                self._remove_waiter(user_id, future)
+            raise
+        self._admit(enqueued)
+
+    def release(self):
+        self.running -= 1
+        self._grant_next()
+
+    def check_admission(self, user_id: Optional[str] = None):
+        """
+        Raise QueueFullError if a request from user_id would be rejected now
+        """
+        if self.running < self.max_concurrency and self.waiting == 0:
+            return
+        user_queue = self._queues.get(user_id or "anonymous")
+        if self.waiting >= self.max_queue or (user_queue and len(user_queue) >= self.max_queue_per_user):
+            self.rejected += 1
+            raise QueueFullError(self.retry_after(), self.waiting, self.waiting + 1)
+
+    def retry_after(self) -> float:
+        """
+        Seconds until a newly queued request would likely be admitted
+        """
+        ahead = self.waiting + 1
+        return max(1.0, math.ceil(self._service_time * ahead / self.max_concurrency))
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self._wait_times)
+
+        def percentile(q):
+            return waits[min(len(waits) - 1, int(q * len(waits)))] if waits else 0.0
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "users_waiting": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_p50_seconds": round(percentile(0.50), 4),
+            "wait_p95_seconds": round(percentile(0.95), 4),
+            "wait_max_seconds": round(waits[-1], 4) if waits else 0.0,
+            "service_time_seconds": round(self._service_time, 4)
+        }
+
+    def _admit(self, enqueued: float):
+        self.admitted += 1
+        self._wait_times.append(time.monotonic() - enqueued)
+
+    def _grant_next(self):
+        while self._queues and self.running < self.max_concurrency:
+            user_id, user_queue = next(iter(self._queues.items()))
+            future = user_queue.popleft()
+            self.waiting -= 1
+            # Rotate: the user goes to the back of the line if more is waiting
+            del self._queues[user_id]
+            if user_queue:
+                self._queues[user_id] = user_queue
+            if future.cancelled():
+                continue
+            self.running += 1
+            future.set_result(None)
+
+    def _remove_waiter(self, user_id: str, future: asyncio.Future):
+        user_queue = self._queues.get(user_id)
+        if user_queue is None or future not in user_queue:
+            return
+        user_queue.remove(future)
+        self.waiting -= 1
+        if not user_queue:
+            del self._queues[user_id]
@@ -0,0 +1,168 @@
+import copy
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend import metrics
+from backend.intent_classifier import hash_ngrams, lexicon_labels, references_specifics
+from backend.logger import setup_logger
+
+logger = setup_logger("semantic_cache")
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, drop punctuation and collapse whitespace
+    """
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+class SemanticCache:
+    """
+    Cache of mood analysis results shared by all users.
+
+    Entries are keyed by the normalised latest message plus the last
+    `context_messages` messages of history before it, so the same words in a
+    different conversation do not share an answer. Lookups try the exact key
+    first. With `similarity` > 0, a miss then searches for a near-duplicate
+    message (cosine similarity of hashed character n-gram vectors, one NumPy
+    matrix-vector product over every entry) with the same context and the
+    same genre and mood keywords. Messages that seem to name an artist only
+    match exactly, since one differing name barely moves the similarity.
+
+    Entries expire after `ttl` seconds; beyond `maxsize` the least recently
+    used one is evicted and its matrix row reused.
+
+    With a `shared` backend (see backend.shared_cache), entries are also
+    stored there and an exact-key miss is looked up there before the
+    near-duplicate search, so analyses are reused across worker processes.
+    Near-duplicate search only covers the entries this process holds.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, similarity: float = 0.9,
+                 context_messages: int = 2, dimensions: int = 2 ** 10, ngram_range=(2, 4), shared=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self.context_messages = context_messages
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        self.shared = shared
+        # Key -> (value, matrix row); kept in LRU order
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, int]]" = OrderedDict()
+        self._vectors = np.zeros((maxsize, dimensions), dtype=np.float32)
+        # Near-duplicates must match this per-row hash of context and keywords
+        self._groups = np.zeros(maxsize, dtype=np.int64)
+        self._expires = np.full(maxsize, -np.inf)
+        self._row_keys: List[Optional[Tuple[str, str]]] = [None] * maxsize
+        self._free_rows = list(range(maxsize - 1, -1, -1))
+        self.hits = 0
+        self.shared_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _context(self, history: List[Dict], message: str) -> str:
+        history = list(history or [])
+        # Callers usually store the message before analysing it
+        if history and history[-1].get("role") == "user" and history[-1].get("content") == message:
+            history.pop()
+        recent = history[-self.context_messages:] if self.context_messages else []
+        return "\n".join(f"{turn.get('role', '')}:{normalize_text(turn.get('content', ''))}" for turn in recent)
+
+    def _group(self, context: str, message: str) -> int:
+        return hash((context, lexicon_labels(message)))
+
+    def get(self, history: List[Dict], message: str) -> Optional[Any]:
+        """
+        Return a copy of the cached value for this message and context, or None
+        """
+        context = self._context(history, message)
+        key = (context, normalize_text(message))
+        now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, row = entry
+            if self._expires[row] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="exact")
+                return copy.deepcopy(value)
+            self._drop(key)
+
+        if self.shared is not None:
+            found = self.shared.get("mood_analysis", key)
+            if found is not None:
+                value, stored_at = found
+                self._insert(key, context, message, value, now + self.ttl - max(0.0, time.time() - stored_at))
+                self.shared_hits += 1
+                metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="shared")
+                return copy.deepcopy(value)
+
+        if self.similarity > 0 and self._entries and not references_specifics(message):
+            query = hash_ngrams(key[1], self.dimensions, self.ngram_range)
+            scores = self._vectors @ query
+            candidates = (self._groups == self._group(context, message)) & (self._expires > now)
+            scores = np.where(candidates, scores, -1.0)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity:
+                match = self._row_keys[best]
+                self._entries.move_to_end(match)
+                self.near_hits += 1
+                metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="near")
+                logger.debug(f"Near-duplicate of {match[1]!r} ({scores[best]:.3f}) for {key[1]!r}")
+                return copy.deepcopy(self._entries[match][0])
+
+        self.misses += 1
+        metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="miss")
+        return None
+
+    def put(self, history: List[Dict], message: str, value: Any):
+        context = self._context(history, message)
+        key = (context, normalize_text(message))
+        self._insert(key, context, message, value, time.monotonic() + self.ttl)
+        if self.shared is not None:
+            self.shared.set("mood_analysis", key, value, self.ttl)
+
+    def _insert(self, key: Tuple[str, str], context: str, message: str, value: Any, expires_at: float):
+        if key in self._entries:
+            self._drop(key)
+        while not self._free_rows:
+            self._drop(next(iter(self._entries)))
+
+        row = self._free_rows.pop()
+        self._vectors[row] = hash_ngrams(key[1], self.dimensions, self.ngram_range)
+        self._groups[row] = self._group(context, message)
+        self._expires[row] = expires_at
+        self._row_keys[row] = key
+        self._entries[key] = (copy.deepcopy(value), row)
+
+    def _drop(self, key: Tuple[str, str]):
+        _, row = self._entries.pop(key)
+        self._expires[row] = -np.inf
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._drop(key)
+
+    def hit_rate(self) -> float:
+        found = self.hits + self.shared_hits + self.near_hits
+        lookups = found + self.misses
+        return found / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate()
+        }
@@ -0,0 +1,184 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from backend.logger import setup_logger
+
+logger = setup_logger("shared_cache")
+
+class SQLiteCacheBackend:
+    """
+    Cache entries shared by every worker process on one host.
+
+    The in-process caches (TTLCache, SemanticCache) stay the first tier and
+    consult a shared backend only on a local miss, so what one worker fetched
+    or generated is reused by the others instead of being recomputed. A
+    backend provides:
+
+        get(namespace, key) -> (value, stored_at) or None
+        set(namespace, key, value, ttl)
+        delete(namespace, key)
+        stats(), close()
+
+    where keys are JSON-encodable (tuples included), values are JSON
+    documents and stored_at is wall-clock time. This one keeps them in a
+    SQLite file; something like Redis would take its place across hosts.
+
+    Reads are single indexed lookups on the caller's thread. Writes are
+    queued and group-committed by a background thread, which also purges
+    expired entries every `purge_interval` seconds.
+    """
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.05,
+                 purge_interval: float = 300.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        self._queue: "queue.Queue" = queue.Queue()
+        self.hits = 0
+        self.misses = 0
+        self.committed_batches = 0
+
+        with self._connect() as conn:
+            conn.execute(self._SCHEMA)
+
+        self._writer_conn = self._connect()
+        self._writer = threading.Thread(target=self._write_loop, name="cache-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @property
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode_key(key: Hashable) -> str:
+        return json.dumps(key, separators=(",", ":"))
+
+    def get(self, namespace: str, key: Hashable) -> Optional[Tuple[Any, float]]:
+        try:
+            row = self._reader.execute(
+                "SELECT value, stored_at FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, self._encode_key(key), time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            # The local tier still works; treat the shared one as empty
+            logger.warning(f"Shared cache read failed: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def set(self, namespace: str, key: Hashable, value: Any, ttl: float):
+        now = time.time()
+        self._queue.put(("set", namespace, self._encode_key(key), json.dumps(value), now, now + ttl))
+
+    def delete(self, namespace: str, key: Hashable):
+        self._queue.put(("delete", namespace, self._encode_key(key)))
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Block until every write queued so far has been committed
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._writer_conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        entries, = self._reader.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        return {
+            "backend": "sqlite",
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_writes": self._queue.qsize(),
+            "committed_batches": self.committed_batches
+        }
+
+    def _write_loop(self):
+        next_purge = time.monotonic() + self.purge_interval
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            # Group-commit whatever else is already queued
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            purge = time.monotonic() >= next_purge
+            writes = [op for op in batch if isinstance(op, tuple)]
+            if writes or purge:
+                try:
+                    self._commit(writes, purge)
+                except sqlite3.Error as e:
+                    # Losing cache writes only costs a later miss
+                    logger.error(f"Failed to write {len(writes)} shared cache entries: {e}")
+                if purge:
+                    next_purge = time.monotonic() + self.purge_interval
+
+            for op in batch:
+                if isinstance(op, threading.Event):
+                    op.set()
+            if any(op is None for op in batch):
+                return
+
+    def _commit(self, writes, purge: bool):
+        conn = self._writer_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op in writes:
+                if op[0] == "set":
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache_entries (namespace, key, value, stored_at, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)", op[1:]
+                    )
+                else:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", op[1:])
+            if purge:
+                conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.committed_batches += 1
@@ -1,13 +1,80 @@
-import requests
-from typing import Dict, List, Optional, Any
+import asyncio
+import httpx
+from typing import Dict, List, Optional, Any, Tuple
 import json
+from backend.auth import SPOTIFY_API_URL
+from backend.cache import TTLCache
 from backend.logger import setup_logger
+from backend.metrics import record_upstream_error
 logger = setup_logger("spotify_api")
 
+# Mood words worth putting into a search query
+VALID_MOODS = [
+    "happy", "sad", "energetic", "relaxed", "calm", "excited",
+    "peaceful", "angry", "romantic", "melancholy", "upbeat", "chill"
+]
+
+class SpotifyAPIError(Exception):
+    """Raised when a Spotify Web API call fails or returns a non-200 status"""
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class SpotifyAuthError(SpotifyAPIError):
+    """Raised when Spotify rejects the access token (401) and it could not be refreshed"""
+
+class _TokenRejected(SpotifyAPIError):
+    """A 401 inside a load shared by several callers; each retries with its own token"""
+
 class SpotifyAPI:
-    def __init__(self, auth_manager):
+    """
+    Async Spotify Web API client. All calls share one pooled HTTP/1.1 client so
+    connections to api.spotify.com are kept alive between requests.
+    """
+    def __init__(self, auth_manager, timeout: float = 10.0, max_connections: int = 50,
+                 max_keepalive_connections: int = 20, keepalive_expiry: float = 60.0,
+                 top_items_cache: Optional[TTLCache] = None, search_cache: Optional[TTLCache] = None,
+                 base_url: str = SPOTIFY_API_URL, event_hooks: Optional[Dict] = None, token_manager=None,
+                 shared_cache=None):
         self.auth_manager = auth_manager
-        self.base_url = "https://api.spotify.com/v1"
+        # Optional TokenManager used to replace a rejected token and retry once
+        self.token_manager = token_manager
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.event_hooks = event_hooks
+        self._client: Optional[httpx.AsyncClient] = None
+        # Top artists/tracks change slowly: serve them from cache for hours and
+        # refresh in the background once an entry goes stale
+        if top_items_cache is None:
+            top_items_cache = TTLCache(maxsize=4096, ttl=6 * 3600, stale_ttl=18 * 3600,
+                                       shared=shared_cache, namespace="spotify_top_items")
+        self.top_items_cache = top_items_cache
+        # Search results are not user specific, so identical queries from
+        # different users share one entry and one in-flight upstream call
+        if search_cache is None:
+            search_cache = TTLCache(maxsize=2048, ttl=600, stale_ttl=3000,
+                                    shared=shared_cache, namespace="spotify_search")
+        self.search_cache = search_cache
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits,
+                                             event_hooks=self.event_hooks)
+        return self._client
+    
+    async def aclose(self):
+        """
+        Close the connection pool
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     def _get_headers(self, access_token: str) -> Dict[str, str]:
         """Generate headers with authorization for Spotify API requests"""
@@ -16,36 +83,91 @@ class SpotifyAPI:
             "Content-Type": "application/json"
         }
     
-    def get_user_top_items(self, access_token: str, item_type: str, limit: int = 10, 
-                           time_range: str = "medium_term") -> Dict[str, Any]:
+    async def _get(self, endpoint: str, access_token: str, params: Dict[str, Any],
+                   shared: bool = False) -> Dict[str, Any]:
+        """
+        GET a Spotify endpoint and return the decoded JSON, raising SpotifyAPIError on failure
+        (SpotifyAuthError if the token is rejected and cannot be refreshed). With shared=True
+        (a load other users wait on too) a 401 raises _TokenRejected without refreshing, so
+        one user's bad token is not reported to everyone else.
+        """
+        response = await self._send_get(endpoint, access_token, params)
+        if response.status_code == 401 and shared:
+            raise _TokenRejected("HTTP 401", 401)
+        if response.status_code == 401 and self.token_manager is not None:
+            # Expired or revoked token: refresh it and retry once
+            refreshed = await self.token_manager.refresh_rejected(access_token)
+            if refreshed is not None:
+                response = await self._send_get(endpoint, refreshed, params)
+        
+        if response.status_code == 401:
+            raise SpotifyAuthError("HTTP 401", 401)
+        if response.status_code != 200:
+            logger.debug(response.text)
+            raise SpotifyAPIError(f"HTTP {response.status_code}", response.status_code)
+        return response.json()
+    
+    async def _send_get(self, endpoint: str, access_token: str, params: Dict[str, Any]) -> httpx.Response:
+        try:
+            return await self.client.get(endpoint, headers=self._get_headers(access_token), params=params)
+        except httpx.HTTPError as e:
+            record_upstream_error("spotify", e)
+            raise SpotifyAPIError(str(e) or type(e).__name__) from e
+    
+    async def get_current_user(self, access_token: str) -> Dict[str, Any]:
+        """
+        The current user's profile, raising SpotifyAPIError on failure
+        """
+        return await self._get(f"{self.base_url}/me", access_token, {})
+    
+    async def get_user_top_items(self, access_token: str, item_type: str, limit: int = 10, 
+                           time_range: str = "medium_term", user_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Get user's top artists or tracks
         item_type: 'artists' or 'tracks'
         time_range: 'short_term' (4 weeks), 'medium_term' (6 months), 'long_term' (years)
+        user_id: Spotify user ID; when given, results are served from the per-user cache
         """
         endpoint = f"{self.base_url}/me/top/{item_type}"
-        headers = self._get_headers(access_token)
         params = {
             "limit": limit,
             "time_range": time_range
         }
         
-        response = requests.get(endpoint, headers=headers, params=params)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Error getting top {item_type}: {response.status_code}")
-            logger.debug(response.text)
+        async def load():
+            return await self._get(endpoint, access_token, params)
+        
+        try:
+            if user_id is None:
+                return await load()
+            return await self.top_items_cache.get_or_load((user_id, item_type, time_range, limit), load)
+        except SpotifyAuthError:
+            raise
+        except SpotifyAPIError as e:
+            logger.error(f"Error getting top {item_type}: {e}")
             return {"items": []}
     
-    def search(self, access_token: str, query: str, types: List[str] = ["track"], 
+    async def get_user_top_artists_and_tracks(self, access_token: str, limit: int = 10,
+                                              time_range: str = "medium_term",
+                                              user_id: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Fetch top artists and top tracks concurrently (one round trip instead of two)
+        """
+        top_artists, top_tracks = await asyncio.gather(
+            self.get_user_top_items(access_token, "artists", limit=limit, time_range=time_range, user_id=user_id),
+            self.get_user_top_items(access_token, "tracks", limit=limit, time_range=time_range, user_id=user_id)
+        )
+        return top_artists, top_tracks
+    
+    async def search(self, access_token: str, query: str, types: List[str] = ["track"], 
                limit: int = 5, market: Optional[str] = None) -> Dict[str, Any]:
         """
         Search for tracks, artists, albums, etc.
         types: List of item types to search across ('track', 'artist', 'album', 'playlist')
         """
         endpoint = f"{self.base_url}/search"
-        headers = self._get_headers(access_token)
+        key = self._search_cache_key(query, types, limit, market)
+        query, types, limit, market = key
         
         # Join types with commas
         type_param = ",".join(types)
@@ -58,41 +180,76 @@ class SpotifyAPI:
         
         if market:
             params["market"] = market
+        
+        async def load():
+            return await self._get(endpoint, access_token, params, shared=True)
             
-        response = requests.get(endpoint, headers=headers, params=params)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Error searching Spotify: {response.status_code}")
-            logger.debug(response.text)
+        try:
+            try:
+                return await self.search_cache.get_or_load(key, load)
+            except _TokenRejected:
+                # Whoever started the shared load had their token rejected: retry
+                # with our own, refreshing it if needed, and only we see an auth error
+                result = await self._get(endpoint, access_token, params)
+                self.search_cache.set(key, result)
+                return result
+        except SpotifyAuthError:
+            raise
+        except SpotifyAPIError as e:
+            logger.error(f"Error searching Spotify: {e}")
             return {}
     
+    @staticmethod
+    def _search_cache_key(query: str, types: List[str], limit: int,
+                          market: Optional[str]) -> Tuple[str, Tuple[str, ...], int, Optional[str]]:
+        """
+        Normalize search parameters so equivalent searches share a cache entry
+        """
+        normalized_query = " ".join(query.lower().split())
+        normalized_types = tuple(sorted(set(types)))
+        normalized_market = market.upper() if market else None
+        return normalized_query, normalized_types, limit, normalized_market
+    
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Hit/miss counters of the top-items and search caches
+        """
+        return {
+            "top_items": self.top_items_cache.stats(),
+            "search": self.search_cache.stats()
+        }
+    
+    @staticmethod
+    def normalize_mood(mood: str) -> str:
+        """
+        Return mood if it is a recognized mood word, otherwise "chill"
+        """
+        mood = (mood or "").lower()
+        return mood if mood in VALID_MOODS else "chill"
+    
     def create_recommendation_query(self, mood: str, top_artists: List[Dict], 
-                                  top_tracks: List[Dict]) -> str:
+                                  top_tracks: List[Dict], taste=None) -> str:
         """
-        Create a search query based on user's mood and top artists/tracks
+        Create a search query based on user's mood and top artists/tracks.
+        With a TasteProfile, the artist the user has played most recently is used.
         """
         # Validate mood - only use if it's a recognized mood word
-        valid_moods = [
-            "happy", "sad", "energetic", "relaxed", "calm", "excited", 
-            "peaceful", "angry", "romantic", "melancholy", "upbeat", "chill"
-        ]
-        
-        # Default to neutral if not recognized
-        if mood.lower() not in valid_moods:
-            mood = "chill"
+        mood = self.normalize_mood(mood)
         
         # Extract artist names and track names
-        artist_names = [artist.get("name", "") for artist in top_artists[:3]]
+        if taste is not None and taste.recent_artists:
+            artist_names = taste.recent_artists[:3]
+        else:
+            artist_names = [artist.get("name", "") for artist in top_artists[:3] if artist.get("name")]
         
         # Build the query with mood and artists
         query_parts = [mood]
         
         if artist_names:
             # Add top artist to query
-            top_artist = f"artist:{artist_names[1]}"
+            top_artist = f"artist:{artist_names[0]}"
             query_parts.append(top_artist)
         
         # Join all parts with spaces
         query = " ".join(query_parts)
-        return query 
\ No newline at end of file
+        return query
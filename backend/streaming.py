@@ -0,0 +1,266 @@
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+
+class JSONStringDecoder:
+    """
+    Incrementally decode the body of a JSON string (the text after its opening
+    quote). Escape sequences split across chunks are held back until complete.
+    """
+    def __init__(self):
+        self._buffer = ""
+        self.done = False
+
+    def feed(self, text: str) -> str:
+        if self.done:
+            return ""
+        buffer = self._buffer + text
+        decoded: List[str] = []
+        i = 0
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char == '\\':
+                # Wait for the rest of an escape sequence split across chunks
+                if i + 1 >= len(buffer):
+                    break
+                length = 6 if buffer[i + 1] == 'u' else 2
+                if i + length > len(buffer):
+                    break
+                if length == 6 and buffer[i + 2:i + 4].lower() in ("d8", "d9", "da", "db"):
+                    # A high surrogate is decoded together with the low surrogate after it
+                    length = 12
+                    if i + length > len(buffer):
+                        break
+                try:
+                    decoded.append(json.loads('"' + buffer[i:i + length] + '"'))
+                except json.JSONDecodeError:
+                    decoded.append(buffer[i + 1:i + length])
+                i += length
+                continue
+            decoded.append(char)
+            i += 1
+
+        self._buffer = buffer[i:]
+        return "".join(decoded)
+
+
+class IncrementalJSONObjectParser:
+    """
+    Parse one top-level JSON object as it is being generated.
+
+    Each top-level field is decoded as soon as its value is complete and made
+    available in `fields`, so a caller can stop the generation once the fields
+    it needs are in. The string value of `stream_field` is additionally decoded
+    character by character and returned from feed() while it is produced.
+    Text before the opening brace (e.g. a code fence) is ignored.
+    """
+    _WHITESPACE = " \t\r\n"
+
+    def __init__(self, stream_field: Optional[str] = None):
+        self.stream_field = stream_field
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self.errors: List[str] = []
+        self._state = "start"
+        self._key: List[str] = []
+        self._current_key: Optional[str] = None
+        self._value: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._decoder: Optional[JSONStringDecoder] = None
+
+    def has_fields(self, names) -> bool:
+        return all(name in self.fields for name in names)
+
+    def feed(self, text: str) -> str:
+        """
+        Consume a chunk; return newly decoded text of the streamed field
+        """
+        streamed: List[str] = []
+        for char in text:
+            if self.done:
+                break
+            self._step(char, streamed)
+        return "".join(streamed)
+
+    def _step(self, char: str, streamed: List[str]):
+        state = self._state
+        if state == "start":
+            if char == "{":
+                self._state = "key_or_end"
+        elif state == "key_or_end":
+            if char == '"':
+                self._key = []
+                self._state = "key"
+            elif char == "}":
+                self.done = True
+        elif state == "key":
+            if self._escape:
+                self._escape = False
+                self._key.append(char)
+            elif char == "\\":
+                self._escape = True
+                self._key.append(char)
+            elif char == '"':
+                self._current_key = json.loads('"' + "".join(self._key) + '"')
+                self._state = "colon"
+            else:
+                self._key.append(char)
+        elif state == "colon":
+            if char == ":":
+                self._state = "value_start"
+        elif state == "value_start":
+            if char in self._WHITESPACE:
+                return
+            self._value = [char]
+            self._depth = 0
+            self._in_string = char == '"'
+            if char in "[{":
+                self._depth = 1
+            if self._in_string and self._current_key == self.stream_field:
+                self._decoder = JSONStringDecoder()
+            self._state = "value"
+        elif state == "value":
+            self._step_value(char, streamed)
+        elif state == "after_value":
+            if char == ",":
+                self._state = "key_or_end"
+            elif char == "}":
+                self.done = True
+
+    def _step_value(self, char: str, streamed: List[str]):
+        if self._in_string:
+            self._value.append(char)
+            if self._decoder is not None:
+                streamed.append(self._decoder.feed(char))
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    self._decoder = None
+                    self._complete_value()
+            return
+
+        if char == '"':
+            self._in_string = True
+            self._value.append(char)
+        elif char in "[{":
+            self._depth += 1
+            self._value.append(char)
+        elif char in "]}" and self._depth > 0:
+            self._depth -= 1
+            self._value.append(char)
+            if self._depth == 0:
+                self._complete_value()
+        elif self._depth == 0 and (char in ",}" or char in self._WHITESPACE):
+            # End of a scalar (number, true, false, null)
+            self._complete_value()
+            if char == ",":
+                self._state = "key_or_end"
+            elif char == "}":
+                self.done = True
+        else:
+            self._value.append(char)
+
+    def _complete_value(self):
+        raw = "".join(self._value)
+        try:
+            self.fields[self._current_key] = json.loads(raw)
+        except json.JSONDecodeError:
+            self.errors.append(f"invalid value for {self._current_key!r}: {raw[:40]}")
+        self._state = "after_value"
+
+
+class ThinkFilter:
+    """
+    Stateful filter that removes <think>...</think> reasoning spans from a stream
+    of chunks. Tags split across chunk boundaries are handled by carrying over at
+    most len(tag) - 1 characters, so each chunk is processed in O(len(chunk)).
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.in_reasoning = False
+        self.reasoning_seen = False
+        self.reasoning_ended = False
+        self._pending = ""
+        self.started_at = time.perf_counter()
+        self.reasoning_ended_at: Optional[float] = None
+        self.first_visible_at: Optional[float] = None
+
+    def feed(self, chunk: str) -> str:
+        """
+        Consume a chunk and return the part of it that is visible to the user
+        """
+        text = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+        visible: List[str] = []
+        pos = 0
+
+        while pos < len(text):
+            tag = self.CLOSE_TAG if self.in_reasoning else self.OPEN_TAG
+            index = text.find(tag, pos)
+            if index == -1:
+                # Hold back a trailing partial tag until the next chunk arrives
+                end = len(text) - self._partial_tag_length(text, pos, tag)
+                if not self.in_reasoning:
+                    visible.append(text[pos:end])
+                self._pending = text[end:]
+                break
+
+            if self.in_reasoning:
+                self.in_reasoning = False
+                self.reasoning_ended = True
+                self.reasoning_ended_at = time.perf_counter()
+            else:
+                visible.append(text[pos:index])
+                self.in_reasoning = True
+                self.reasoning_seen = True
+            pos = index + len(tag)
+
+        return self._emit("".join(visible))
+
+    def flush(self) -> str:
+        """
+        Return any held-back text once the stream has ended
+        """
+        pending, self._pending = self._pending, ""
+        if self.in_reasoning:
+            return ""
+        return self._emit(pending)
+
+    def timings(self) -> Dict[str, Optional[float]]:
+        """
+        Seconds from the start of the stream until reasoning ended and until
+        the first visible character was produced
+        """
+        def since_start(timestamp):
+            return None if timestamp is None else timestamp - self.started_at
+
+        return {
+            "reasoning_seconds": since_start(self.reasoning_ended_at),
+            "first_visible_seconds": since_start(self.first_visible_at)
+        }
+
+    def _emit(self, visible: str) -> str:
+        if visible and self.first_visible_at is None:
+            self.first_visible_at = time.perf_counter()
+        return visible
+
+    @staticmethod
+    def _partial_tag_length(text: str, start: int, tag: str) -> int:
+        # Longest suffix of text[start:] that is a proper prefix of tag
+        for length in range(min(len(tag) - 1, len(text) - start), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
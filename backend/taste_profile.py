@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set
+
+from backend.cache import TTLCache
+from backend.logger import setup_logger
+from backend.spotify_api import SpotifyAPIError
+
+logger = setup_logger("taste_profile")
+
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+# Recent listening says most about what the user wants now
+RANGE_WEIGHTS = {"short_term": 1.0, "medium_term": 0.8, "long_term": 0.5}
+
+@dataclass(frozen=True)
+class TasteProfile:
+    """
+    Compact summary of a user's listening, built once at login
+    """
+    user_id: str
+    # Top artists and tracks blended across time ranges, best first, trimmed
+    # to the fields the recommender reads
+    top_artists: List[Dict] = field(default_factory=list)
+    top_tracks: List[Dict] = field(default_factory=list)
+    # Artists of the last four weeks, most played first
+    recent_artists: List[str] = field(default_factory=list)
+    genres: List[str] = field(default_factory=list)
+    market: Optional[str] = None
+    fetched_at: float = 0.0
+
+def _blend(items_by_range: Dict[str, List[Dict]], limit: int) -> List[Dict]:
+    """
+    Merge ranked lists from each time range, scoring items by rank-decayed range weight
+    """
+    scores: Dict[str, float] = {}
+    items: Dict[str, Dict] = {}
+    for time_range, ranked in items_by_range.items():
+        for rank, item in enumerate(ranked):
+            key = item.get("id") or item.get("name")
+            if not key:
+                continue
+            items.setdefault(key, item)
+            scores[key] = scores.get(key, 0.0) + RANGE_WEIGHTS[time_range] / (1.0 + 0.25 * rank)
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [items[key] for key in best]
+
+def build_taste_profile(profile: Dict, artists_by_range: Dict[str, List[Dict]],
+                        tracks_by_range: Dict[str, List[Dict]], limit: int = 20) -> TasteProfile:
+    top_artists = [
+        {"id": artist.get("id"), "name": artist.get("name", ""), "genres": artist.get("genres", [])}
+        for artist in _blend(artists_by_range, limit)
+    ]
+    top_tracks = [
+        {"id": track.get("id"), "name": track.get("name", ""),
+         "artists": [{"name": artist.get("name", "")} for artist in track.get("artists", [])]}
+        for track in _blend(tracks_by_range, limit)
+    ]
+    genres = Counter(genre for artist in top_artists for genre in artist["genres"])
+    return TasteProfile(
+        user_id=profile.get("id", ""),
+        top_artists=top_artists,
+        top_tracks=top_tracks,
+        recent_artists=[artist.get("name", "") for artist in artists_by_range.get("short_term", [])
+                        if artist.get("name")],
+        genres=[genre for genre, _ in genres.most_common(10)],
+        market=profile.get("country"),
+        fetched_at=time.time()
+    )
+
+class TasteProfiles:
+    """
+    Per-user taste profiles, prefetched in the background when a user logs in
+    so the first recommendation does not wait on Spotify's top-items calls
+    """
+    def __init__(self, spotify_api, ttl: float = 6 * 3600, maxsize: int = 10000, limit: int = 10,
+                 shared_cache=None):
+        self.spotify_api = spotify_api
+        self.limit = limit
+        # Shared, the worker that handled the login is not the only one with the profile
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, shared=shared_cache, namespace="taste_profile",
+                              serialize=asdict, deserialize=lambda data: TasteProfile(**data))
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, user_id: Optional[str]) -> Optional[TasteProfile]:
+        if not user_id:
+            return None
+        return self.cache.get(user_id)
+
+    async def prefetch(self, access_token: str) -> Dict:
+        """
+        Fetch the user's profile and, concurrently, their top artists and
+        tracks for every time range. Returns the profile as soon as it arrives;
+        the taste profile is built and stored in the background.
+        Raises SpotifyAPIError if the profile cannot be fetched.
+        """
+        top_items = asyncio.create_task(self._fetch_top_items(access_token))
+        try:
+            profile = await self.spotify_api.get_current_user(access_token)
+        except BaseException:
+            top_items.cancel()
+            raise
+
+        task = asyncio.create_task(self._store(profile, top_items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return profile
+
+    async def _fetch_top_items(self, access_token: str):
+        requests = [(item_type, time_range) for item_type in ("artists", "tracks") for time_range in TIME_RANGES]
+        results = await asyncio.gather(*(
+            self.spotify_api.get_user_top_items(access_token, item_type, limit=self.limit, time_range=time_range)
+            for item_type, time_range in requests
+        ))
+        by_type: Dict[str, Dict[str, List[Dict]]] = {"artists": {}, "tracks": {}}
+        for (item_type, time_range), result in zip(requests, results):
+            by_type[item_type][time_range] = result.get("items", [])
+        return by_type["artists"], by_type["tracks"]
+
+    async def _store(self, profile: Dict, top_items: asyncio.Task):
+        user_id = profile.get("id")
+        try:
+            artists_by_range, tracks_by_range = await top_items
+        except SpotifyAPIError as e:
+            logger.warning(f"Taste profile prefetch failed: {e}")
+            return
+        if not user_id or not (any(artists_by_range.values()) or any(tracks_by_range.values())):
+            # Nothing learned; recommendations fall back to fetching top items per request
+            return
+        taste = build_taste_profile(profile, artists_by_range, tracks_by_range)
+        self.cache.set(user_id, taste)
+        logger.debug(f"Taste profile for {user_id}: {len(taste.top_artists)} artists, genres {taste.genres[:3]}")
+
+    async def aclose(self):
+        """
+        Cancel prefetches still running
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.cache.stats(), "prefetching": len(self._tasks)}
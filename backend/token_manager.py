@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Dict, MutableMapping, Optional
+
+import requests
+
+from backend import metrics
+from backend.logger import setup_logger
+
+logger = setup_logger("token_manager")
+
+@dataclass
+class TokenSet:
+    access_token: str
+    refresh_token: Optional[str]
+    # Wall-clock time, so it can be stored in the session cookie
+    expires_at: float
+    # When to start refreshing: refresh_margin before expiry, or earlier
+    # for short-lived tokens
+    refresh_at: float
+    last_used: float
+
+class TokenManager:
+    """
+    Keeps each logged-in user's Spotify access token fresh.
+
+    Tokens are tracked with their expiry. A background loop refreshes tokens
+    of recently active users shortly before they expire; a token found close
+    to expiry on access is refreshed inline. Concurrent refreshes for one
+    user share a single call to the accounts service. SpotifyAPI calls
+    refresh_rejected() on a 401 to get a new token and retry once.
+
+    The session stays the source of truth across restarts and worker
+    processes: unknown users are seeded from it, tokens another process
+    refreshed are picked up from it, and refreshed tokens are written back
+    into it on the user's next request. With several workers, pass
+    refresh_in_background=False: each worker's loop would otherwise refresh
+    the same users independently, and once Spotify rotates a refresh token
+    the other workers' refreshes fail and log those users out. Tokens are
+    then refreshed only on request, and the session carries the result to
+    the other workers.
+    """
+    def __init__(self, auth, refresh_margin: float = 300.0, check_interval: float = 60.0,
+                 idle_ttl: float = 3600.0, default_expires_in: float = 3600.0,
+                 refresh_in_background: bool = True):
+        self.auth = auth
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.idle_ttl = idle_ttl
+        self.default_expires_in = default_expires_in
+        self.refresh_in_background = refresh_in_background
+        self._tokens: Dict[str, TokenSet] = {}
+        self._keys_by_token: Dict[str, str] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.coalesced = 0
+
+    @staticmethod
+    def session_key(session: MutableMapping) -> Optional[str]:
+        """
+        The Spotify user id, or a digest of the refresh token when the login
+        could not fetch the profile; the key is logged, so never the token itself
+        """
+        if session.get("user_id"):
+            return session["user_id"]
+        refresh_token = session.get("refresh_token")
+        if not refresh_token:
+            return None
+        return "refresh:" + hashlib.sha256(refresh_token.encode()).hexdigest()[:16]
+
+    def register(self, key: str, tokens: Dict) -> TokenSet:
+        """
+        Track tokens from a token response (expires_in) or a session (expires_at)
+        """
+        now = time.time()
+        expires_at = tokens.get("expires_at") or now + float(tokens.get("expires_in") or self.default_expires_in)
+        previous = self._tokens.get(key)
+        if previous is not None:
+            self._keys_by_token.pop(previous.access_token, None)
+        token_set = TokenSet(
+            access_token=tokens["access_token"],
+            refresh_token=tokens.get("refresh_token") or (previous.refresh_token if previous else None),
+            expires_at=expires_at,
+            refresh_at=expires_at - min(self.refresh_margin, max(expires_at - now, 0.0) / 4),
+            last_used=now
+        )
+        self._tokens[key] = token_set
+        self._keys_by_token[token_set.access_token] = key
+        return token_set
+
+    def forget(self, key: Optional[str]):
+        token_set = self._tokens.pop(key, None)
+        if token_set is not None:
+            self._keys_by_token.pop(token_set.access_token, None)
+
+    async def access_token(self, session: MutableMapping) -> Optional[str]:
+        """
+        Return a usable access token for the session's user, refreshing it if
+        it is about to expire, or None if it has expired and cannot be refreshed
+        """
+        key = self.session_key(session)
+        if key is None or not session.get("access_token"):
+            return None
+
+        token_set = self._tokens.get(key)
+        if token_set is None or (session.get("token_expires_at") or 0) > token_set.expires_at:
+            # Unknown here, or another worker process refreshed it since
+            token_set = self.register(key, {
+                "access_token": session["access_token"],
+                "refresh_token": session.get("refresh_token"),
+                "expires_at": session.get("token_expires_at")
+            })
+        now = time.time()
+        token_set.last_used = now
+
+        if now >= token_set.refresh_at:
+            token_set = await self._refresh(key) or token_set
+            if token_set.expires_at <= time.time():
+                return None
+
+        if session.get("access_token") != token_set.access_token:
+            session["access_token"] = token_set.access_token
+            session["refresh_token"] = token_set.refresh_token
+            session["token_expires_at"] = token_set.expires_at
+        return token_set.access_token
+
+    async def refresh_rejected(self, access_token: str) -> Optional[str]:
+        """
+        Get a replacement for an access token Spotify answered 401 to, or None
+        """
+        key = self._keys_by_token.get(access_token)
+        if key is None:
+            return None
+        token_set = self._tokens[key]
+        if token_set.access_token != access_token:
+            # Already replaced by a concurrent refresh
+            return token_set.access_token
+        refreshed = await self._refresh(key)
+        return refreshed.access_token if refreshed is not None else None
+
+    async def _refresh(self, key: str) -> Optional[TokenSet]:
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._do_refresh(key))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled caller does not cancel the refresh for the others
+        return await asyncio.shield(task)
+
+    async def _do_refresh(self, key: str) -> Optional[TokenSet]:
+        token_set = self._tokens.get(key)
+        if token_set is None or not token_set.refresh_token:
+            return None
+        # SpotifyAuth uses blocking requests; refreshes are rare enough for a worker thread
+        try:
+            result = await asyncio.to_thread(self.auth.refresh_token, token_set.refresh_token)
+        except requests.RequestException as e:
+            metrics.TOKEN_REFRESHES.inc(result="failed")
+            logger.warning(f"Could not reach Spotify to refresh the token of {key}: {e}")
+            return None
+        if "error" in result or not result.get("access_token"):
+            metrics.TOKEN_REFRESHES.inc(result="failed")
+            logger.warning(f"Could not refresh the Spotify token of {key}")
+            return None
+        metrics.TOKEN_REFRESHES.inc(result="ok")
+        refreshed = self.register(key, result)
+        refreshed.last_used = token_set.last_used
+        return refreshed
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._refreshing.values()):
+            task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.refresh_expiring()
+            except Exception as e:
+                logger.error(f"Token refresh loop failed unexpectedly: {e}")
+
+    async def refresh_expiring(self):
+        """
+        Refresh tokens that would expire before the next check; forget idle users
+        """
+        now = time.time()
+        due = []
+        for key, token_set in list(self._tokens.items()):
+            if now - token_set.last_used > self.idle_ttl:
+                self.forget(key)
+            elif self.refresh_in_background and token_set.refresh_at - now < self.check_interval:
+                due.append(key)
+        if due:
+            # One failed refresh must not abort the rest of the batch
+            results = await asyncio.gather(*(self._refresh(key) for key in due), return_exceptions=True)
+            for key, result in zip(due, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Refreshing the Spotify token of {key} failed: {result}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._tokens),
+            "refreshing": len(self._refreshing),
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1 @@
+# Load and latency benchmarks run against local Ollama and Spotify stand-ins
@@ -0,0 +1,101 @@
+"""
+Stand-in for an Ollama node: /api/tags, /api/ps and /api/chat (streamed or not)
+with configurable time to first token and per-token latency.
+
+    python -m benchmarks.fake_ollama --port 11500 --first-token-ms 300 --token-ms 15
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Latest messages that ask for music get a recommendation analysis
+MUSIC_REQUEST = re.compile(r"\b(play|recommend\w*|suggest\w*|music|playlist|songs?|tracks?)\b", re.IGNORECASE)
+GENRES = ["pop", "rock", "jazz", "lo-fi", "classical"]
+MOODS = ["happy", "sad", "calm", "energetic", "neutral"]
+
+def latest_message(messages) -> str:
+    content = messages[-1].get("content", "") if messages else ""
+    # The mood prompt puts the message last, after any history
+    match = re.search(r"Latest message: (.*)$", content, re.DOTALL)
+    return match.group(1).strip() if match else content
+
+def mood_analysis(message: str) -> dict:
+    wants = bool(MUSIC_REQUEST.search(message))
+    genres = [genre for genre in GENRES if genre in message.lower()]
+    return {
+        "wants_recommendations": wants,
+        "mood": random.choice(MOODS),
+        "genres": genres,
+        "artists": [],
+        "response": ("Here are some tracks that should fit what you're after."
+                     if wants else "That sounds like quite a day. Want some music to go with it?")
+    }
+
+def create_app(model: str, first_token_ms: float, token_ms: float, chars_per_token: int = 4,
+               jitter: float = 0.1) -> FastAPI:
+    app = FastAPI()
+
+    def delay(ms: float) -> float:
+        return max(0.0, ms * random.uniform(1 - jitter, 1 + jitter)) / 1000
+
+    @app.get("/")
+    async def root():
+        return "Ollama is running"
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model}]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model}]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = await request.json()
+        text = json.dumps(mood_analysis(latest_message(payload.get("messages", []))))
+        tokens = [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+        prompt_eval_count = sum(len(m.get("content", "")) for m in payload.get("messages", [])) // 4
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(delay(first_token_ms) + delay(token_ms) * len(tokens))
+            return JSONResponse({
+                "model": model,
+                "message": {"role": "assistant", "content": text},
+                "done": True,
+                "prompt_eval_count": prompt_eval_count,
+                "eval_count": len(tokens)
+            })
+
+        async def stream():
+            await asyncio.sleep(delay(first_token_ms))
+            for token in tokens:
+                yield json.dumps({"model": model, "message": {"role": "assistant", "content": token},
+                                  "done": False}) + "\n"
+                await asyncio.sleep(delay(token_ms))
+            yield json.dumps({"model": model, "done": True, "prompt_eval_count": prompt_eval_count,
+                              "eval_count": len(tokens)}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--model", default="deepseek-r1:1.5b")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    args = parser.parse_args()
+    app = create_app(args.model, args.first_token_ms, args.token_ms)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Stand-in for Spotify: the accounts service (/authorize, /api/token) and the
+Web API endpoints the app uses (/v1/me, /v1/me/top/*, /v1/search), each
+answering after a configurable latency. Authorization codes are only
+exchanged for the PKCE verifier matching their login's code challenge.
+Access tokens expire after --token-expires-in seconds and are then rejected
+with 401 until refreshed.
+
+    python -m benchmarks.fake_spotify --port 11600 --latency-ms 80
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+import secrets
+import time
+from urllib.parse import parse_qs, urlencode
+
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+
+ARTISTS = ["Radiohead", "Norah Jones", "Arijit Singh", "Daft Punk", "Nujabes", "Adele", "Kendrick Lamar",
+           "Coldplay", "Miles Davis", "Hans Zimmer"]
+
+def artist(name: str) -> dict:
+    return {"id": name.lower().replace(" ", "-"), "name": name, "genres": ["pop"], "popularity": 70}
+
+def track(index: int, artist_name: str) -> dict:
+    return {
+        "id": f"track-{index}",
+        "name": f"Song {index}",
+        "artists": [{"name": artist_name}],
+        "album": {"name": f"Album {index // 3}", "images": [{"url": f"https://example.invalid/{index}.jpg"}]},
+        "preview_url": None,
+        "popularity": random.randint(20, 90),
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{index}"}
+    }
+
+def create_app(latency_ms: float, jitter: float = 0.1, token_expires_in: int = 3600) -> FastAPI:
+    app = FastAPI()
+    # access token -> (user, expiry) and refresh token -> user
+    access_tokens = {}
+    refresh_tokens = {}
+    # authorization code -> PKCE code challenge
+    challenges = {}
+    counts = {"expired": 0, "refreshed": 0, "pkce_failed": 0}
+
+    def user_for(authorization: str) -> str:
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(status_code=401, detail="No token provided")
+        user_id, expires_at = access_tokens.get(authorization[len("Bearer "):], (None, 0))
+        if user_id is None or expires_at < time.time():
+            counts["expired"] += 1
+            raise HTTPException(status_code=401, detail="The access token expired")
+        return user_id
+
+    async def wait():
+        await asyncio.sleep(max(0.0, latency_ms * random.uniform(1 - jitter, 1 + jitter)) / 1000)
+
+    @app.get("/authorize")
+    async def authorize(redirect_uri: str, code_challenge: str, state: str = None):
+        # Consent is implied: go straight back to the app with a code
+        params = {"code": secrets.token_urlsafe(16)}
+        challenges[params["code"]] = code_challenge
+        if state:
+            params["state"] = state
+        return RedirectResponse(f"{redirect_uri}?{urlencode(params)}", status_code=303)
+
+    @app.post("/api/token")
+    async def token(request: Request):
+        await wait()
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        refresh_token = form.get("refresh_token")
+        if refresh_token:
+            user_id = refresh_tokens.get(refresh_token)
+            if user_id is None:
+                return JSONResponse({"error": "invalid_grant"}, status_code=400)
+            counts["refreshed"] += 1
+        else:
+            challenge = challenges.pop(form.get("code"), None)
+            verifier = form.get("code_verifier", "")
+            digest = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).decode().rstrip("=")
+            if challenge is None or digest != challenge:
+                counts["pkce_failed"] += 1
+                return JSONResponse({"error": "invalid_grant"}, status_code=400)
+            seed = form.get("code")
+            user_id = "user-" + hashlib.sha1(seed.encode()).hexdigest()[:12]
+            refresh_token = "refresh-" + seed
+            refresh_tokens[refresh_token] = user_id
+        access_token = "access-" + hashlib.sha1(f"{user_id}{random.random()}".encode()).hexdigest()
+        access_tokens[access_token] = (user_id, time.time() + token_expires_in)
+        return {
+            "access_token": access_token,
+            "token_type": "Bearer",
+            "expires_in": token_expires_in,
+            "refresh_token": refresh_token,
+            "scope": "user-read-private user-read-email user-top-read"
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return counts
+
+    @app.get("/v1/me")
+    async def me(authorization: str = Header(None)):
+        await wait()
+        user_id = user_for(authorization)
+        return {"id": user_id, "display_name": user_id, "product": "premium"}
+
+    @app.get("/v1/me/top/{item_type}")
+    async def top(item_type: str, limit: int = 10, authorization: str = Header(None)):
+        await wait()
+        user_for(authorization)
+        names = random.sample(ARTISTS, min(limit, len(ARTISTS)))
+        if item_type == "artists":
+            items = [artist(name) for name in names]
+        elif item_type == "tracks":
+            items = [track(index, name) for index, name in enumerate(names)]
+        else:
+            raise HTTPException(status_code=400, detail="Invalid item type")
+        return {"items": items, "total": len(items), "limit": limit}
+
+    @app.get("/v1/search")
+    async def search(q: str, type: str = "track", limit: int = 5, authorization: str = Header(None)):
+        await wait()
+        user_for(authorization)
+        tracks = [track(index, random.choice(ARTISTS)) for index in range(limit)]
+        return {
+            "tracks": {"items": tracks, "total": len(tracks)},
+            "artists": {"items": [artist(name) for name in ARTISTS[:limit]], "total": limit}
+        }
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11600)
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--token-expires-in", type=int, default=3600)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, token_expires_in=args.token_expires_in),
+                host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
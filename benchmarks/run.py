@@ -0,0 +1,438 @@
+"""
+End-to-end load benchmark.
+
+Starts fake Ollama and Spotify servers plus the app itself (pointed at the
+fakes), logs every virtual user in through the OAuth flow, then drives
+/api/send_message and /api/stream_message concurrently. Writes throughput and
+p50/p95/p99 latencies per mode and branch (chat vs. recommendation) as JSON,
+including per-stage timings from the Server-Timing header when the app sends
+one. Pass --compare with an earlier report to print the differences.
+
+With --workers 1,2,4 the app is run once per worker count, sharing
+conversations, caches and the session key through SQLite as a multi-worker
+deployment would, and the report adds throughput speedup and scaling
+efficiency relative to the first count. Spread the virtual users over
+several load-generating processes with --client-processes so the client is
+not what saturates first.
+
+    python -m benchmarks.run --users 20 --duration 30 --output bench.json
+    python -m benchmarks.run --output new.json --compare bench.json
+    python -m benchmarks.run --workers 1,2,4 --client-processes 4 --users 64 --mode send
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import httpx
+
+CHAT_MESSAGES = [
+    "I had a long day at work",
+    "What do you know about the history of jazz?",
+    "My friend is visiting this weekend",
+    "How are you doing today?",
+]
+RECOMMENDATION_MESSAGES = [
+    "Play something like Radiohead",
+    "Recommend some upbeat pop songs",
+    "I need music for studying",
+    "Make me a calm playlist for tonight",
+]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2)
+    }
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    Parse `name;dur=12.3, other;desc="x";dur=4` into {name: milliseconds}
+    """
+    timings = {}
+    for metric in (header or "").split(","):
+        parts = [part.strip() for part in metric.split(";")]
+        if not parts[0]:
+            continue
+        for param in parts[1:]:
+            if param.startswith("dur="):
+                try:
+                    timings[parts[0]] = float(param[4:])
+                except ValueError:
+                    pass
+    return timings
+
+class Recorder:
+    """
+    Samples collected during one mode's run, keyed by branch
+    """
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.first_token = defaultdict(list)
+        self.stages = defaultdict(lambda: defaultdict(list))
+        self.errors = 0
+        self.rejected = 0
+
+    def record(self, branch: str, latency_ms: float, first_token_ms: Optional[float] = None,
+               server_timing: Optional[Dict[str, float]] = None):
+        self.latency[branch].append(latency_ms)
+        if first_token_ms is not None:
+            self.first_token[branch].append(first_token_ms)
+        for stage, duration in (server_timing or {}).items():
+            self.stages[branch][stage].append(duration)
+
+    def samples(self) -> Dict:
+        """
+        Everything recorded, as plain data that can be sent between processes
+        """
+        return {
+            "latency": dict(self.latency),
+            "first_token": dict(self.first_token),
+            "stages": {branch: dict(stages) for branch, stages in self.stages.items()},
+            "errors": self.errors,
+            "rejected": self.rejected
+        }
+
+    def add_samples(self, samples: Dict):
+        for branch, values in samples["latency"].items():
+            self.latency[branch].extend(values)
+        for branch, values in samples["first_token"].items():
+            self.first_token[branch].extend(values)
+        for branch, stages in samples["stages"].items():
+            for stage, values in stages.items():
+                self.stages[branch][stage].extend(values)
+        self.errors += samples["errors"]
+        self.rejected += samples["rejected"]
+
+    def report(self, elapsed: float) -> Dict:
+        branches = {}
+        for branch, latencies in self.latency.items():
+            branches[branch] = {
+                "requests": len(latencies),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "latency_ms": percentiles(latencies),
+                "first_token_ms": percentiles(self.first_token[branch]),
+                "stages_ms": {stage: percentiles(values) for stage, values in sorted(self.stages[branch].items())}
+            }
+        completed = sum(len(latencies) for latencies in self.latency.values())
+        return {
+            "requests": completed,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "throughput_rps": round(completed / elapsed, 2),
+            "branches": branches
+        }
+
+async def login(client: httpx.AsyncClient):
+    """
+    Follow /login -> fake /authorize -> /callback so the client holds a session
+    """
+    response = await client.get("/login")
+    authorize_url = response.headers["location"]
+    response = await client.get(authorize_url)
+    callback_url = response.headers["location"]
+    response = await client.get(callback_url)
+    if response.headers.get("location") != "/chat":
+        raise RuntimeError(f"Login failed: {response.status_code} {response.headers.get('location')}")
+
+async def send_message(client: httpx.AsyncClient, message: str, recorder: Recorder):
+    started = time.perf_counter()
+    response = await client.post("/api/send_message", json={"message": message})
+    latency_ms = (time.perf_counter() - started) * 1000
+    if response.status_code == 429:
+        recorder.rejected += 1
+        return
+    if response.status_code != 200:
+        recorder.errors += 1
+        return
+    branch = "recommendation" if response.json().get("music_recommendations") else "chat"
+    recorder.record(branch, latency_ms, server_timing=parse_server_timing(response.headers.get("server-timing")))
+
+async def stream_message(client: httpx.AsyncClient, message: str, recorder: Recorder):
+    started = time.perf_counter()
+    first_token_ms = None
+    branch = "chat"
+    async with client.stream("POST", "/api/stream_message", json={"message": message}) as response:
+        if response.status_code == 429:
+            recorder.rejected += 1
+            return
+        if response.status_code != 200:
+            recorder.errors += 1
+            return
+        server_timing = parse_server_timing(response.headers.get("server-timing"))
+        async for line in response.aiter_lines():
+            if not line.startswith("event: "):
+                continue
+            event = line[7:]
+            if event == "token" and first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            elif event == "recommendations":
+                branch = "recommendation"
+            elif event in ("error", "session_expired"):
+                recorder.errors += 1
+                return
+    latency_ms = (time.perf_counter() - started) * 1000
+    recorder.record(branch, latency_ms, first_token_ms, server_timing)
+
+async def virtual_user(app_url: str, mode: str, deadline: float, recorder: Recorder,
+                       recommendation_ratio: float, think_time: float, timeout: float):
+    request = send_message if mode == "send" else stream_message
+    async with httpx.AsyncClient(base_url=app_url, timeout=timeout) as client:
+        await login(client)
+        while time.perf_counter() < deadline:
+            if random.random() < recommendation_ratio:
+                message = random.choice(RECOMMENDATION_MESSAGES)
+            else:
+                message = random.choice(CHAT_MESSAGES)
+            try:
+                await request(client, message, recorder)
+            except httpx.HTTPError:
+                recorder.errors += 1
+            if think_time:
+                await asyncio.sleep(random.expovariate(1 / think_time))
+
+async def run_users(args, app_url: str, mode: str, users: int, recorder: Recorder):
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(
+        virtual_user(app_url, mode, deadline, recorder, args.recommendation_ratio, args.think_time, args.timeout)
+        for _ in range(users)
+    ))
+
+def run_client_process(args, app_url: str, mode: str, users: int) -> Dict:
+    recorder = Recorder()
+    asyncio.run(run_users(args, app_url, mode, users, recorder))
+    return recorder.samples()
+
+def run_mode(args, app_url: str, mode: str) -> Dict:
+    recorder = Recorder()
+    started = time.perf_counter()
+    if args.client_processes <= 1:
+        asyncio.run(run_users(args, app_url, mode, args.users, recorder))
+    else:
+        # One event loop saturates a core long before several app workers do
+        shares = [args.users // args.client_processes + (i < args.users % args.client_processes)
+                  for i in range(args.client_processes)]
+        with ProcessPoolExecutor(len(shares)) as pool:
+            futures = [pool.submit(run_client_process, args, app_url, mode, users) for users in shares if users]
+            for future in futures:
+                recorder.add_samples(future.result())
+    return recorder.report(time.perf_counter() - started)
+
+def run_app(args, workers: int, env: Dict[str, str], app_port: int) -> Dict:
+    """
+    Start the app with the given number of worker processes and run every mode against it
+    """
+    app_url = f"http://127.0.0.1:{app_port}"
+    process = start(["uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                     "--workers", str(workers), "--log-level", "warning"], {**env, "WEB_CONCURRENCY": str(workers)})
+    try:
+        wait_until_ready(f"{app_url}/health")
+        modes = ["send", "stream"] if args.mode == "both" else [args.mode]
+        results = {}
+        for mode in modes:
+            print(f"Running {mode} with {args.users} users and {workers} app worker(s) for {args.duration:.0f}s...",
+                  file=sys.stderr)
+            results[mode] = run_mode(args, app_url, mode)
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+def scaling(results_by_workers: Dict[int, Dict]) -> Dict:
+    """
+    Throughput of each worker count relative to the first: speedup, and
+    efficiency (speedup per added worker, 1.0 being linear)
+    """
+    counts = list(results_by_workers)
+    base = counts[0]
+    report = {}
+    for mode in results_by_workers[base]:
+        base_rps = results_by_workers[base][mode]["throughput_rps"]
+        report[mode] = {}
+        for workers in counts:
+            rps = results_by_workers[workers][mode]["throughput_rps"]
+            speedup = rps / base_rps if base_rps else 0.0
+            report[mode][f"workers_{workers}"] = {
+                "throughput_rps": rps,
+                "speedup": round(speedup, 2),
+                "efficiency": round(speedup * base / workers, 2)
+            }
+    return report
+
+def start(module_args: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", *module_args], env={**os.environ, **(env or {})})
+
+def wait_until_ready(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(report: Dict, prefix: str = "") -> Dict[str, float]:
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            values.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def compare(old: Dict, new: Dict):
+    """
+    Print every numeric result that changed between two reports
+    """
+    before, after = flatten(old["results"]), flatten(new["results"])
+    print(f"\n{'metric':<70} {old['meta'].get('commit') or 'old':>10} {new['meta'].get('commit') or 'new':>10} {'change':>8}")
+    for path in sorted(set(before) | set(after)):
+        a, b = before.get(path), after.get(path)
+        if a == b:
+            continue
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+        print(f"{path:<70} {'-' if a is None else a:>10} {'-' if b is None else b:>10} {change:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per mode")
+    parser.add_argument("--mode", choices=["send", "stream", "both"], default="both")
+    parser.add_argument("--recommendation-ratio", type=float, default=0.5)
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between messages, seconds")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ollama-nodes", type=int, default=1)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    parser.add_argument("--spotify-latency-ms", type=float, default=80.0)
+    parser.add_argument("--token-expires-in", type=int, default=3600,
+                        help="lifetime of fake Spotify access tokens, seconds; set below --duration to exercise refresh")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every message to the fake Ollama")
+    parser.add_argument("--workers", default="1",
+                        help="app worker processes; a comma-separated list runs once per count, e.g. 1,2,4")
+    parser.add_argument("--client-processes", type=int, default=1,
+                        help="processes generating load, the virtual users split between them")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app, e.g. OLLAMA_MAX_CONCURRENCY=8")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+    worker_counts = [int(count) for count in args.workers.split(",")]
+
+    processes = []
+    shared_dir = tempfile.TemporaryDirectory(prefix="bench-")
+    try:
+        ollama_urls = []
+        for _ in range(args.ollama_nodes):
+            port = free_port()
+            processes.append(start(["benchmarks.fake_ollama", "--port", str(port),
+                                    "--first-token-ms", str(args.first_token_ms), "--token-ms", str(args.token_ms)]))
+            ollama_urls.append(f"http://127.0.0.1:{port}")
+
+        spotify_port = free_port()
+        processes.append(start(["benchmarks.fake_spotify", "--port", str(spotify_port),
+                                "--latency-ms", str(args.spotify_latency_ms),
+                                "--token-expires-in", str(args.token_expires_in)]))
+        spotify_url = f"http://127.0.0.1:{spotify_port}"
+
+        app_port = free_port()
+        app_url = f"http://127.0.0.1:{app_port}"
+        env = {
+            # A fixed key file for all workers, and state they share on this host
+            "SESSION_SECRET_FILE": os.path.join(shared_dir.name, "session_secret"),
+            "OLLAMA_ENDPOINTS": ",".join(ollama_urls),
+            "SPOTIFY_ACCOUNTS_URL": spotify_url,
+            "SPOTIFY_API_URL": f"{spotify_url}/v1",
+            "SPOTIFY_REDIRECT_URI": f"{app_url}/callback",
+            "INTENT_FAST_PATH": "0" if args.no_fast_path else "1",
+        }
+        if max(worker_counts) > 1:
+            # Every count uses the same backends, so only the worker count differs between runs
+            env.update({
+                "CONVERSATION_BACKEND": "sqlite",
+                "CACHE_BACKEND": "sqlite",
+            })
+        env.update(item.split("=", 1) for item in args.app_env)
+
+        for url in ollama_urls:
+            wait_until_ready(f"{url}/api/tags")
+        wait_until_ready(f"{spotify_url}/openapi.json")
+        results_by_workers = {}
+        for workers in worker_counts:
+            # Fresh databases per run, so later runs do not start with warm caches
+            run_dir = os.path.join(shared_dir.name, f"workers-{workers}")
+            run_env = {
+                **env,
+                "CONVERSATION_DB_PATH": os.path.join(run_dir, "conversations.db"),
+                "CACHE_DB_PATH": os.path.join(run_dir, "cache.db"),
+            }
+            results_by_workers[workers] = run_app(args, workers, run_env, app_port)
+        # Requests rejected for an expired token, refreshes the app made and failed PKCE exchanges
+        spotify_tokens = httpx.get(f"{spotify_url}/stats").json()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shared_dir.cleanup()
+
+    if len(worker_counts) == 1:
+        results = results_by_workers[worker_counts[0]]
+    else:
+        results = {f"workers_{workers}": result for workers, result in results_by_workers.items()}
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        "results": results,
+        "spotify_tokens": spotify_tokens
+    }
+    if len(worker_counts) > 1:
+        report["scaling"] = scaling(results_by_workers)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
-from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+import time
+
+# Measured from here to the end of startup, see lifespan()
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query, status, Form
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer
-from starlette.middleware.sessions import SessionMiddleware
+from starlette.routing import Match
 import uvicorn
 import json
 from pydantic import BaseModel
@@ -12,18 +17,162 @@ import os
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 import requests
+import secrets
+from contextlib import asynccontextmanager
+
+from backend.config import Settings
+from backend.deadline import (ClientDisconnected, DeadlineExceeded, budget, record_timed_out, run_until_disconnected,
+                              start_deadline, stream_until_disconnected)
+from backend.llm_manager import AsyncLLMManager
+from backend.spotify_api import SpotifyAPI, SpotifyAPIError, SpotifyAuthError
+from backend.auth import LazySessionMiddleware, SpotifyAuth, load_session_secret
+from backend.conversation_store import ConversationStore, SQLiteConversationBackend
+from backend.health_monitor import ModelHealthMonitor
+from backend.intent_classifier import IntentClassifier
+from backend.recommender import Recommender
+from backend.semantic_cache import SemanticCache
+from backend.shared_cache import SQLiteCacheBackend
+from backend.taste_profile import TasteProfiles
+from backend.token_manager import TokenManager
+from backend.scheduler import InferenceScheduler, QueueFullError
+from backend.logger import configure_logging, setup_logger
+from backend import metrics
+
+def build_services(state, settings: Settings):
+    """
+    Create the upstream clients and stores on app.state. Nothing here does
+    network I/O; clients open their connection pools on first use.
+    """
+    state.settings = settings
+    # Caches are per process by default; with SQLite, workers on the host share them
+    state.shared_cache = SQLiteCacheBackend(settings.cache_db_path) if settings.cache_backend == "sqlite" else None
+    
+    state.spotify_auth = SpotifyAuth(
+        settings.spotify_client_id, settings.spotify_redirect_uri,
+        accounts_url=settings.spotify_accounts_url,
+        api_url=settings.spotify_api_url
+    )
+    
+    # Non-blocking LLM client, routed across the configured Ollama nodes
+    state.llm_manager = AsyncLLMManager(
+        base_url=settings.ollama_base_url,
+        model=settings.ollama_model,
+        endpoints=settings.ollama_endpoints or None,
+        # Duplicate requests running past their endpoint's p95 latency to a second node
+        hedge=settings.ollama_hedge,
+        read_timeout=settings.ollama_read_timeout,
+        # Bound concurrent generations; excess requests queue fairly per user or get a 429
+        scheduler=InferenceScheduler(
+            max_concurrency=settings.max_concurrency,
+            max_queue=settings.ollama_max_queue,
+            max_queue_per_user=settings.ollama_max_queue_per_user
+        ),
+        event_hooks=metrics.upstream_hooks("ollama"),
+        # Reuse analyses of (nearly) identical messages instead of re-running inference
+        response_cache=SemanticCache(
+            maxsize=settings.mood_cache_size,
+            ttl=settings.mood_cache_ttl,
+            similarity=settings.mood_cache_similarity,
+            context_messages=settings.mood_cache_context_messages,
+            shared=state.shared_cache
+        ) if settings.mood_cache_size > 0 else None
+    )
+    
+    # Poll Ollama in the background so handlers can check readiness without I/O
+    state.health_monitor = ModelHealthMonitor(state.llm_manager, interval=settings.ollama_health_interval)
+    
+    # Refreshes access tokens before they expire and after a 401; with several
+    # workers only on request, so workers do not race to rotate one refresh token
+    state.token_manager = TokenManager(state.spotify_auth, refresh_in_background=settings.workers <= 1)
+    
+    state.spotify_api = SpotifyAPI(state.spotify_auth, base_url=settings.spotify_api_url,
+                                   event_hooks=metrics.upstream_hooks("spotify"),
+                                   token_manager=state.token_manager, shared_cache=state.shared_cache)
+    
+    # Top items for every time range, fetched when the user logs in
+    state.taste_profiles = TasteProfiles(state.spotify_api, ttl=settings.taste_profile_ttl,
+                                         shared_cache=state.shared_cache)
+    
+    # Candidate generation over several concurrent searches plus re-ranking
+    state.recommender = Recommender(state.spotify_api, taste_profiles=state.taste_profiles)
+    
+    # Bounded in-memory history by default, or SQLite so that history
+    # survives restarts and is shared by all workers on the host
+    if settings.conversation_backend == "sqlite":
+        state.conversation_store = ConversationStore(SQLiteConversationBackend(
+            settings.conversation_db_path,
+            max_turns=settings.conversation_max_turns
+        ))
+    else:
+        state.conversation_store = ConversationStore(
+            max_turns=settings.conversation_max_turns,
+            max_users=settings.conversation_max_users,
+            idle_ttl=settings.conversation_idle_ttl,
+            max_bytes=settings.conversation_max_bytes
+        )
+
+async def load_intent_classifier(llm_manager: AsyncLLMManager):
+    """
+    Train the fast-path classifier off the event loop; until it is ready every
+    message goes to the LLM
+    """
+    llm_manager.intent_classifier = await asyncio.to_thread(IntentClassifier)
+    logger.info("Intent classifier ready")
 
-from backend.llm_manager import LLMManager
-from backend.spotify_api import SpotifyAPI
-from backend.auth import SpotifyAuth
-from backend.conversation_store import ConversationStore
-from backend.logger import setup_logger
+def check_multi_worker(settings: Settings):
+    """
+    Warn about state that stays per process when several workers serve the app
+    """
+    if settings.workers <= 1:
+        return
+    if settings.conversation_backend != "sqlite":
+        logger.warning(f"{settings.workers} workers with in-memory conversations: a user's history is split "
+                       f"across workers. Set CONVERSATION_BACKEND=sqlite")
+    if settings.cache_backend != "sqlite":
+        logger.warning(f"{settings.workers} workers with per-process caches: each worker fetches and generates "
+                       f"everything itself. Set CACHE_BACKEND=sqlite")
+    if not settings.session_secret and not settings.session_secret_path:
+        logger.warning(f"{settings.workers} workers without SESSION_SECRET: each worker rejects the others' sessions")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    settings = Settings.from_env()
+    state = app.state
+    build_services(state, settings)
+    # The same key in every worker process and across restarts, so any worker
+    # can read any session; LazySessionMiddleware picks it up from here
+    state.session_secret = load_session_secret(settings.session_secret, settings.session_secret_path)
+    check_multi_worker(settings)
+    
+    # Discovery, health checks and classifier training all continue in the background
+    await state.llm_manager.start()
+    await state.health_monitor.start()
+    await state.token_manager.start()
+    classifier_task = None
+    if settings.intent_fast_path:
+        classifier_task = asyncio.create_task(load_intent_classifier(state.llm_manager))
+    
+    startup_seconds = time.perf_counter() - _IMPORT_STARTED
+    metrics.STARTUP_SECONDS.set(startup_seconds)
+    logger.info(f"Started in {startup_seconds * 1000:.0f} ms (import to ready)")
+    yield
+    
+    if classifier_task is not None:
+        classifier_task.cancel()
+    await state.health_monitor.stop()
+    await state.token_manager.stop()
+    await state.taste_profiles.aclose()
+    await state.llm_manager.aclose()
+    await state.spotify_api.aclose()
+    state.conversation_store.close()
+    if state.shared_cache is not None:
+        state.shared_cache.close()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
-    SessionMiddleware, 
-    secret_key=os.urandom(24),
+    LazySessionMiddleware, 
     max_age=3600,  # 1 hour session
     same_site="lax",  # Allow cross-site requests for OAuth
     https_only=False  # Set to True in production
@@ -35,19 +184,73 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Set up templates
 templates = Jinja2Templates(directory="templates")
 
-# Initialize Spotify authentication
-CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID", "5c2bfce5570a46c394675a810b5cb895")
-REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI", "http://localhost:8888/callback")
-spotify_auth = SpotifyAuth(CLIENT_ID, REDIRECT_URI)
+def _started_llm_manager() -> Optional[AsyncLLMManager]:
+    return getattr(app.state, "llm_manager", None)
 
-# Initialize LLM Manager
-llm_manager = LLMManager()
+def _mood_cache():
+    llm = _started_llm_manager()
+    return llm.response_cache if llm else None
 
-# Initialize Spotify API client
-spotify_api = SpotifyAPI(spotify_auth)
+# Scheduler and endpoint state, read at scrape time (empty before startup)
+metrics.registry.callback_gauge(
+    "app_scheduler_running", "Generations holding a scheduler slot",
+    lambda: {(): llm.scheduler.running} if (llm := _started_llm_manager()) else {}
+)
+metrics.registry.callback_gauge(
+    "app_scheduler_queue_depth", "Generations waiting for a scheduler slot",
+    lambda: {(): llm.scheduler.waiting} if (llm := _started_llm_manager()) else {}
+)
+metrics.registry.callback_gauge(
+    "app_ollama_endpoint_in_flight", "Requests in flight per Ollama endpoint",
+    lambda: {(endpoint.base_url,): endpoint.in_flight for endpoint in llm.pool} if (llm := _started_llm_manager()) else {},
+    ["endpoint"]
+)
+metrics.registry.callback_gauge(
+    "app_ollama_endpoint_healthy", "Whether each Ollama endpoint passed its last health check",
+    lambda: {(endpoint.base_url,): int(endpoint.healthy) for endpoint in llm.pool} if (llm := _started_llm_manager()) else {},
+    ["endpoint"]
+)
+metrics.registry.callback_gauge(
+    "app_mood_cache_entries", "Mood analyses held by the semantic cache",
+    lambda: {(): len(cache)} if (cache := _mood_cache()) is not None else {}
+)
+metrics.registry.callback_gauge(
+    "app_mood_cache_hit_ratio", "Share of mood analysis cache lookups answered from the cache",
+    lambda: {(): cache.hit_rate()} if (cache := _mood_cache()) is not None else {}
+)
 
-# Initialize conversation store
-conversation_store = ConversationStore()
+def _spotify_cache_lookups():
+    spotify_api = getattr(app.state, "spotify_api", None)
+    if spotify_api is None:
+        return {}
+    return {
+        (cache, result): stats[result]
+        for cache, stats in spotify_api.cache_stats().items()
+        for result in ("hits", "stale_hits", "shared_hits", "misses", "coalesced")
+    }
+
+def _conversation_store_size():
+    store = getattr(app.state, "conversation_store", None)
+    if store is None:
+        return {}
+    # One stats() call per scrape: the SQLite backend answers it with a table scan
+    stats = store.stats()
+    return {("users",): stats["users"], ("messages",): stats["messages"], ("bytes",): stats["approx_bytes"]}
+
+metrics.registry.callback_gauge(
+    "app_spotify_cache_lookups", "Spotify top-items and search cache lookups by result since startup",
+    _spotify_cache_lookups, ["cache", "result"]
+)
+metrics.registry.callback_gauge(
+    "app_spotify_cache_entries", "Entries held by the Spotify top-items and search caches",
+    lambda: {(cache,): stats["size"] for cache, stats in spotify_api.cache_stats().items()}
+    if (spotify_api := getattr(app.state, "spotify_api", None)) else {},
+    ["cache"]
+)
+metrics.registry.callback_gauge(
+    "app_conversation_store_held", "Users, messages and approximate bytes held by the conversation store",
+    _conversation_store_size, ["quantity"]
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -58,6 +261,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def route_label(request: Request) -> str:
+    """
+    Route template for metric labels, so path parameters do not explode cardinality
+    """
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = metrics.start_request()
+    route = route_label(request)
+    metrics.HTTP_IN_FLIGHT.inc(route=route)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        # Stages of a streamed response that run after the headers are only in /metrics
+        response.headers["Server-Timing"] = timings.server_timing()
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec(route=route)
+        metrics.HTTP_DURATION.observe(time.perf_counter() - timings.started, method=request.method, route=route)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=status_code)
+
 # Pydantic model for message requests
 class MessageRequest(BaseModel):
     message: str
@@ -73,30 +303,36 @@ async def index(request: Request):
 
 @app.get("/login")
 async def login(request: Request):
-    # Store code verifier in session for later use
-    request.session['code_verifier'] = spotify_auth.code_verifier
+    state = request.app.state
+    # A fresh PKCE pair and OAuth state per login, kept in this user's session
+    # so whichever worker handles the callback can finish it
+    code_verifier, code_challenge = state.spotify_auth.create_pkce_pair()
+    request.session['code_verifier'] = code_verifier
+    request.session['oauth_state'] = secrets.token_urlsafe(16)
     
     # Redirect to Spotify authorization page
-    auth_url = spotify_auth.get_auth_url()
+    auth_url = state.spotify_auth.get_auth_url(code_challenge, state=request.session['oauth_state'])
     return RedirectResponse(url=auth_url, status_code=303)
 
 @app.get("/callback")
-async def callback(request: Request, code: Optional[str] = None, error: Optional[str] = None):
+async def callback(request: Request, code: Optional[str] = None, error: Optional[str] = None,
+                   oauth_state: Optional[str] = Query(None, alias="state")):
+    state = request.app.state
     if error:
         return RedirectResponse(url="/", status_code=303)
     
     if not code:
         return RedirectResponse(url="/", status_code=303)
     
-    # Restore code verifier from session
-    code_verifier = request.session.get('code_verifier')
-    if not code_verifier:
+    # Restore this login's code verifier; a state mismatch means the
+    # callback does not belong to the login started in this session
+    code_verifier = request.session.pop('code_verifier', None)
+    expected_state = request.session.pop('oauth_state', None)
+    if not code_verifier or not expected_state or not secrets.compare_digest(oauth_state or "", expected_state):
         return RedirectResponse(url="/", status_code=303)
-        
-    spotify_auth.code_verifier = code_verifier
     
-    # Exchange authorization code for tokens
-    tokens = spotify_auth.get_tokens(code)
+    # Exchange authorization code for tokens (SpotifyAuth blocks, so off the event loop)
+    tokens = await asyncio.to_thread(state.spotify_auth.get_tokens, code, code_verifier)
     
     if 'error' in tokens:
         return RedirectResponse(url="/", status_code=303)
@@ -105,11 +341,24 @@ async def callback(request: Request, code: Optional[str] = None, error: Optional
     request.session['access_token'] = tokens.get('access_token')
     request.session['refresh_token'] = tokens.get('refresh_token')
     
-    # Get user profile info
-    user_profile = spotify_auth.get_user_profile(request.session['access_token'])
+    # Get user profile info; top items for the taste profile load in the background
+    try:
+        user_profile = await state.taste_profiles.prefetch(request.session['access_token'])
+    except SpotifyAPIError as e:
+        logger.error(f"Error getting user profile: {e}")
+        user_profile = {}
+    
+    # Have the model resident before the first chat message
+    if state.settings.ollama_warmup:
+        state.llm_manager.warm_up(state.health_monitor.cold_endpoints(), keep_alive=state.settings.ollama_keep_alive)
     
     # Store in session with proper fallback
     request.session['display_name'] = user_profile.get('display_name', 'Spotify User')
+    request.session['user_id'] = user_profile.get('id')
+    
+    # Track the token's expiry so it is refreshed before Spotify starts rejecting it
+    token_set = state.token_manager.register(TokenManager.session_key(request.session), tokens)
+    request.session['token_expires_at'] = token_set.expires_at
     
     return RedirectResponse(url="/chat", status_code=303)
 
@@ -124,88 +373,138 @@ async def chat(request: Request):
         {"request": request, "display_name": display_name}
     )
 
+def get_conversation_id(request: Request) -> Optional[str]:
+    """
+    Key conversations by Spotify user ID so that a new access token does not
+    orphan the user's history; fall back to the token for older sessions
+    """
+    return request.session.get('user_id') or request.session.get('access_token')
+
+async def get_music_recommendations(recommender: Recommender, access_token: str, mood_analysis: Dict,
+                                    spotify_user_id: Optional[str] = None) -> Dict:
+    """
+    Search Spotify for tracks matching the analysed mood and the user's taste
+    """
+    # Fan out several searches and re-rank the pooled candidates
+    tracks = await recommender.recommend(access_token, mood_analysis, spotify_user_id)
+    
+    # Process tracks for display
+    processed_tracks = []
+    
+    for track in tracks:
+        processed_tracks.append({
+            "name": track.get("name", "Unknown"),
+            "artist": ", ".join([artist.get("name", "") for artist in track.get("artists", [])]),
+            "album": track.get("album", {}).get("name", ""),
+            "image_url": track.get("album", {}).get("images", [{}])[0].get("url", ""),
+            "preview_url": track.get("preview_url", ""),
+            "spotify_url": track.get("external_urls", {}).get("spotify", "")
+        })
+    
+    return {
+        "tracks": processed_tracks,
+        "mood": mood_analysis.get("mood", ""),
+        "genres": mood_analysis.get("genres", [])
+    }
+
+def format_sse(event: str, data: Dict) -> str:
+    """
+    Format one server-sent event frame
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+SESSION_EXPIRED_MESSAGE = "Your Spotify session has expired. Please log in again."
+
+def session_expired_response(request: Request) -> Dict:
+    """
+    Log the user out once their token can no longer be used or refreshed,
+    so later requests fail fast instead of calling Spotify again
+    """
+    request.app.state.token_manager.forget(TokenManager.session_key(request.session))
+    request.session.clear()
+    return {"response": SESSION_EXPIRED_MESSAGE}
+
+def busy_response(error: QueueFullError) -> JSONResponse:
+    """
+    429 telling the client when to retry and where it would have been queued
+    """
+    return JSONResponse(
+        {
+            "response": f"I'm handling a lot of requests right now. Please try again in {error.retry_after:.0f} seconds.",
+            "retry_after": error.retry_after,
+            "queue_position": error.queue_position
+        },
+        status_code=429,
+        headers={"Retry-After": str(int(error.retry_after))}
+    )
+
+TIMED_OUT_MESSAGE = "Sorry, that took too long. Please try again."
+
 @app.post("/api/send_message")
 async def send_message(message_request: MessageRequest, request: Request):
+    """
+    Answer a chat message. The whole pipeline runs under the request deadline
+    and is cancelled, Ollama generation included, if the client disconnects.
+    """
+    state = request.app.state
+    start_deadline(state.settings.request_timeout, state.settings.stage_budgets)
     try:
-        # Get user access token
-        access_token = request.session.get('access_token', None)
+        return await run_until_disconnected(request, handle_message(message_request, request), "/api/send_message")
+    except ClientDisconnected:
+        # Nobody is listening; the status is only for access logs
+        return Response(status_code=499)
+
+async def handle_message(message_request: MessageRequest, request: Request):
+    state = request.app.state
+    try:
+        # Get user access token, refreshed if it is about to expire
+        access_token = await state.token_manager.access_token(request.session)
         if not access_token:
-            return {"response": "Your Spotify session has expired. Please log in again."}
+            return session_expired_response(request)
         
-        user_id = access_token
+        user_id = get_conversation_id(request)
         user_message = message_request.message
         
-        # Add user message to history
-        conversation_store.add_message(user_id, "user", user_message)
-        
-        # Get history for context 
-        history = conversation_store.get_history(user_id)
+        with metrics.stage("history"):
+            # History for context, with the new message; it is stored once admitted
+            history = state.conversation_store.get_history(user_id) + [{"role": "user", "content": user_message}]
         
         # Check if model is ready
-        if not llm_manager.is_model_ready():
+        with metrics.stage("model_ready"):
+            model_ready = state.health_monitor.ready
+        if not model_ready:
             return {
-                "response": "The AI model is not loaded yet. Please run: `ollama pull deepseek-r1:1.5b`"
+                "response": f"The AI model is not loaded yet. Please run: `ollama pull {state.llm_manager.model}`"
             }
         
+        # Raises QueueFullError only if the message has to go to Ollama; rejected
+        # before touching history so a retried message is not stored twice
+        mood_events = state.llm_manager.stream_conversation_mood(history, user_message, user_id)
+        state.conversation_store.add_message(user_id, "user", user_message)
+        
         # First, analyze the conversation for mood and recommendation intent
-        mood_analysis = llm_manager.analyze_conversation_mood(history, user_message)
+        async with budget("mood_analysis"):
+            with metrics.stage("mood_analysis"):
+                mood_analysis = await state.llm_manager.collect_analysis(mood_events)
         
         # Only proceed with recommendations if needed
         if mood_analysis.get("wants_recommendations", False):
-            # Get user's top artists and tracks
-            top_artists = spotify_api.get_user_top_items(access_token, "artists")
-            top_tracks = spotify_api.get_user_top_items(access_token, "tracks")
-            
-            # Create a search query
-            query = spotify_api.create_recommendation_query(
-                mood_analysis.get("mood", ""), 
-                top_artists.get("items", []),
-                top_tracks.get("items", [])
-            )
-            
-            # Add genres if available
-            if mood_analysis.get("genres"):
-                for genre in mood_analysis.get("genres", ["bollywood"])[:1]:
-                    query += f" genre:{genre}"
-            
-            # Search Spotify
-            logger.info(f"Query : {query}")
-            search_results = spotify_api.search(
-                access_token, 
-                query, 
-                types=["track", "artist"], 
-                limit=5
-            )
-            
-            # Process tracks for display
-            tracks = search_results.get("tracks", {}).get("items", [])
-            processed_tracks = []
-            
-            for track in tracks:
-                processed_tracks.append({
-                    "name": track.get("name", "Unknown"),
-                    "artist": ", ".join([artist.get("name", "") for artist in track.get("artists", [])]),
-                    "album": track.get("album", {}).get("name", ""),
-                    "image_url": track.get("album", {}).get("images", [{}])[0].get("url", ""),
-                    "preview_url": track.get("preview_url", ""),
-                    "spotify_url": track.get("external_urls", {}).get("spotify", "")
-                })
+            async with budget("recommendations"):
+                music_recommendations = await get_music_recommendations(
+                    state.recommender, access_token, mood_analysis, request.session.get('user_id')
+                )
             
             # Generate a response message
             response_message = f"Based on our conversation, I've created a playlist for your {mood_analysis.get('mood', 'current')} mood. Here are some tracks I think you'll enjoy:"
             
             # Add the assistant message to history
-            conversation_store.add_message(user_id, "assistant", response_message)
+            state.conversation_store.add_message(user_id, "assistant", response_message)
             
             # Return both text response and music recommendations
             return {
                 "response": response_message,
                 "animate": True,
-                "music_recommendations": {
-                    "tracks": processed_tracks,
-                    "mood": mood_analysis.get("mood", ""),
-                    "genres": mood_analysis.get("genres", [])
-                }
+                "music_recommendations": music_recommendations
             }
         
         # If no recommendation needed, proceed with normal chat
@@ -214,20 +513,146 @@ async def send_message(message_request: MessageRequest, request: Request):
             response_text = mood_analysis.get("response", "")
             
             # Add the assistant message to history
-            conversation_store.add_message(user_id, "assistant", response_text)
+            state.conversation_store.add_message(user_id, "assistant", response_text)
             
             return {"response": response_text, "animate": True}
             
         except Exception as e:
             return {"response": f"I encountered an error: {str(e)}"}
         
+    except QueueFullError as e:
+        return busy_response(e)
+    except SpotifyAuthError:
+        return session_expired_response(request)
+    except DeadlineExceeded as e:
+        record_timed_out("/api/send_message", e)
+        return JSONResponse({"response": TIMED_OUT_MESSAGE}, status_code=504)
     except Exception as e:
         return {"response": f"An error occurred: {str(e)}"}
 
+@app.post("/api/stream_message")
+async def stream_message(message_request: MessageRequest, request: Request):
+    """
+    Server-sent-events variant of /api/send_message. Emits "thinking" while the
+    model reasons, "token" frames as the reply is generated, an optional
+    "recommendations" frame and a final "done" frame. Like /api/send_message,
+    it runs under the request deadline and stops when the client disconnects.
+    """
+    state = request.app.state
+    start_deadline(state.settings.request_timeout, state.settings.stage_budgets)
+    # Resolved before the response starts, while a refreshed token can still go into the session cookie
+    access_token = await state.token_manager.access_token(request.session)
+    if not access_token:
+        session_expired_response(request)
+    spotify_user_id = request.session.get('user_id')
+    # Tokens are tracked by session key, which is not always the Spotify user id
+    token_key = TokenManager.session_key(request.session)
+    user_id = get_conversation_id(request)
+    user_message = message_request.message
+    mood_events = None
+    
+    if access_token and state.health_monitor.ready:
+        with metrics.stage("history"):
+            history = state.conversation_store.get_history(user_id) + [{"role": "user", "content": user_message}]
+        try:
+            # Admission is decided here, while a 429 can still be sent, and only
+            # for messages the classifier and the cache cannot answer
+            mood_events = state.llm_manager.stream_conversation_mood(history, user_message, user_id)
+        except QueueFullError as e:
+            return busy_response(e)
+    
+    async def event_stream():
+        if not access_token:
+            yield format_sse("session_expired", {"text": SESSION_EXPIRED_MESSAGE})
+            yield format_sse("done", {})
+            return
+        
+        try:
+            if mood_events is None:
+                yield format_sse("token", {"text": f"The AI model is not loaded yet. Please run: `ollama pull {state.llm_manager.model}`"})
+                yield format_sse("done", {})
+                return
+            
+            with metrics.stage("history"):
+                state.conversation_store.add_message(user_id, "user", user_message)
+            
+            streamed_text = []
+            mood_analysis = {}
+            async with budget("mood_analysis"):
+                with metrics.stage("mood_analysis"):
+                    async for event in mood_events:
+                        if event["event"] == "thinking":
+                            yield format_sse("thinking", {})
+                        elif event["event"] == "token":
+                            streamed_text.append(event["text"])
+                            yield format_sse("token", {"text": event["text"]})
+                        elif event["event"] == "analysis":
+                            mood_analysis = event["result"]
+            
+            response_text = "".join(streamed_text)
+            if not response_text:
+                # Nothing could be streamed (e.g. unparseable output), send the final reply at once
+                response_text = mood_analysis.get("response", "")
+                yield format_sse("token", {"text": response_text})
+            
+            state.conversation_store.add_message(user_id, "assistant", response_text)
+            
+            if mood_analysis.get("wants_recommendations", False):
+                async with budget("recommendations"):
+                    music_recommendations = await get_music_recommendations(
+                        state.recommender, access_token, mood_analysis, spotify_user_id
+                    )
+                yield format_sse("recommendations", music_recommendations)
+            
+            yield format_sse("done", {})
+        except QueueFullError as e:
+            # Filled up between the admission check and the generation
+            yield format_sse("error", {
+                "text": f"I'm handling a lot of requests right now. Please try again in {e.retry_after:.0f} seconds.",
+                "retry_after": e.retry_after,
+                "queue_position": e.queue_position
+            })
+        except SpotifyAuthError:
+            # Headers are already sent, so the client logs out to clear the cookie
+            state.token_manager.forget(token_key)
+            yield format_sse("session_expired", {"text": SESSION_EXPIRED_MESSAGE})
+        except DeadlineExceeded as e:
+            record_timed_out("/api/stream_message", e)
+            yield format_sse("error", {"text": TIMED_OUT_MESSAGE})
+        except Exception as e:
+            logger.error(f"Error streaming message: {e}")
+            yield format_sse("error", {"text": f"An error occurred: {str(e)}"})
+    
+    return StreamingResponse(
+        stream_until_disconnected(request, event_stream(), "/api/stream_message"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/health")
+async def health(request: Request):
+    """
+    Cached model readiness, suitable for load balancer health checks
+    """
+    state = request.app.state
+    status_code = 200 if state.health_monitor.ready else 503
+    return JSONResponse(
+        {**state.health_monitor.as_dict(), "scheduler": state.llm_manager.scheduler.stats()},
+        status_code=status_code
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/api/clear_history")
 async def clear_history(request: Request):
-    user_id = request.session.get('access_token', 'anonymous')
-    conversation_store.clear_history(user_id)
+    state = request.app.state
+    user_id = get_conversation_id(request) or 'anonymous'
+    state.conversation_store.clear_history(user_id)
     return {"success": True}
 
 @app.get("/logout")
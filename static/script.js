@@ -43,65 +43,91 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show typing indicator
         const typingIndicator = addTypingIndicator();
         
-        // Send message to server
-        fetch('/api/send_message', {
+        // Stream the reply from the server as server-sent events
+        let paragraph = null;
+        let recommendations = null;
+        
+        function ensureAssistantMessage() {
+            if (!paragraph) {
+                typingIndicator.remove();
+                paragraph = addMessage('', 'assistant');
+            }
+            return paragraph;
+        }
+        
+        function handleEvent(event, data) {
+            if (event === 'token') {
+                ensureAssistantMessage().textContent += data.text;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'recommendations') {
+                recommendations = data;
+            } else if (event === 'error') {
+                ensureAssistantMessage().textContent = data.text;
+            } else if (event === 'session_expired') {
+                // The stream cannot clear the session cookie itself: log out to do so
+                ensureAssistantMessage().textContent = data.text;
+                setTimeout(() => {
+                    window.location.href = '/logout';
+                }, 1500);
+            }
+        }
+        
+        fetch('/api/stream_message', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
             },
             body: JSON.stringify({ message: message }),
         })
-        .then(response => {
-            if (!response.ok) {
+        .then(async response => {
+            if (response.status === 429) {
+                // Server is at capacity: show its retry hint instead of a generic error
+                const data = await response.json();
+                handleEvent('error', { text: data.response });
+                return;
+            }
+            if (!response.ok || !response.body) {
                 throw new Error('Network response was not ok');
             }
-            return response.json();
-        })
-        .then(data => {
-            // Remove typing indicator
-            typingIndicator.remove();
             
-            if (data.response) {
-                if (data.animate) {
-                    // Create message placeholder
-                    const messageDiv = document.createElement('div');
-                    messageDiv.className = 'message assistant';
-                    
-                    const contentDiv = document.createElement('div');
-                    contentDiv.className = 'message-content';
-                    
-                    const paragraph = document.createElement('p');
-                    paragraph.textContent = '';  // Start empty
-                    
-                    contentDiv.appendChild(paragraph);
-                    messageDiv.appendChild(contentDiv);
-                    chatMessages.appendChild(messageDiv);
-                    
-                    // Animate the text appearing character by character
-                    const fullResponse = data.response;
-                    let charIndex = 0;
-                    const typingSpeed = 20; // milliseconds per character
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                
+                // Frames are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
                     
-                    function typeNextChar() {
-                        if (charIndex < fullResponse.length) {
-                            paragraph.textContent += fullResponse.charAt(charIndex);
-                            charIndex++;
-                            chatMessages.scrollTop = chatMessages.scrollHeight;
-                            setTimeout(typeNextChar, typingSpeed);
+                    let event = 'message';
+                    let data = '';
+                    frame.split('\n').forEach(line => {
+                        if (line.startsWith('event: ')) {
+                            event = line.slice(7);
+                        } else if (line.startsWith('data: ')) {
+                            data += line.slice(6);
                         }
-                    }
-                    
-                    typeNextChar();
-                } else {
-                    // Add assistant message to chat (no animation)
-                    addMessage(data.response, 'assistant');
+                    });
+                    handleEvent(event, data ? JSON.parse(data) : {});
                 }
             }
+        })
+        .then(() => {
+            if (!paragraph) {
+                typingIndicator.remove();
+            }
             
             // If music recommendations are included, display them
-            if (data.music_recommendations) {
+            if (recommendations) {
                 setTimeout(() => {
-                    displayMusicRecommendations(data.music_recommendations);
+                    displayMusicRecommendations(recommendations);
                 }, 500);
             }
             
@@ -152,6 +178,8 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Scroll to bottom
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        
+        return paragraph;
     }
     
     // Helper function to add typing indicator
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from backend.cache import TTLCache
+
+def test_failed_load_is_not_cached():
+    calls = []
+
+    async def loader():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("upstream down")
+        return "value"
+
+    async def run():
+        cache = TTLCache()
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("key", loader)
+        assert cache.get("key") is None
+        assert await cache.get_or_load("key", loader) == "value"
+        return cache
+
+    cache = asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.stats()["inflight"] == 0
+
+def test_concurrent_misses_share_one_load():
+    calls = []
+
+    async def loader():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        cache = TTLCache()
+        results = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+        return cache, results
+
+    cache, results = asyncio.run(run())
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+def test_cancelled_caller_does_not_cancel_the_shared_load():
+    async def loader():
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        cache = TTLCache()
+        first = asyncio.create_task(cache.get_or_load("key", loader))
+        second = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        return cache, await second
+
+    cache, value = asyncio.run(run())
+    assert value == "value"
+    assert cache.get("key") == "value"
+
+def test_stale_value_is_served_while_reloading():
+    values = iter(["old", "new"])
+
+    async def loader():
+        return next(values)
+
+    async def run():
+        cache = TTLCache(ttl=0.0, stale_ttl=60.0)
+        assert await cache.get_or_load("key", loader) == "old"
+        stale = await cache.get_or_load("key", loader)
+        await asyncio.sleep(0)
+        return cache, stale
+
+    cache, stale = asyncio.run(run())
+    assert stale == "old"
+    assert cache.get("key") == "new"
+    assert cache.stale_hits == 1
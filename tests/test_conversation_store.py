@@ -0,0 +1,58 @@
+import pytest
+
+from backend.conversation_store import SQLiteConversationBackend
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteConversationBackend(str(tmp_path / "conversations.db"), max_turns=4)
+    yield backend
+    backend.close()
+
+def contents(history):
+    return [message["content"] for message in history]
+
+def test_pending_writes_are_read_back_in_order(backend):
+    for content in ("a", "b", "c"):
+        backend.add_message("u", "user", content)
+    assert contents(backend.get_history("u")) == ["a", "b", "c"]
+    backend.flush()
+    assert contents(backend.get_history("u")) == ["a", "b", "c"]
+    assert backend.stats()["pending_writes"] == 0
+
+def test_history_is_trimmed_to_max_turns(backend):
+    for index in range(6):
+        backend.add_message("u", "user", f"m{index}")
+    backend.flush()
+    assert contents(backend.get_history("u")) == ["m2", "m3", "m4", "m5"]
+    assert contents(backend.get_history("u", limit=2)) == ["m4", "m5"]
+    assert backend.stats()["messages"] == 4
+
+def test_entries_committed_during_a_read_are_not_repeated(backend, monkeypatch):
+    # Leave committed entries in the overlay, as a reader that copied it
+    # just before the writer committed would see them
+    monkeypatch.setattr(backend, "_settle", lambda writes: None)
+    for index in range(6):
+        backend.add_message("u", "user", f"m{index}")
+    backend.flush()
+    assert contents(backend.get_history("u")) == ["m2", "m3", "m4", "m5"]
+    assert contents(backend.get_history("u", limit=2)) == ["m4", "m5"]
+
+def test_clear_is_ordered_with_queued_writes(backend):
+    backend.add_message("u", "user", "a")
+    backend.flush()
+    backend.add_message("u", "user", "b")
+    backend.clear_history("u")
+    assert backend.get_history("u") == []
+    backend.add_message("u", "user", "c")
+    assert contents(backend.get_history("u")) == ["c"]
+    backend.flush()
+    assert contents(backend.get_history("u")) == ["c"]
+    assert backend.stats()["messages"] == 1
+
+def test_users_are_kept_apart(backend):
+    backend.add_message("u", "user", "for u")
+    backend.add_message("v", "user", "for v")
+    backend.clear_history("v")
+    backend.flush()
+    assert contents(backend.get_history("u")) == ["for u"]
+    assert backend.get_history("v") == []
@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import httpx
+
+from backend.llm_manager import AsyncLLMManager
+
+PAYLOAD = {"model": "test", "messages": [], "stream": True}
+
+class FakeStream(httpx.AsyncByteStream):
+    """
+    Ollama-style NDJSON chat stream that records when it is closed
+    """
+    def __init__(self, words, first_delay: float = 0.0, word_delay: float = 0.0):
+        self.words = words
+        self.first_delay = first_delay
+        self.word_delay = word_delay
+        self.closed = False
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.first_delay)
+        for word in self.words:
+            yield (json.dumps({"message": {"content": word}, "done": False}) + "\n").encode()
+            await asyncio.sleep(self.word_delay)
+        yield (json.dumps({"done": True, "eval_count": len(self.words)}) + "\n").encode()
+
+    async def aclose(self):
+        self.closed = True
+
+def make_manager(handler, endpoints=("http://a", "http://b"), hedge=True) -> AsyncLLMManager:
+    manager = AsyncLLMManager(endpoints=list(endpoints), hedge=hedge)
+    manager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return manager
+
+def host(request: httpx.Request) -> str:
+    return request.url.host
+
+async def consume(manager: AsyncLLMManager):
+    return [content async for content in manager._iter_stream_content(PAYLOAD)]
+
+def in_flight(manager: AsyncLLMManager):
+    return [endpoint.in_flight for endpoint in manager.pool]
+
+def test_losing_hedge_releases_its_stream():
+    streams = {}
+
+    async def handler(request):
+        # a answers the headers but stalls before its first line; b is fast
+        stream = FakeStream(["hello"], first_delay=5.0 if host(request) == "a" else 0.0)
+        streams[host(request)] = stream
+        return httpx.Response(200, stream=stream)
+
+    async def run():
+        manager = make_manager(handler)
+        manager.pool.min_samples = 1
+        manager.pool.min_hedge_delay = 0.05
+        for endpoint in manager.pool:
+            endpoint.observe(0.01)
+        words = await consume(manager)
+        await asyncio.sleep(0)
+        return manager, words
+
+    manager, words = asyncio.run(run())
+    assert words == ["hello"]
+    assert manager.pool.hedged == 1 and manager.pool.hedge_wins == 1
+    assert streams["a"].closed and streams["b"].closed
+    assert in_flight(manager) == [0, 0]
+
+def test_in_flight_returns_to_zero_when_cancelled_mid_stream():
+    stream = FakeStream(["one", "two", "three"], word_delay=5.0)
+
+    async def handler(request):
+        return httpx.Response(200, stream=stream)
+
+    async def run():
+        manager = make_manager(handler, endpoints=("http://a",))
+        task = asyncio.create_task(consume(manager))
+        await asyncio.sleep(0.05)
+        assert in_flight(manager) == [1]
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return manager
+
+    manager = asyncio.run(run())
+    assert stream.closed
+    assert in_flight(manager) == [0]
+
+def test_in_flight_returns_to_zero_when_cancelled_before_first_line():
+    stream = FakeStream(["late"], first_delay=5.0)
+
+    async def handler(request):
+        return httpx.Response(200, stream=stream)
+
+    async def run():
+        manager = make_manager(handler, endpoints=("http://a",))
+        task = asyncio.create_task(consume(manager))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return manager
+
+    manager = asyncio.run(run())
+    assert stream.closed
+    assert in_flight(manager) == [0]
+
+def test_failover_to_next_endpoint():
+    async def handler(request):
+        if host(request) == "a":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, stream=FakeStream(["from", "b"]))
+
+    async def run():
+        manager = make_manager(handler, hedge=False)
+        return manager, await consume(manager)
+
+    manager, words = asyncio.run(run())
+    a, b = manager.pool
+    assert words == ["from", "b"]
+    assert manager.pool.failovers == 1
+    assert not a.healthy and a.failures == 1
+    assert in_flight(manager) == [0, 0]
+
+def test_every_endpoint_failing_raises_and_releases():
+    async def handler(request):
+        return httpx.Response(500, text="model crashed")
+
+    async def run():
+        manager = make_manager(handler, hedge=False)
+        try:
+            await consume(manager)
+        except httpx.HTTPStatusError:
+            return manager
+        raise AssertionError("expected the last endpoint's error")
+
+    manager = asyncio.run(run())
+    assert manager.pool.failovers == 1
+    assert in_flight(manager) == [0, 0]
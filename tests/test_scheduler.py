@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from backend.scheduler import InferenceScheduler, QueueFullError
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def run():
+        scheduler = InferenceScheduler(max_concurrency=1)
+        await scheduler.acquire("holder")
+        first = asyncio.create_task(scheduler.acquire("a"))
+        second = asyncio.create_task(scheduler.acquire("b"))
+        await settle()
+        assert scheduler.waiting == 2
+
+        # The slot goes to the first waiter, which is cancelled before it runs
+        scheduler.release()
+        first.cancel()
+        await settle()
+
+        assert first.cancelled()
+        assert second.done() and not second.cancelled()
+        assert scheduler.running == 1 and scheduler.waiting == 0
+
+    asyncio.run(run())
+
+def test_cancelled_queued_waiter_leaves_the_queue():
+    async def run():
+        scheduler = InferenceScheduler(max_concurrency=1)
+        await scheduler.acquire("holder")
+        waiter = asyncio.create_task(scheduler.acquire("a"))
+        await settle()
+        waiter.cancel()
+        await settle()
+
+        assert scheduler.waiting == 0 and scheduler.stats()["users_waiting"] == 0
+        scheduler.release()
+        assert scheduler.running == 0
+
+    asyncio.run(run())
+
+def test_waiting_users_are_served_round_robin():
+    async def run():
+        scheduler = InferenceScheduler(max_concurrency=1, max_queue_per_user=3)
+        await scheduler.acquire("holder")
+        served = []
+
+        async def request(user_id):
+            async with scheduler.slot(user_id):
+                served.append(user_id)
+                await asyncio.sleep(0)
+
+        # a queues a burst before b and c send one request each
+        tasks = []
+        for user_id in ("a", "a", "a", "b", "c"):
+            tasks.append(asyncio.create_task(request(user_id)))
+            await settle()
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(run()) == ["a", "b", "c", "a", "a"]
+
+def test_full_queue_rejects_with_retry_after():
+    async def run():
+        scheduler = InferenceScheduler(max_concurrency=1, max_queue=2, max_queue_per_user=1)
+        await scheduler.acquire("holder")
+        waiters = [asyncio.create_task(scheduler.acquire(user_id)) for user_id in ("a", "b")]
+        await settle()
+
+        with pytest.raises(QueueFullError) as rejected:
+            scheduler.check_admission("c")
+        assert rejected.value.retry_after >= 1.0
+        assert rejected.value.queue_position == 3
+
+        for waiter in waiters:
+            waiter.cancel()
+        await settle()
+
+    asyncio.run(run())